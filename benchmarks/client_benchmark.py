@@ -0,0 +1,129 @@
+"""
+End-to-end benchmark of the client hot path against the local stub server (`stub_server.py`).
+
+Drives `TextGenApi.do_call` and `stream_call` against the OpenAI and Anthropic formats, and the retry path against a
+server that rejects a fraction of the requests with 429. The server runs in a subprocess, so the reported CPU time
+per request is the client's alone.
+
+    python benchmarks/client_benchmark.py --requests 1000 --concurrency 16 --latency 0.005
+"""
+
+import argparse
+import dataclasses
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+from llm_utils import (
+    Chat,
+    RetryPolicy,
+    TextGenApi,
+    TextGenLLMConnection,
+    TextGenLLMConnections,
+    TextMessageContent,
+    UserMessage,
+)
+
+STUB_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_server.py")
+
+
+@contextmanager
+def stub_server(*args: str) -> Iterator[int]:
+    """Run the stub server in a subprocess and yield its port."""
+    process = subprocess.Popen([sys.executable, STUB_SERVER, "--port", "0", *args], stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(process.stdout.readline().split()[-1])
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def make_api(port: int, anthropic: bool) -> TextGenApi:
+    connection = TextGenLLMConnection.self_hosted("127.0.0.1", port)
+    if anthropic:
+        # "claude" in the identifier switches the client to the Anthropic format
+        connection = dataclasses.replace(connection, identifier="claude-stub", path="v1/messages")
+    retry_policy = RetryPolicy(max_attempts=20, initial_delay=0.001, max_delay=0.05, circuit_breaker_threshold=None)
+    return TextGenApi(connections=TextGenLLMConnections(connections=[connection]), retry_policy=retry_policy)
+
+
+def run(name: str, api: TextGenApi, call: Callable[[TextGenApi, Chat], None], chats: List[Chat], concurrency: int):
+    call(api, chats[0])  # warm up the connection pool
+    api.usage.reset()
+
+    def timed_call(chat: Chat) -> float:
+        start = time.perf_counter()
+        call(api, chat)
+        return time.perf_counter() - start
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(timed_call, chats))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    api.close()
+
+    assert len(api.usage.calls) == len(chats), "%d of %d calls recorded" % (len(api.usage.calls), len(chats))
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(
+        "%-24s %10.1f %10.2f %10.2f %12.3f" % (name, len(chats) / elapsed, p50 * 1e3, p99 * 1e3, cpu / len(chats) * 1e3)
+    )
+
+
+def do_call(api: TextGenApi, chat: Chat):
+    api.do_call(chat)
+
+
+def stream_call(api: TextGenApi, chat: Chat):
+    stream = api.stream_call(chat)
+    for _ in stream:
+        pass
+    assert stream.message is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--latency", type=float, default=0.0, help="server latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="server generation speed")
+    parser.add_argument("--output-tokens", type=int, default=64)
+    parser.add_argument("--history", type=int, default=10, help="messages per chat")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.2, help="429 rate of the retry scenario")
+    args = parser.parse_args()
+    logging.getLogger("llm_utils").setLevel(logging.ERROR)  # the injected 429s are logged as warnings
+
+    server_args = ["--latency", str(args.latency), "--output-tokens", str(args.output_tokens)]
+    if args.tokens_per_second is not None:
+        server_args += ["--tokens-per-second", str(args.tokens_per_second)]
+    chats = []
+    for i in range(args.requests):
+        chat = Chat(messages=[])
+        for j in range(args.history):
+            chat = chat.add_message(
+                UserMessage(content=TextMessageContent(text="request %d, message %d " % (i, j) * 8))
+            )
+        chats.append(chat)
+
+    print("%-24s %10s %10s %10s %12s" % ("scenario", "req/s", "p50 ms", "p99 ms", "cpu ms/req"))
+    with stub_server(*server_args) as port:
+        run("do_call openai", make_api(port, anthropic=False), do_call, chats, args.concurrency)
+        run("do_call anthropic", make_api(port, anthropic=True), do_call, chats, args.concurrency)
+        run("stream_call openai", make_api(port, anthropic=False), stream_call, chats, args.concurrency)
+        run("stream_call anthropic", make_api(port, anthropic=True), stream_call, chats, args.concurrency)
+    with stub_server(*server_args, "--rate-limit-rate", str(args.rate_limit_rate)) as port:
+        name = "do_call %d%% 429" % round(args.rate_limit_rate * 100)
+        run(name, make_api(port, anthropic=False), do_call, chats, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time regression check.
+
+Runs each scenario in a fresh interpreter, reports its median import time and fails if it loads one of the heavy
+dependencies it must not need, or if `import llm_utils` exceeds `--max-ms`.
+
+    python benchmarks/import_time.py --runs 10 --max-ms 50
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import List, Tuple
+
+HEAVY_MODULES = ("PIL", "tiktoken", "requests", "urllib3", "httpx", "python_utils", "xml")
+
+# name, code, heavy modules it must not load
+SCENARIOS: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("import llm_utils", "import llm_utils", HEAVY_MODULES),
+    (
+        "build a chat",
+        "from llm_utils import Chat, UserMessage, TextMessageContent\n"
+        "chat = Chat(messages=[UserMessage(content=TextMessageContent(text='hi'))]).add_user_text('hello')\n"
+        "chat.to_dict()",
+        HEAVY_MODULES,
+    ),
+    ("usage records", "from llm_utils import Usage, UsageCall", HEAVY_MODULES),
+    (
+        "render a prompt",
+        "from llm_utils import Prompt\nprompt = Prompt('<data><user>{q}</user></data>')\n"
+        "prompt.replace_all(q='hi')\nprompt.to_chat()",
+        ("PIL", "tiktoken", "requests", "urllib3", "httpx"),
+    ),
+    ("api client", "from llm_utils import TextGenApi", ("PIL", "tiktoken")),
+]
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+exec(compile(%r, "<scenario>", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1e3, "modules": sorted({name.split(".")[0] for name in sys.modules})}))
+"""
+
+
+def run_scenario(code: str) -> Tuple[float, List[str]]:
+    process = subprocess.run([sys.executable, "-c", CHILD % code], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError("scenario failed:\n%s\n%s" % (code, process.stderr))
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    return result["ms"], result["modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per scenario")
+    parser.add_argument("--max-ms", type=float, default=None, help="budget for `import llm_utils`")
+    args = parser.parse_args()
+
+    failures = []
+    for name, code, forbidden in SCENARIOS:
+        timings = []
+        loaded = set()
+        for _ in range(args.runs):
+            ms, modules = run_scenario(code)
+            timings.append(ms)
+            loaded |= set(modules) & set(forbidden)
+        median = statistics.median(timings)
+        print("%-18s %8.1f ms %s" % (name, median, ("loads " + ", ".join(sorted(loaded))) if loaded else ""))
+        if loaded:
+            failures.append("%s loads %s" % (name, ", ".join(sorted(loaded))))
+        if name == "import llm_utils" and args.max_ms is not None and median > args.max_ms:
+            failures.append("%s takes %.1f ms, budget is %.1f ms" % (name, median, args.max_ms))
+
+    if failures:
+        print("\n".join(["FAILED"] + failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
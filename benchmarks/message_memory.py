@@ -0,0 +1,97 @@
+"""
+Memory and construction time of messages and usage records.
+
+Compares the slotted, frozen data model against plain dataclasses with a per-instance `__dict__`, which is how
+`Message`, `TextMessageContent` and `UsageCall` used to be defined. The texts are created upfront and shared by both
+variants, so only the overhead of the objects themselves is measured.
+
+    python benchmarks/message_memory.py --n 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from llm_utils import Message, MessageRole, TextMessageContent, UsageCall
+
+
+@dataclass
+class LegacyTextMessageContent:
+    text: str
+
+
+@dataclass
+class LegacyMessage:
+    role: MessageRole
+    content: Tuple[LegacyTextMessageContent, ...]
+
+
+@dataclass
+class LegacyUsageCall:
+    input_tokens: int
+    input_tokens_cached: int
+    output_tokens: int
+    output_tokens_cached: int
+    call_id: Optional[str] = None
+    from_cache: bool = False
+
+
+def measure(build: Callable[[int], object], n: int) -> Tuple[float, float]:
+    """Bytes per object and microseconds per object of building `n` objects."""
+    gc.collect()
+    start = time.perf_counter()
+    objects: List[object] = [build(i) for i in range(n)]
+    elapsed = time.perf_counter() - start
+    del objects
+
+    # timed separately, tracing allocations slows down the construction
+    gc.collect()
+    tracemalloc.start()
+    objects = [build(i) for i in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / n, elapsed / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=200_000, help="objects per variant")
+    args = parser.parse_args()
+
+    texts = ["message %d" % i for i in range(args.n)]
+    call_ids = ["call-%d" % i for i in range(args.n)]
+    cases = [
+        (
+            "message",
+            lambda i: LegacyMessage(role=MessageRole.USER, content=(LegacyTextMessageContent(text=texts[i]),)),
+            lambda i: Message(role=MessageRole.USER, content=(TextMessageContent(text=texts[i]),)),
+        ),
+        (
+            "usage call",
+            lambda i: LegacyUsageCall(
+                input_tokens=i, input_tokens_cached=0, output_tokens=i, output_tokens_cached=0, call_id=call_ids[i]
+            ),
+            lambda i: UsageCall(
+                input_tokens=i, input_tokens_cached=0, output_tokens=i, output_tokens_cached=0, call_id=call_ids[i]
+            ),
+        ),
+    ]
+
+    print("%-12s %-8s %14s %14s" % ("", "", "bytes/object", "us/object"))
+    for name, build_legacy, build_slotted in cases:
+        legacy_size, legacy_time = measure(build_legacy, args.n)
+        slotted_size, slotted_time = measure(build_slotted, args.n)
+        print("%-12s %-8s %14.1f %14.3f" % (name, "dict", legacy_size, legacy_time))
+        print("%-12s %-8s %14.1f %14.3f" % (name, "slots", slotted_size, slotted_time))
+        print(
+            "%-12s %-8s %13.0f%% %13.0f%%"
+            % (name, "saving", 100 * (1 - slotted_size / legacy_size), 100 * (1 - slotted_time / legacy_time))
+        )
+
+
+if __name__ == "__main__":
+    main()
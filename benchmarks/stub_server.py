@@ -0,0 +1,393 @@
+"""
+Local stub of the OpenAI `v1/chat/completions` and Anthropic `v1/messages` endpoints.
+
+Answers every request with `--output-tokens` generated words, as a single JSON response or as an SSE stream in the
+format of the endpoint. Latency, generation speed and rate limiting are configurable, so client behavior can be
+measured without network access or API keys.
+
+Also stands in for the batch endpoints (`v1/files`, `v1/batches` and `v1/messages/batches`). A batch finishes
+`--batch-delay` seconds after it was created, requests hit by the rate limit rate fail with 429 in its results.
+
+    python benchmarks/stub_server.py --port 8000 --latency 0.05 --tokens-per-second 200 --rate-limit-rate 0.1
+"""
+
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.0  # seconds until the response starts (the first token when streaming)
+    tokens_per_second: Optional[float] = None  # generation speed after the first token, None = instantly
+    output_tokens: int = 64
+    rate_limit_rate: float = 0.0  # fraction of requests rejected with 429
+    retry_after: float = 0.01  # `Retry-After` seconds sent with a 429
+    batch_delay: float = 0.0  # seconds until a batch finishes
+    seed: int = 0
+
+
+@dataclass
+class _StubBatch:
+    id: str
+    anthropic: bool
+    created: float
+    results: List[dict]
+    input_file_id: Optional[str] = None
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, config: Optional[StubConfig] = None):
+        self.config = config if config is not None else StubConfig()
+        self.n_requests = 0
+        self.n_rate_limited = 0
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, _StubBatch] = {}
+        self._ids = itertools.count()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", port), _StubHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "StubLLMServer":
+        """Serve on a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def next_request_rate_limited(self) -> bool:
+        with self._lock:
+            self.n_requests += 1
+            rate_limited = self._random.random() < self.config.rate_limit_rate
+            if rate_limited:
+                self.n_rate_limited += 1
+            return rate_limited
+
+    def next_id(self, prefix: str) -> str:
+        with self._lock:
+            return "%s_stub%d" % (prefix, next(self._ids))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+    disable_nagle_algorithm = True
+    server: StubLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        raw_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.rstrip("/")
+        if path.endswith("v1/files"):
+            self._upload_file(raw_body)
+            return
+        if path.endswith("v1/batches"):
+            self._create_openai_batch(json.loads(raw_body))
+            return
+        if path.endswith("v1/messages/batches"):
+            self._create_anthropic_batch(json.loads(raw_body))
+            return
+        body = json.loads(raw_body or b"{}")
+        anthropic = path.endswith("v1/messages")
+        if not anthropic and not path.endswith("v1/chat/completions"):
+            self._send_json(404, {"error": {"message": "unknown path %s" % self.path}})
+            return
+        config = self.server.config
+        if self.server.next_request_rate_limited():
+            self._send_json(
+                429, {"error": {"type": "rate_limit_error"}}, headers=(("Retry-After", str(config.retry_after)),)
+            )
+            return
+
+        tokens = ["tok%d " % i for i in range(config.output_tokens)]
+        if body.get("stream"):
+            # like OpenAI, usage is only sent at the end of a stream if it was asked for
+            include_usage = anthropic or (body.get("stream_options") or {}).get("include_usage", False)
+            self._send_stream(anthropic, tokens, _input_tokens(body), include_usage)
+            return
+        started = time.monotonic()
+        _sleep_until(started + config.latency + self._generation_time(len(tokens)))
+        self._send_json(200, _completion(body, tokens, anthropic))
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in self.server.files:
+            self._send_bytes(200, self.server.files[parts[-2]], "application/octet-stream")
+        elif len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.server.batches:
+            self._send_json(200, self._batch_state(self.server.batches[parts[-1]]))
+        elif len(parts) >= 3 and parts[-3] == "batches" and parts[-1] == "results" and parts[-2] in self.server.batches:
+            batch = self.server.batches[parts[-2]]
+            if not self._batch_finished(batch):
+                self._send_json(404, {"error": {"message": "batch %s is still processing" % batch.id}})
+                return
+            results = b"".join(json.dumps(result).encode("utf-8") + b"\n" for result in batch.results)
+            self._send_bytes(200, results, "application/x-jsonl")
+        else:
+            self._send_json(404, {"error": {"message": "unknown path %s" % self.path}})
+
+    def _upload_file(self, raw_body: bytes):
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            b"Content-Type: %s\r\n\r\n" % self.headers.get("Content-Type", "").encode("latin-1") + raw_body
+        )
+        content = next(
+            (
+                part.get_payload(decode=True)
+                for part in message.iter_parts()
+                if part.get_param("name", header="content-disposition") == "file"
+            ),
+            None,
+        )
+        if content is None:
+            self._send_json(400, {"error": {"message": "missing file"}})
+            return
+        file_id = self.server.next_id("file")
+        self.server.files[file_id] = content
+        self._send_json(200, {"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch"})
+
+    def _create_openai_batch(self, body: dict):
+        content = self.server.files.get(body.get("input_file_id"))
+        if content is None:
+            self._send_json(404, {"error": {"message": "unknown file %s" % body.get("input_file_id")}})
+            return
+        tokens = ["tok%d " % i for i in range(self.server.config.output_tokens)]
+        results = []
+        for line in content.splitlines():
+            request = json.loads(line)
+            if self.server.next_request_rate_limited():
+                response = {"status_code": 429, "body": {"error": {"type": "rate_limit_error"}}}
+            else:
+                response = {"status_code": 200, "body": _completion(request["body"], tokens, anthropic=False)}
+            results.append(
+                {"id": "batch_req_stub", "custom_id": request["custom_id"], "response": response, "error": None}
+            )
+        batch = _StubBatch(
+            id=self.server.next_id("batch"),
+            anthropic=False,
+            created=time.monotonic(),
+            results=results,
+            input_file_id=body["input_file_id"],
+        )
+        succeeded = [r for r in results if r["response"]["status_code"] == 200]
+        failed = [r for r in results if r["response"]["status_code"] != 200]
+        for name, records in (("output_file_id", succeeded), ("error_file_id", failed)):
+            if len(records) > 0:
+                file_id = self.server.next_id("file")
+                self.server.files[file_id] = b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records)
+                setattr(batch, name, file_id)
+        self.server.batches[batch.id] = batch
+        self._send_json(200, self._batch_state(batch))
+
+    def _create_anthropic_batch(self, body: dict):
+        tokens = ["tok%d " % i for i in range(self.server.config.output_tokens)]
+        results = []
+        for request in body.get("requests", []):
+            if self.server.next_request_rate_limited():
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "rate_limit_error"}}}
+            else:
+                result = {"type": "succeeded", "message": _completion(request["params"], tokens, anthropic=True)}
+            results.append({"custom_id": request["custom_id"], "result": result})
+        batch = _StubBatch(
+            id=self.server.next_id("msgbatch"), anthropic=True, created=time.monotonic(), results=results
+        )
+        self.server.batches[batch.id] = batch
+        self._send_json(200, self._batch_state(batch))
+
+    def _batch_finished(self, batch: _StubBatch) -> bool:
+        return time.monotonic() >= batch.created + self.server.config.batch_delay
+
+    def _batch_state(self, batch: _StubBatch) -> dict:
+        finished = self._batch_finished(batch)
+        if batch.anthropic:
+            errored = sum(r["result"]["type"] != "succeeded" for r in batch.results)
+            return {
+                "id": batch.id,
+                "type": "message_batch",
+                "processing_status": "ended" if finished else "in_progress",
+                "request_counts": {
+                    "processing": 0 if finished else len(batch.results),
+                    "succeeded": len(batch.results) - errored if finished else 0,
+                    "errored": errored if finished else 0,
+                    "canceled": 0,
+                    "expired": 0,
+                },
+                "results_url": (
+                    "http://127.0.0.1:%d/v1/messages/batches/%s/results" % (self.server.port, batch.id)
+                    if finished
+                    else None
+                ),
+            }
+        failed = sum(r["response"]["status_code"] != 200 for r in batch.results)
+        return {
+            "id": batch.id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": batch.input_file_id,
+            "completion_window": "24h",
+            "status": "completed" if finished else "in_progress",
+            "output_file_id": batch.output_file_id if finished else None,
+            "error_file_id": batch.error_file_id if finished else None,
+            "request_counts": {
+                "total": len(batch.results),
+                "completed": len(batch.results) - failed if finished else 0,
+                "failed": failed if finished else 0,
+            },
+        }
+
+    def _generation_time(self, n_tokens: int) -> float:
+        tokens_per_second = self.server.config.tokens_per_second
+        return n_tokens / tokens_per_second if tokens_per_second else 0.0
+
+    def _send_json(self, status: int, data: dict, headers: Tuple[Tuple[str, str], ...] = ()):
+        self._send_bytes(status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+    def _send_bytes(self, status: int, content: bytes, content_type: str, headers: Tuple[Tuple[str, str], ...] = ()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_stream(self, anthropic: bool, tokens: list, input_tokens: int, include_usage: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.monotonic() + self.server.config.latency
+        if anthropic:
+            events = _anthropic_events(tokens, input_tokens)
+        else:
+            events = _openai_events(tokens, input_tokens, include_usage)
+        for i, event in events:
+            _sleep_until(started + self._generation_time(i))
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _input_tokens(body: dict) -> int:
+    return sum(len(_message_text(message).split()) for message in body.get("messages", []))
+
+
+def _completion(body: dict, tokens: list, anthropic: bool) -> dict:
+    input_tokens = _input_tokens(body)
+    text = "".join(tokens)
+    if anthropic:
+        return {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens)},
+        }
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": input_tokens + len(tokens),
+        },
+    }
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return " ".join(item.get("text", "") for item in content if isinstance(item, dict))
+
+
+def _sse(data: dict, event: Optional[str] = None) -> bytes:
+    prefix = b"event: %s\n" % event.encode("utf-8") if event is not None else b""
+    return prefix + b"data: " + json.dumps(data).encode("utf-8") + b"\n\n"
+
+
+def _openai_events(tokens: list, input_tokens: int, include_usage: bool) -> Iterator[Tuple[int, bytes]]:
+    """SSE events with the number of tokens generated before they are sent."""
+    for i, token in enumerate(tokens):
+        yield i, _sse({"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}}]})
+    if include_usage:
+        usage = {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": input_tokens + len(tokens),
+        }
+        yield len(tokens), _sse({"object": "chat.completion.chunk", "choices": [], "usage": usage})
+    yield len(tokens), b"data: [DONE]\n\n"
+
+
+def _anthropic_events(tokens: list, input_tokens: int) -> Iterator[Tuple[int, bytes]]:
+    message = {"id": "msg_stub", "type": "message", "role": "assistant", "content": []}
+    message["usage"] = {"input_tokens": input_tokens, "output_tokens": 1}
+    yield 0, _sse({"type": "message_start", "message": message}, event="message_start")
+    yield 0, _sse(
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        event="content_block_start",
+    )
+    for i, token in enumerate(tokens):
+        delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}}
+        yield i, _sse(delta, event="content_block_delta")
+    yield len(tokens), _sse({"type": "content_block_stop", "index": 0}, event="content_block_stop")
+    yield len(tokens), _sse(
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(tokens)}},
+        event="message_delta",
+    )
+    yield len(tokens), _sse({"type": "message_stop"}, event="message_stop")
+
+
+def _sleep_until(deadline: float):
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--output-tokens", type=int, default=64)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.01)
+    parser.add_argument("--batch-delay", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        batch_delay=args.batch_delay,
+        seed=args.seed,
+    )
+    server = StubLLMServer(port=args.port, config=config)
+    print("listening on %d" % server.port, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
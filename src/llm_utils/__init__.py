@@ -1,20 +1,94 @@
-from .openai_api import (
-    AssistantMessage,
-    Chat,
-    ChatFactory,
-    ImageMessageContent,
-    Message,
-    MessageContent,
-    MessageContentFactory,
-    MessageContentType,
-    MessageFactory,
-    MessageRole,
-    SystemMessage,
-    TextMessageContent,
-    UserMessage,
+from typing import TYPE_CHECKING
+
+from llm_utils._lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .openai_api import (
+        AssistantMessage,
+        Chat,
+        ChatFactory,
+        ImageMessageContent,
+        Message,
+        MessageContent,
+        MessageContentFactory,
+        MessageContentType,
+        MessageFactory,
+        MessageRole,
+        MessageSequence,
+        SystemMessage,
+        TextMessageContent,
+        UserMessage,
+    )
+    from .prompt_generation import CompiledPrompt, Prompt
+    from .textgen_api import (
+        AsyncTextGenStream,
+        BatchJob,
+        BatchResult,
+        CallMetrics,
+        CircuitOpenError,
+        ConnectionRouter,
+        HedgePolicy,
+        HistogramSnapshot,
+        JSONItemParser,
+        MetricsRegistry,
+        ResponseCache,
+        RetryPolicy,
+        StopCondition,
+        TextGenApi,
+        TextGenApiError,
+        TextGenLLMConnection,
+        TextGenLLMConnections,
+        TextGenStream,
+        Usage,
+        UsageCall,
+        UsageLog,
+        XMLItemParser,
+    )
+
+# imported on first access, `import llm_utils` does not load any of the subpackages
+__getattr__, __dir__ = lazy_attributes(
+    __name__,
+    {
+        "AssistantMessage": ".openai_api",
+        "Chat": ".openai_api",
+        "ChatFactory": ".openai_api",
+        "ImageMessageContent": ".openai_api",
+        "Message": ".openai_api",
+        "MessageContent": ".openai_api",
+        "MessageContentFactory": ".openai_api",
+        "MessageContentType": ".openai_api",
+        "MessageFactory": ".openai_api",
+        "MessageRole": ".openai_api",
+        "MessageSequence": ".openai_api",
+        "SystemMessage": ".openai_api",
+        "TextMessageContent": ".openai_api",
+        "UserMessage": ".openai_api",
+        "CompiledPrompt": ".prompt_generation",
+        "Prompt": ".prompt_generation",
+        "AsyncTextGenStream": ".textgen_api",
+        "BatchJob": ".textgen_api",
+        "BatchResult": ".textgen_api",
+        "CallMetrics": ".textgen_api",
+        "CircuitOpenError": ".textgen_api",
+        "ConnectionRouter": ".textgen_api",
+        "HedgePolicy": ".textgen_api",
+        "HistogramSnapshot": ".textgen_api",
+        "JSONItemParser": ".textgen_api",
+        "MetricsRegistry": ".textgen_api",
+        "ResponseCache": ".textgen_api",
+        "RetryPolicy": ".textgen_api",
+        "StopCondition": ".textgen_api",
+        "TextGenApi": ".textgen_api",
+        "TextGenApiError": ".textgen_api",
+        "TextGenLLMConnection": ".textgen_api",
+        "TextGenLLMConnections": ".textgen_api",
+        "TextGenStream": ".textgen_api",
+        "Usage": ".textgen_api",
+        "UsageCall": ".textgen_api",
+        "UsageLog": ".textgen_api",
+        "XMLItemParser": ".textgen_api",
+    },
 )
-from .prompt_generation import Prompt
-from .textgen_api import TextGenApi, TextGenLLMConnection, TextGenLLMConnections
 
 __all__ = (
     "AssistantMessage",
@@ -26,12 +100,33 @@ __all__ = (
     "MessageContent",
     "MessageFactory",
     "MessageRole",
+    "MessageSequence",
     "Message",
     "SystemMessage",
     "TextMessageContent",
     "UserMessage",
+    "CompiledPrompt",
     "Prompt",
+    "AsyncTextGenStream",
+    "BatchJob",
+    "BatchResult",
+    "CallMetrics",
+    "CircuitOpenError",
+    "ConnectionRouter",
+    "HedgePolicy",
+    "HistogramSnapshot",
+    "JSONItemParser",
+    "MetricsRegistry",
+    "ResponseCache",
+    "RetryPolicy",
+    "StopCondition",
     "TextGenApi",
+    "TextGenApiError",
     "TextGenLLMConnection",
     "TextGenLLMConnections",
+    "TextGenStream",
+    "Usage",
+    "UsageCall",
+    "UsageLog",
+    "XMLItemParser",
 )
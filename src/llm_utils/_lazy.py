@@ -0,0 +1,29 @@
+import importlib
+import sys
+from typing import Callable, Dict, List, Tuple
+
+
+def lazy_attributes(package_name: str, attributes: Dict[str, str]) -> Tuple[Callable, Callable[[], List[str]]]:
+    """
+    Module `__getattr__` and `__dir__` (PEP 562) for a package whose public attributes are imported on first access.
+
+    Args:
+        package_name: `__name__` of the package
+        attributes: public attribute name -> relative name of the module defining it
+
+    Returns:
+        `__getattr__` and `__dir__` to assign in the package's `__init__`
+    """
+
+    def __getattr__(name: str):
+        module_name = attributes.get(name)
+        if module_name is None:
+            raise AttributeError("module %r has no attribute %r" % (package_name, name))
+        value = getattr(importlib.import_module(module_name, package_name), name)
+        setattr(sys.modules[package_name], name, value)  # later lookups do not reach __getattr__
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(set(vars(sys.modules[package_name])) | set(attributes))
+
+    return __getattr__, __dir__
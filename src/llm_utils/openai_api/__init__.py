@@ -1,16 +1,43 @@
-from .assistant_message import AssistantMessage
-from .chat import Chat
-from .chat_factory import ChatFactory
-from .image_message_content import ImageMessageContent
-from .message import Message
-from .message_content import MessageContent
-from .message_content_factory import MessageContentFactory
-from .message_content_type import MessageContentType
-from .message_factory import MessageFactory
-from .message_role import MessageRole
-from .system_message import SystemMessage
-from .text_message_content import TextMessageContent
-from .user_message import UserMessage
+from typing import TYPE_CHECKING
+
+from llm_utils._lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .assistant_message import AssistantMessage
+    from .chat import Chat
+    from .chat_factory import ChatFactory
+    from .image_message_content import ImageMessageContent
+    from .message import Message
+    from .message_content import MessageContent
+    from .message_content_factory import MessageContentFactory
+    from .message_content_type import MessageContentType
+    from .message_factory import MessageFactory
+    from .message_role import MessageRole
+    from .message_sequence import MessageSequence
+    from .system_message import SystemMessage
+    from .text_message_content import TextMessageContent
+    from .user_message import UserMessage
+
+# imported on first access, so that e.g. building a chat does not load PIL or xml
+__getattr__, __dir__ = lazy_attributes(
+    __name__,
+    {
+        "AssistantMessage": ".assistant_message",
+        "Chat": ".chat",
+        "ChatFactory": ".chat_factory",
+        "ImageMessageContent": ".image_message_content",
+        "Message": ".message",
+        "MessageContent": ".message_content",
+        "MessageContentFactory": ".message_content_factory",
+        "MessageContentType": ".message_content_type",
+        "MessageFactory": ".message_factory",
+        "MessageRole": ".message_role",
+        "MessageSequence": ".message_sequence",
+        "SystemMessage": ".system_message",
+        "TextMessageContent": ".text_message_content",
+        "UserMessage": ".user_message",
+    },
+)
 
 __all__ = (
     "AssistantMessage",
@@ -22,6 +49,7 @@ __all__ = (
     "MessageContent",
     "MessageFactory",
     "MessageRole",
+    "MessageSequence",
     "Message",
     "SystemMessage",
     "TextMessageContent",
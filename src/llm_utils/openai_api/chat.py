@@ -1,39 +1,75 @@
+import copy
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Union
-from python_utils.communication_utils.utils.parsing_utils import obj_to_xml
+from typing import Dict, List, Optional, Sequence, Union
 
 from llm_utils.openai_api.message import Message
 from llm_utils.openai_api.message_role import MessageRole
+from llm_utils.openai_api.message_sequence import MessageSequence
 from llm_utils.openai_api.text_message_content import TextMessageContent
 
 
 @dataclass
 class Chat:
-    messages: List[Message]
+    # any sequence is accepted and stored as MessageSequence, which shares the history with the chat it extends
+    messages: Sequence[Message]
 
-    def to_dict(self, cache: bool = False) -> Dict:
-        response = []
-        n_cached = 0
-        for message in self.messages:
-            cache = False
-            if n_cached < 4:
-                cache = message.role == MessageRole.ASSISTANT
-                if cache:
-                    n_cached += 1
-
-            response.append(message.to_dict(cache=cache))
-        return response
+    def __post_init__(self):
+        if not isinstance(self.messages, MessageSequence):
+            self.messages = MessageSequence(self.messages)
+
+    def to_dict(self, cache: bool = False, max_cache_breakpoints: int = 4) -> Dict:
+        """With `cache`, prompt cache breakpoints are set on up to `max_cache_breakpoints` messages, see `cache_flags`."""
         return [
-            message.to_dict(cache=cache if i == len(self.messages) - 1 else False)
-            for i, message in enumerate(self.messages)
+            message.to_dict(cache=flag)
+            for message, flag in zip(self.messages, self.cache_flags(cache, max_cache_breakpoints))
         ]
 
+    def to_json_bytes(self, cache: bool = False, max_cache_breakpoints: int = 4) -> bytes:
+        """`to_dict` encoded as JSON, assembled from the memoized encodings of the messages."""
+        return b"[%s]" % b",".join(
+            message.to_json_bytes(cache=flag)
+            for message, flag in zip(self.messages, self.cache_flags(cache, max_cache_breakpoints))
+        )
+
+    def cache_flags(self, cache: bool = True, max_cache_breakpoints: int = 4) -> List[bool]:
+        """
+        Messages that get a prompt cache breakpoint: the system message, the last message and the user messages
+        that ended the previous turns, newest first. A breakpoint caches the whole prefix up to it, so the next turn
+        of the conversation reads the prefix this one wrote, and chats sharing the system prompt read that.
+        """
+        messages = list(self.messages)
+        flags = [False] * len(messages)
+        if not cache or max_cache_breakpoints <= 0 or len(messages) == 0:
+            return flags
+        n_breakpoints = 0
+        if messages[0].role == MessageRole.SYSTEM:
+            flags[0] = True
+            n_breakpoints += 1
+        for i in range(len(messages) - 1, -1, -1):
+            if n_breakpoints >= max_cache_breakpoints:
+                break
+            if flags[i]:
+                continue
+            is_last = i == len(messages) - 1
+            if is_last or (messages[i].role == MessageRole.USER and messages[i + 1].role == MessageRole.ASSISTANT):
+                flags[i] = True
+                n_breakpoints += 1
+        return flags
+
     def to_xml(self) -> Dict:
-        return obj_to_xml(self)
+        from python_utils.communication_utils.utils.parsing_utils import obj_to_xml
+
+        return obj_to_xml(self._materialized())
+
+    def _materialized(self) -> "Chat":
+        """Shallow copy holding the messages in a list, for serializers that only know builtin containers."""
+        chat = copy.copy(self)
+        chat.messages = list(self.messages)
+        return chat
 
     def add_message(self, message: Message) -> "Chat":
         assert isinstance(message, Message)
-        return Chat(messages=self.messages + [message])
+        return Chat(messages=self.messages.appended(message))
 
     def add_user_text(self, text: str) -> "Chat":
         return self.add_message(Message(role=MessageRole.USER, content=[TextMessageContent(text=text)]))
@@ -42,9 +78,13 @@ class Chat:
         return "\n|".join(map(str, self.messages))
 
     def replace(self, needle: str, replacement: str) -> "Chat":
-        return Chat(messages=[m.replace(needle, replacement) for m in self.messages])
+        return self.replace_all({needle: replacement})
+
+    def replace_all(self, replacements: Dict[str, str]) -> "Chat":
+        """Replace all needles (keys) of all messages in a single pass per text."""
+        return Chat(messages=[m.replace_all(replacements) for m in self.messages])
 
-    def copy_with(self, *, messages: Optional[List[Message]] = None) -> "Chat":
+    def copy_with(self, *, messages: Optional[Sequence[Message]] = None) -> "Chat":
         return Chat(messages=messages if messages is not None else self.messages)
 
     def last_message(self) -> str:
@@ -55,17 +95,19 @@ class Chat:
     def replace_last_message(self, text: str) -> "Chat":
         last_message = self.messages[-1]
         assert len(last_message.content) == 1
-        new_messages = self.messages[:-1] + [Message(role=last_message.role, content=[TextMessageContent(text=text)])]
+        new_messages = self.messages.prefix(len(self.messages) - 1).appended(
+            Message(role=last_message.role, content=[TextMessageContent(text=text)])
+        )
         return self.copy_with(messages=new_messages)
 
     @staticmethod
     def concat_chats(chat1: "Chat", chat2: "Chat") -> "Chat":
-        return Chat(messages=chat1.messages + chat2.messages)
+        return Chat(messages=chat1.messages.extended(chat2.messages))
 
     def get_all_after(self, prior_chat: "Chat") -> "Chat":
-        assert all(
-            c_m == p_m for c_m, p_m in zip(self.messages, prior_chat.messages)
-        ), "prior chat is not parent of current chat"
+        # only the common prefix is compared, a prior chat that is longer than this one yields an empty chat
+        n_common = min(len(self.messages), len(prior_chat.messages))
+        assert self.messages.startswith(prior_chat.messages[:n_common]), "prior chat is not parent of current chat"
         return Chat(messages=self.messages[len(prior_chat.messages) :])
 
     def copy_with_system_message_only(self) -> "Chat":
@@ -1,8 +1,6 @@
 import xml.etree.ElementTree as ET
 from typing import Dict, Optional
 
-from python_utils.data_utils import asdict, fromdict
-
 from llm_utils.openai_api.chat import Chat
 from llm_utils.openai_api.message_factory import MessageFactory
 from llm_utils.openai_api.utils import ImageMap
@@ -20,9 +18,13 @@ class ChatFactory:
         return Chat(messages=messages)
 
     def to_json(self, chat: Chat) -> Dict:
-        return asdict(chat)
+        from python_utils.data_utils import asdict
+
+        return asdict(chat._materialized())
 
     def from_json(self, data: Dict) -> "Chat":
+        from python_utils.data_utils import fromdict
+
         if isinstance(data, list):
             data = {"messages": data}
         return fromdict(data, Chat)
@@ -1,30 +1,48 @@
 import base64
+import io
 from dataclasses import dataclass
-from tempfile import NamedTemporaryFile
-from typing import Dict
-
-from PIL import Image
+from typing import TYPE_CHECKING, Dict, Optional
 
+from llm_utils.openai_api.message import _Memoized
 from llm_utils.openai_api.message_content import MessageContent
 from llm_utils.openai_api.message_content_type import MessageContentType
 
+if TYPE_CHECKING:  # the image is only handled through its methods, PIL itself is not needed here
+    from PIL import Image
+
 
-@dataclass
-class ImageMessageContent(MessageContent):
-    image: Image.Image
+@dataclass(frozen=True, slots=True)
+class ImageMessageContent(MessageContent, _Memoized):
+    image: "Image.Image"
+    jpeg_quality: int = 75
+    max_edge_size: Optional[int] = None  # downscale so that the longer edge is at most this many pixels
 
     def to_dict(self) -> Dict:
-        with NamedTemporaryFile(mode="wb", suffix=".jpeg", delete=False) as tf:
+        return {"type": MessageContentType.IMAGE.value, "image_url": {"url": self.data_url}}
+
+    @property
+    def data_url(self) -> str:
+        """The image is encoded once per content object, modifying `image` in place afterwards is not picked up."""
+        memo = self._get_memo()
+        data_url = memo.get("data_url")
+        if data_url is None:
             image_to_save = self.image
-            if image_to_save.mode == "RGBA":
+            if self.max_edge_size is not None and max(image_to_save.size) > self.max_edge_size:
+                image_to_save = image_to_save.copy()
+                image_to_save.thumbnail((self.max_edge_size, self.max_edge_size))
+            if image_to_save.mode not in ("RGB", "L"):
                 image_to_save = image_to_save.convert("RGB")
-            image_to_save.save(tf)
-        with open(tf.name, "rb") as image_file:
-            image_data = "data:image/jpeg;base64,%s" % base64.b64encode(image_file.read()).decode("utf-8")
-        tf.close()
-        return {"type": MessageContentType.IMAGE.value, "image_url": {"url": image_data}}
+            buffer = io.BytesIO()
+            image_to_save.save(buffer, format="JPEG", quality=self.jpeg_quality)
+            data_url = "data:image/jpeg;base64,%s" % base64.b64encode(buffer.getvalue()).decode("ascii")
+            data_url = memo.setdefault("data_url", data_url)
+        return data_url
+
+    def __hash__(self) -> int:
+        # images are unhashable, equal images have equal mode and size
+        return hash((self.image.mode, self.image.size, self.jpeg_quality, self.max_edge_size))
 
-    def replace(self, needle, text):
+    def replace_all(self, replacements: Dict[str, str]) -> "ImageMessageContent":
         return self
 
     def __str__(self) -> str:
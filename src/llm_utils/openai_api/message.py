@@ -1,41 +1,77 @@
+import json
 from dataclasses import dataclass
-
-from python_utils.data_utils import fromdict
+from typing import Dict
 
 from llm_utils.openai_api.message_content import MessageContent
-from llm_utils.openai_api.message_content_factory import MessageContentFactory
 from llm_utils.openai_api.message_role import MessageRole
 
 
-@dataclass
-class Message:
+class _Memoized:
+    """Slot for values derived from a frozen dataclass. It is not a field, so it is neither compared nor serialized."""
+
+    __slots__ = ("_memo",)
+
+    def _get_memo(self) -> dict:
+        try:
+            return self._memo
+        except AttributeError:  # not computed yet, or dropped when copying or pickling
+            object.__setattr__(self, "_memo", {})
+            return self._memo
+
+
+@dataclass(frozen=True, slots=True)
+class Message(_Memoized):
     role: MessageRole
     content: tuple[MessageContent, ...]
 
+    def __post_init__(self):
+        if not isinstance(self.content, tuple):
+            object.__setattr__(self, "content", tuple(self.content))
+
     def to_dict(self, cache: bool = False) -> dict:
-        if len(self.content) == 1:
+        """
+        Wire format of the message, built anew on every call so the caller may modify it.
+        Requests use the memoized `to_json_bytes` instead.
+        """
+        if len(self.content) == 1 and not cache:
             content_dict = self.content[0].to_dict()
             assert content_dict["type"] == "text"
-            if cache:
-                content_dict["cache_control"] = {"type": "ephemeral"}
             content_dict = content_dict["text"]
-            # content_dict = [content_dict]
         else:
-            assert not cache, "unusuported cache for multiple content items"
+            # a cache breakpoint can only be set on a content block, it caches the prefix up to the last block
             content_dict = [content.to_dict() for content in self.content]
+            if cache:
+                content_dict[-1]["cache_control"] = {"type": "ephemeral"}
 
         return {"role": self.role.value, "content": content_dict}
 
+    def to_json_bytes(self, cache: bool = False) -> bytes:
+        """`to_dict` encoded as JSON, to be spliced into a request body."""
+        memo = self._get_memo()
+        encoded = memo.get(("json", cache))
+        if encoded is None:
+            encoded = json.dumps(self.to_dict(cache=cache), ensure_ascii=False).encode("utf-8")
+            encoded = memo.setdefault(("json", cache), encoded)
+        return encoded
+
     def __str__(self) -> str:
         content_repr = [c for cs in self.content for c in str(cs).split("\n")]
         content_repr = "\n    ".join(content_repr)
         return "- %s\n    %s" % (self.role.value, content_repr)
 
     def replace(self, needle: str, text: str) -> "Message":
-        return Message(role=self.role, content=tuple(c.replace(needle, text) for c in self.content))
+        return self.replace_all({needle: text})
+
+    def replace_all(self, replacements: Dict[str, str]) -> "Message":
+        return Message(role=self.role, content=tuple(c.replace_all(replacements) for c in self.content))
 
     @staticmethod
     def from_json(data: dict) -> "Message":
+        # imported here, the factory pulls in xml parsing which building messages does not need
+        from python_utils.data_utils import fromdict
+
+        from llm_utils.openai_api.message_content_factory import MessageContentFactory
+
         if isinstance(data["content"], str):
             data["content"] = [{"text": data["content"]}]
         return Message(
@@ -2,10 +2,14 @@ from dataclasses import dataclass
 from typing import Dict
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MessageContent:
     def to_dict(self) -> Dict:
         raise NotImplementedError()
 
     def replace(self, needle: str, text: str) -> "MessageContent":
+        return self.replace_all({needle: text})
+
+    def replace_all(self, replacements: Dict[str, str]) -> "MessageContent":
+        """Replace all needles (keys) in a single pass, see `prompt_generation.utils.replace_texts`."""
         raise NotImplementedError()
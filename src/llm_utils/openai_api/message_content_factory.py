@@ -1,5 +1,5 @@
 import xml.etree.ElementTree as ET
-from typing import Any
+from typing import Any, Dict
 
 from llm_utils.openai_api.image_message_content import ImageMessageContent
 from llm_utils.openai_api.message_content import MessageContent
@@ -26,10 +26,18 @@ class MessageContentFactory:
             return TextMessageContent.from_string(text=xml.text)
         elif message_type == "image":
             image_id = xml.get("id")
-            return ImageMessageContent(image=images[image_id])
+            return ImageMessageContent(image=images[image_id], **self.image_options(xml))
         else:
             raise NotImplementedError()
 
+    @staticmethod
+    def image_options(xml: ET.Element) -> Dict[str, int]:
+        """
+        Encoding options of an image content, given as attributes,
+        e.g. `<content type="image" id="photo" jpeg_quality="90" max_edge_size="1024"/>`.
+        """
+        return {name: int(xml.get(name)) for name in ("jpeg_quality", "max_edge_size") if xml.get(name) is not None}
+
     def __call__(self, data):
         if "text" in data:
             return TextMessageContent
@@ -0,0 +1,139 @@
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union, overload
+
+from llm_utils.openai_api.message import Message
+
+
+class MessageSequence(Sequence[Message]):
+    """
+    Immutable sequence of messages that shares its prefix with the sequence it was extended from.
+
+    Each sequence holds a pointer to its parent sequence and the messages added on top of it, so extending a
+    conversation by k messages costs O(k), however long it already is. Branches of a conversation share their
+    common history. Length and hash are cached, `startswith` recognizes an ancestor by identity.
+    """
+
+    __slots__ = ("parent", "chunk", "_length", "_hash", "_items")
+
+    def __init__(self, messages: Iterable[Message] = (), parent: Optional["MessageSequence"] = None):
+        if parent is not None and len(parent) == 0:
+            parent = None
+        self.parent = parent
+        self.chunk: Tuple[Message, ...] = tuple(messages)
+        self._length = len(self.chunk) + (len(parent) if parent is not None else 0)
+        self._hash: Optional[int] = None
+        self._items: Optional[Tuple[Message, ...]] = None  # materialized on the first random access
+
+    def appended(self, message: Message) -> "MessageSequence":
+        return MessageSequence((message,), parent=self)
+
+    def extended(self, messages: Iterable[Message]) -> "MessageSequence":
+        if len(self) == 0 and isinstance(messages, MessageSequence):
+            return messages
+        messages = tuple(messages)
+        if len(messages) == 0:
+            return self
+        return MessageSequence(messages, parent=self)
+
+    def prefix(self, length: int) -> "MessageSequence":
+        """The first `length` messages, sharing the structure of this sequence."""
+        assert 0 <= length <= len(self)
+        node = self
+        while node.parent is not None and len(node.parent) >= length:
+            node = node.parent
+        if len(node) == length:
+            return node
+        parent_length = len(node.parent) if node.parent is not None else 0
+        return MessageSequence(node.chunk[: length - parent_length], parent=node.parent)
+
+    def startswith(self, prefix: Sequence[Message]) -> bool:
+        if len(prefix) > len(self):
+            return False
+        if isinstance(prefix, MessageSequence):
+            node = self
+            while node is not None and len(node) >= len(prefix):
+                if node is prefix:
+                    return True
+                node = node.parent
+        return tuple(self.prefix(len(prefix))) == tuple(prefix)
+
+    def __len__(self) -> int:
+        return self._length
+
+    @overload
+    def __getitem__(self, index: int) -> Message: ...
+    @overload
+    def __getitem__(self, index: slice) -> "MessageSequence": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, "MessageSequence"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if start == 0 and step == 1:
+                return self.prefix(max(stop, 0))
+            return MessageSequence(self._materialize()[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        chunk_start = len(self) - len(self.chunk)
+        if index >= chunk_start:
+            return self.chunk[index - chunk_start]
+        return self._materialize()[index]
+
+    def __iter__(self) -> Iterator[Message]:
+        if self._items is not None:
+            return iter(self._items)
+        chunks: List[Tuple[Message, ...]] = []
+        node = self
+        while node is not None:
+            if node._items is not None:
+                chunks.append(node._items)
+                break
+            chunks.append(node.chunk)
+            node = node.parent
+        return (message for chunk in reversed(chunks) for message in chunk)
+
+    def _materialize(self) -> Tuple[Message, ...]:
+        if self._items is None:
+            self._items = tuple(iter(self))
+        return self._items
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            # folded message by message, so the hash does not depend on how the sequence was built
+            pending = []
+            node = self
+            while node is not None and node._hash is None:
+                pending.append(node)
+                node = node.parent
+            value = node._hash if node is not None else 0
+            for node in reversed(pending):
+                for message in node.chunk:
+                    value = hash((value, message))
+                node._hash = value
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+        if isinstance(other, MessageSequence):
+            if len(self) != len(other) or hash(self) != hash(other):
+                return False
+        elif isinstance(other, (list, tuple)):
+            if len(self) != len(other):
+                return False
+        else:
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __add__(self, other: Iterable[Message]) -> "MessageSequence":
+        return self.extended(other)
+
+    def __radd__(self, other: Iterable[Message]) -> "MessageSequence":
+        return MessageSequence(other).extended(self)
+
+    def __reduce__(self):
+        # pickle flat, a deep parent chain would exceed the recursion limit
+        return MessageSequence, (tuple(self),)
+
+    def __repr__(self) -> str:
+        return "MessageSequence(%r)" % (list(self),)
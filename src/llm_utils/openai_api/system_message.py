@@ -6,7 +6,8 @@ from llm_utils.openai_api.message_content import MessageContent
 from llm_utils.openai_api.message_role import MessageRole
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SystemMessage(Message):
     def __init__(self, content: List[MessageContent]):
-        return super().__init__(role=MessageRole.SYSTEM, content=content)
+        # no zero-argument super(), dataclass replaces the class when adding slots
+        return Message.__init__(self, role=MessageRole.SYSTEM, content=content)
@@ -7,7 +7,7 @@ from llm_utils.openai_api.message_content import MessageContent
 from llm_utils.openai_api.message_content_type import MessageContentType
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TextMessageContent(MessageContent):
     text: str
 
@@ -25,9 +25,11 @@ class TextMessageContent(MessageContent):
 
         return TextMessageContent(text=text)
 
-    def replace(self, needle, replacement):
-        text = replace_text(needle=needle, replacement=replacement, text=self.text)
-        return TextMessageContent(text=text)
+    def replace_all(self, replacements: Dict[str, str]) -> "TextMessageContent":
+        # imported here since prompt_generation depends on openai_api
+        from llm_utils.prompt_generation.utils import replace_texts
+
+        return TextMessageContent(text=replace_texts(text=self.text, replacements=replacements))
 
     def __str__(self) -> str:
         return self.text
@@ -6,9 +6,10 @@ from llm_utils.openai_api.message_content import MessageContent
 from llm_utils.openai_api.message_role import MessageRole
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class UserMessage(Message):
     def __init__(self, content: Union[List[MessageContent], MessageContent]):
         if isinstance(content, MessageContent):
             content = [content]
-        return super().__init__(role=MessageRole.USER, content=content)
+        # no zero-argument super(), dataclass replaces the class when adding slots
+        return Message.__init__(self, role=MessageRole.USER, content=content)
@@ -1,5 +1,6 @@
-from typing import Dict
+from typing import TYPE_CHECKING, Dict
 
-from PIL import Image
+if TYPE_CHECKING:  # PIL is only loaded by code that actually handles images
+    from PIL import Image
 
-ImageMap = Dict[str, Image.Image]
+ImageMap = Dict[str, "Image.Image"]
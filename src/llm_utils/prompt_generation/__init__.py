@@ -1,3 +1,12 @@
-from .prompt import Prompt
+from typing import TYPE_CHECKING
 
-__all__ = ("Prompt",)
+from llm_utils._lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .compiled_prompt import CompiledPrompt
+    from .prompt import Prompt
+
+# imported on first access
+__getattr__, __dir__ = lazy_attributes(__name__, {"CompiledPrompt": ".compiled_prompt", "Prompt": ".prompt"})
+
+__all__ = ("CompiledPrompt", "Prompt")
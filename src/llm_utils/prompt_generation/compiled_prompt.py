@@ -0,0 +1,191 @@
+import functools
+import os
+import re
+import textwrap
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from llm_utils.openai_api.chat import Chat
+from llm_utils.openai_api.chat_factory import ChatFactory
+from llm_utils.openai_api.image_message_content import ImageMessageContent
+from llm_utils.openai_api.message import Message
+from llm_utils.openai_api.message_content_factory import MessageContentFactory
+from llm_utils.openai_api.message_role import MessageRole
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.utils import ImageMap
+from llm_utils.prompt_generation.utils import LINE_BREAK_PATTERN, escape_xml, join_indented
+
+PLACEHOLDER_PATTERN = re.compile(r"\{([\w\-\_]+)\}")
+
+
+class _Template:
+    """Text split at its placeholders, rendered with the indentation semantics of `replace_text`."""
+
+    __slots__ = ("literals", "names")
+
+    def __init__(self, text: str):
+        parts = PLACEHOLDER_PATTERN.split(text)
+        self.literals: List[str] = parts[0::2]
+        self.names: List[str] = parts[1::2]
+
+    def render(self, values: Dict[str, str]) -> str:
+        if len(self.names) == 0:
+            return self.literals[0]
+        return join_indented(self.literals, [values.get(name, "{%s}" % name) for name in self.names])
+
+
+def _is_inline(value: Optional[str]) -> bool:
+    """Substituting the value changes neither the lines of a text nor their indentation."""
+    return value is None or (
+        LINE_BREAK_PATTERN.search(value) is None and value[:1] not in (" ", "\t") and len(value.strip()) > 0
+    )
+
+
+class _TextSlot:
+    """Text of a message content with placeholders."""
+
+    __slots__ = ("template", "dedented_template")
+
+    def __init__(self, text: str):
+        self.template = _Template(text)
+        self.dedented_template = _Template(textwrap.dedent(text))
+
+    def render(self, values: Dict[str, str]) -> TextMessageContent:
+        if all(_is_inline(values.get(name)) for name in self.template.names):
+            # the lines and their indentation are those of the template, which was dedented once upfront
+            literals = self.dedented_template.literals
+            pieces = [literals[0]]
+            for name, literal in zip(self.dedented_template.names, literals[1:]):
+                value = values.get(name)
+                pieces.append(value if value is not None else "{%s}" % name)
+                pieces.append(literal)
+            return TextMessageContent(text="".join(pieces).lstrip("\n").rstrip("\n"))
+        return TextMessageContent.from_string(text=self.template.render(values))
+
+
+class CompiledPrompt:
+    """
+    Prompt template prepared for rendering it many times.
+
+    Renders like `Prompt.replace_all(...).to_chat()`, but substitutes all placeholders in a single pass over
+    precomputed positions and reuses the parsed message structure instead of parsing the XML again.
+    Only placeholders inside message texts are substituted on the parsed structure. A template with placeholders
+    elsewhere (attributes, markup lines) is rendered as a string and parsed.
+    """
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self._template = _Template(prompt)
+        # placeholders on a line that starts with markup: multi-line values would indent the markup into the text
+        self._markup_line_names: Set[str] = set()
+        for match in PLACEHOLDER_PATTERN.finditer(prompt):
+            line_prefix = prompt[prompt.rfind("\n", 0, match.start()) + 1 : match.start()]
+            if "<" in line_prefix or ">" in line_prefix:
+                self._markup_line_names.add(match.group(1))
+        self._messages = self._compile_messages(n_placeholders=len(self._template.names))
+
+    def render(self, images: Optional[ImageMap] = None, **kwargs) -> Chat:
+        for needle in kwargs:
+            assert "{" not in needle and "}" not in needle
+        if self._messages is None or not self._can_render_parsed(kwargs):
+            return ChatFactory().from_xml_string(self.render_string(**kwargs), images=images)
+        if images is None:
+            images = {}
+        values = {
+            name: value.replace("\r\n", "\n").replace("\r", "\n") if "\r" in value else value
+            for name, value in kwargs.items()
+        }
+        messages = []
+        for role, slots in self._messages:
+            content = []
+            for slot in slots:
+                if isinstance(slot, TextMessageContent):
+                    content.append(slot)
+                elif isinstance(slot, _TextSlot):
+                    content.append(slot.render(values))
+                else:
+                    image_id, options = slot
+                    content.append(ImageMessageContent(image=images[image_id], **options))
+            messages.append(Message(role=role, content=tuple(content)))
+        return Chat(messages=messages)
+
+    def render_string(self, **kwargs) -> str:
+        """Substitute the (xml-escaped) values into the template string."""
+        return self._template.render({name: escape_xml(value) for name, value in kwargs.items()})
+
+    def _can_render_parsed(self, values: Dict[str, str]) -> bool:
+        for name in self._markup_line_names:
+            value = values.get(name)
+            if value is not None and (LINE_BREAK_PATTERN.search(value) is not None or not value.strip()):
+                return False
+        return True
+
+    def _compile_messages(
+        self, n_placeholders: int
+    ) -> Optional[
+        List[Tuple[MessageRole, Tuple[Union[TextMessageContent, _TextSlot, Tuple[str, Dict[str, int]]], ...]]]
+    ]:
+        """Message structure of the template, mirrors `MessageFactory.from_xml`. None if it has to be parsed."""
+        try:
+            xml = ET.fromstring(self.prompt)
+        except ET.ParseError:
+            return None
+        raw_messages: List[Tuple[str, List[Tuple[str, Any]]]] = []
+        for message in xml:
+            if message.tag == "message":
+                role = message.get("role")
+                children = list(message.iter("content"))
+            else:
+                role = message.tag
+                children = list(message)
+            if len(children) == 0:
+                raw_messages.append((role, [("text", message.text)]))
+                continue
+            raw_slots = []
+            for content in children:
+                content_type = content.get("type", "text")
+                if content_type not in ("text", "image"):
+                    return None
+                if content_type == "text":
+                    raw_slots.append((content_type, content.text))
+                else:
+                    raw_slots.append((content_type, (content.get("id"), MessageContentFactory.image_options(content))))
+            raw_messages.append((role, raw_slots))
+
+        n_text_placeholders = sum(
+            len(PLACEHOLDER_PATTERN.findall(value))
+            for _, raw_slots in raw_messages
+            for content_type, value in raw_slots
+            if content_type == "text" and value is not None
+        )
+        if n_text_placeholders != n_placeholders:
+            # placeholders in attributes or ignored text change more than the message texts
+            return None
+
+        messages = []
+        for role, raw_slots in raw_messages:
+            slots = []
+            for content_type, value in raw_slots:
+                if content_type == "image":
+                    slots.append(value)
+                elif value is None:
+                    return None
+                elif PLACEHOLDER_PATTERN.search(value) is None:
+                    slots.append(TextMessageContent.from_string(text=value))
+                else:
+                    slots.append(_TextSlot(value))
+            messages.append((MessageRole(role), tuple(slots)))
+        return messages
+
+    @staticmethod
+    def load_from_file(file_path: Path) -> "CompiledPrompt":
+        """Compiled once per file, recompiled when the file changes."""
+        file_path = os.path.abspath(file_path)
+        return _load_compiled_prompt(file_path, os.path.getmtime(file_path))
+
+
+@functools.lru_cache(maxsize=256)
+def _load_compiled_prompt(file_path: str, mtime: float) -> CompiledPrompt:
+    with open(file_path) as f:
+        return CompiledPrompt(prompt=f.read())
@@ -1,12 +1,13 @@
+import re
 from dataclasses import dataclass
 from pathlib import Path
-import re
 from typing import Optional
 
 from llm_utils.openai_api.chat import Chat
 from llm_utils.openai_api.chat_factory import ChatFactory
 from llm_utils.openai_api.utils import ImageMap
-from llm_utils.prompt_generation.utils import replace_text
+from llm_utils.prompt_generation.compiled_prompt import CompiledPrompt
+from llm_utils.prompt_generation.utils import escape_xml, replace_text, replace_texts
 
 
 @dataclass
@@ -18,19 +19,17 @@ class Prompt:
         return ChatFactory().from_xml_string(self.prompt, images=images)
 
     def replace_all(self, **kwargs):
-        for needle, replacement in kwargs.items():
+        for needle in kwargs:
             assert "{" not in needle and "}" not in needle
-            self.replace(needle="{%s}" % needle, replacement=replacement)
+        replacements = {"{%s}" % needle: escape_xml(replacement) for needle, replacement in kwargs.items()}
+        self.prompt = replace_texts(text=self.prompt, replacements=replacements)
 
     def replace(self, needle: str, replacement: str):
-        escaped_replacement = (
-            replacement.replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace('"', "&quot;")
-            .replace("'", "&apos;")
-        )
-        self.prompt = replace_text(needle=needle, replacement=escaped_replacement, text=self.prompt)
+        self.prompt = replace_text(needle=needle, replacement=escape_xml(replacement), text=self.prompt)
+
+    def compile(self) -> CompiledPrompt:
+        """Prepare the prompt for rendering it many times, see CompiledPrompt."""
+        return CompiledPrompt(prompt=self.prompt)
 
     @staticmethod
     def load_from_file(file_path: Path):
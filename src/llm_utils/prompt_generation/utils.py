@@ -1,31 +1,110 @@
+import functools
 import re
 import textwrap
-from typing import Tuple, Union
+from typing import Dict, List, Sequence, Tuple, Union
+
+# characters `str.splitlines` (and therefore `textwrap.indent`) breaks lines at
+LINE_BREAK_PATTERN = re.compile("[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+def escape_xml(text: str) -> str:
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("'", "&apos;")
+    )
 
 
 def replace_text(text: str, needle: Union[str, Tuple[int]], replacement: str) -> str:
-    matches = [needle]
-    while True:
-        if isinstance(needle, str):
-            matches = [m.span() for m in re.finditer(re.escape(needle), text)]
-            matches = [(start_idx, end_idx) for start_idx, end_idx in matches if start_idx != -1]
-            if len(matches) == 0:
-                break
-            match = matches[0]
+    if isinstance(needle, str):
+        return replace_texts(text=text, replacements={needle: replacement})
+    start_idx, end_idx = needle
+    return join_indented(literals=[text[:start_idx], text[end_idx:]], replacements=[replacement])
+
+
+def replace_texts(text: str, replacements: Dict[str, str]) -> str:
+    """
+    Replace all needles in a single left-to-right pass.
+    Like `replace_text`, every line of a replacement is prefixed with the text preceding the needle on its line.
+    Where needles overlap, the longest one starting first wins. Replacements are not searched for needles again.
+    The result equals `replace_text` applied to the occurrences from left to right. Replacing one needle after the
+    other can differ where a replacement is blank: the line prefix dropped with it may hold needles not replaced yet.
+    """
+    if len(replacements) == 0:
+        return text
+    literals: List[str] = []
+    values: List[str] = []
+    start_idx = 0
+    for match in needle_pattern(tuple(replacements)).finditer(text):
+        literals.append(text[start_idx : match.start()])
+        values.append(replacements[match.group()])
+        start_idx = match.end()
+    if len(values) == 0:
+        return text
+    literals.append(text[start_idx:])
+    return join_indented(literals, values)
+
+
+def join_indented(literals: Sequence[str], replacements: Sequence[str]) -> str:
+    """
+    Interleave `literals` and `replacements` (one less), each replacement indented with the output preceding it
+    on its line. This prefix is moved into the replacement, i.e. it is dropped for whitespace-only lines.
+    """
+    pieces = []
+    line = ""  # output since the last newline
+    for literal, replacement in zip(literals, replacements):
+        newline = literal.rfind("\n")
+        if newline == -1:
+            line += literal
+        else:
+            pieces.append(line)
+            pieces.append(literal[: newline + 1])
+            line = literal[newline + 1 :]
+        if LINE_BREAK_PATTERN.search(replacement) is None and replacement.strip():
+            line += replacement  # fast path, equivalent to indenting a single line
+            continue
+        indented = textwrap.indent(text=replacement, prefix=line)
+        newline = indented.rfind("\n")
+        if newline == -1:
+            line = indented
         else:
-            if len(matches) == 0:
-                break
-            match = matches.pop()
+            pieces.append(indented[: newline + 1])
+            line = indented[newline + 1 :]
+    pieces.append(line)
+    pieces.append(literals[-1])
+    return "".join(pieces)
 
-        start_idx, end_idx = match
-        last_line = text[:start_idx].split("\n")[-1]  # not splitlines() since removes empty lines
-        # if len(last_line.strip()) != 0:
-        # only copy whitespace
-        # last_line = ""
 
-        replacement_w_prefix = textwrap.indent(text=replacement, prefix=last_line)
-        start_idx = start_idx - len(last_line)
+@functools.lru_cache(maxsize=1024)
+def needle_pattern(needles: Tuple[str, ...]) -> re.Pattern:
+    """
+    Regex matching any of the needles, compiled from their prefix trie.
+    At every position of the text the match attempt descends the trie instead of trying each needle, so a scan
+    costs O(len(text) * max needle length) regardless of the number of needles.
+    """
+    trie: dict = {}
+    for needle in needles:
+        assert len(needle) > 0, "needles must not be empty"
+        node = trie
+        for char in needle:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end of a needle
+    return re.compile(_trie_to_regex(trie))
 
-        text = text[:start_idx] + replacement_w_prefix + text[end_idx:]
 
-    return text
+def _trie_to_regex(node: dict) -> str:
+    # collapse chains of single children into one literal, which also bounds the recursion depth
+    prefix = ""
+    while len(node) == 1 and "" not in node:
+        char, node = next(iter(node.items()))
+        prefix += char
+    branches = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items()) if char != ""]
+    if len(branches) == 0:
+        return re.escape(prefix)
+    alternation = branches[0] if len(branches) == 1 else "(?:%s)" % "|".join(branches)
+    if "" in node:
+        # greedy optional group, the longer needle is preferred
+        alternation = "(?:%s)?" % alternation
+    return re.escape(prefix) + alternation
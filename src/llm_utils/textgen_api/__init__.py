@@ -1,5 +1,77 @@
-from .textgen_api import TextGenApi
-from .textgen_api_connection import TextGenLLMConnection
-from .textgen_api_connections import TextGenLLMConnections
+from typing import TYPE_CHECKING
 
-__all__ = ("TextGenApi", "TextGenLLMConnection", "TextGenLLMConnections")
+from llm_utils._lazy import lazy_attributes
+
+if TYPE_CHECKING:
+    from .batch_job import BatchJob
+    from .batch_result import BatchResult
+    from .call_metrics import CallMetrics
+    from .connection_router import ConnectionRouter
+    from .exceptions import CircuitOpenError, TextGenApiError
+    from .hedge_policy import HedgePolicy
+    from .json_item_parser import JSONItemParser
+    from .metrics_registry import HistogramSnapshot, MetricsRegistry
+    from .response_cache import ResponseCache
+    from .retry_policy import RetryPolicy
+    from .stop_condition import StopCondition
+    from .textgen_api import TextGenApi
+    from .textgen_api_connection import TextGenLLMConnection
+    from .textgen_api_connections import TextGenLLMConnections
+    from .textgen_stream import AsyncTextGenStream, TextGenStream
+    from .usage import Usage, UsageCall
+    from .usage_log import UsageLog
+    from .xml_item_parser import XMLItemParser
+
+# imported on first access, so that requests and tiktoken are only loaded by the api client
+__getattr__, __dir__ = lazy_attributes(
+    __name__,
+    {
+        "AsyncTextGenStream": ".textgen_stream",
+        "BatchJob": ".batch_job",
+        "BatchResult": ".batch_result",
+        "CallMetrics": ".call_metrics",
+        "CircuitOpenError": ".exceptions",
+        "ConnectionRouter": ".connection_router",
+        "HedgePolicy": ".hedge_policy",
+        "JSONItemParser": ".json_item_parser",
+        "HistogramSnapshot": ".metrics_registry",
+        "MetricsRegistry": ".metrics_registry",
+        "ResponseCache": ".response_cache",
+        "RetryPolicy": ".retry_policy",
+        "StopCondition": ".stop_condition",
+        "TextGenApi": ".textgen_api",
+        "TextGenApiError": ".exceptions",
+        "TextGenLLMConnection": ".textgen_api_connection",
+        "TextGenLLMConnections": ".textgen_api_connections",
+        "TextGenStream": ".textgen_stream",
+        "Usage": ".usage",
+        "UsageCall": ".usage",
+        "UsageLog": ".usage_log",
+        "XMLItemParser": ".xml_item_parser",
+    },
+)
+
+__all__ = (
+    "AsyncTextGenStream",
+    "BatchJob",
+    "BatchResult",
+    "CallMetrics",
+    "CircuitOpenError",
+    "ConnectionRouter",
+    "HedgePolicy",
+    "JSONItemParser",
+    "HistogramSnapshot",
+    "MetricsRegistry",
+    "ResponseCache",
+    "RetryPolicy",
+    "StopCondition",
+    "TextGenApi",
+    "TextGenApiError",
+    "TextGenLLMConnection",
+    "TextGenLLMConnections",
+    "TextGenStream",
+    "Usage",
+    "UsageCall",
+    "UsageLog",
+    "XMLItemParser",
+)
@@ -0,0 +1,60 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+# OpenAI: completed, failed, expired, cancelled. Anthropic: ended
+FINISHED_STATUSES = frozenset({"completed", "failed", "expired", "cancelled", "ended"})
+
+
+@dataclass
+class BatchJob:
+    """
+    A job submitted to the batch endpoint of the provider (OpenAI Batches, Anthropic Message Batches),
+    see `TextGenApi.submit_batch_job`.
+    Save it to wait for the results in another process, or create one from the id of a job submitted earlier.
+    """
+
+    id: str
+    connection_id: str
+    call_ids: Optional[List[Optional[str]]] = None  # one per chat in input order, None if only the job id is known
+    status: Optional[str] = None  # as reported by the provider when it was last polled
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @staticmethod
+    def custom_id(index: int, call_id: Optional[str]) -> str:
+        """Id of a request in the job, results are mapped back to the chats by it."""
+        return call_id if call_id is not None else "request-%d" % index
+
+    def custom_ids(self) -> Optional[List[str]]:
+        if self.call_ids is None:
+            return None
+        return [BatchJob.custom_id(index, call_id) for index, call_id in enumerate(self.call_ids)]
+
+    def to_dumps(self) -> dict:
+        return {"id": self.id, "connection_id": self.connection_id, "call_ids": self.call_ids, "status": self.status}
+
+    @staticmethod
+    def from_loads(data: dict) -> "BatchJob":
+        return BatchJob(
+            id=data["id"],
+            connection_id=data["connection_id"],
+            call_ids=data.get("call_ids"),
+            status=data.get("status"),
+        )
+
+    def save(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dumps(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> "BatchJob":
+        with open(path, "r") as f:
+            return BatchJob.from_loads(json.load(f))
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from llm_utils.openai_api.message import Message
+
+
+@dataclass
+class BatchResult:
+    index: int  # position of the chat in the batch
+    call_id: Optional[str] = None
+    message: Optional[Message] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
@@ -0,0 +1,37 @@
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class CallMetrics:
+    """
+    Timings and sizes of a single call, passed to the metrics callbacks of `TextGenApi` once the call finished.
+    Streams are reported once they are exhausted. All durations are in seconds.
+    """
+
+    connection_id: str
+    call_id: Optional[str] = None
+    stream: bool = False
+    success: bool = True
+    from_cache: bool = False  # served by the response cache, no request was sent
+    coalesced: bool = False  # shared the request of an identical call in flight, no request was sent
+    queue_wait: float = 0.0  # waiting for rate limits and concurrency slots
+    time_to_first_byte: Optional[float] = None  # from sending the successful attempt to the response headers
+    time_to_first_token: Optional[float] = None  # from the start of the call to the first text of a stream
+    latency: Optional[float] = None  # from the start of the call to the complete message
+    output_tokens: Optional[int] = None
+    retries: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    started: float = field(default_factory=time.perf_counter, repr=False)  # `time.perf_counter()` at the start
+
+    @property
+    def output_tokens_per_second(self) -> Optional[float]:
+        """Generation speed, measured from the first token if it is known."""
+        if self.output_tokens is None or self.latency is None:
+            return None
+        generation_time = self.latency - (self.time_to_first_token or 0.0)
+        if generation_time <= 0:
+            return None
+        return self.output_tokens / generation_time
@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from llm_utils.textgen_api.exceptions import CircuitOpenError
+
+
+class CircuitBreaker:
+    """
+    Per-connection circuit breaker.
+
+    closed: calls pass, consecutive failures are counted.
+    open: after `failure_threshold` consecutive failures, calls fail fast for `recovery_timeout` seconds.
+    half-open: afterwards a single trial call is let through. Its success closes the circuit, its failure or a rate
+        limit reopens it. If it ends without either, e.g. because it was cancelled, the next call becomes the trial.
+
+    Only server errors and network errors are failures, other error responses show that the connection is healthy.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial = 0  # number of the current or last trial call
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """Whether `before_call` would let a call through right now, without changing the state."""
+        if self.failure_threshold is None or self.state == self.CLOSED:
+            return True
+        return self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout
+
+    @contextmanager
+    def attempt(self) -> Iterator[None]:
+        """
+        Guards one attempt to call the connection, the attempt records its outcome with `record_*`.
+        Raises CircuitOpenError if the connection must not be called right now.
+        """
+        trial = self.before_call()
+        try:
+            yield
+        finally:
+            if trial is not None:
+                self.end_trial(trial)
+
+    def before_call(self) -> Optional[int]:
+        """
+        Raises CircuitOpenError if the connection must not be called right now.
+        Returns the number of the trial if the call is the half-open trial, it must be ended with `end_trial`.
+        """
+        if self.failure_threshold is None:
+            return None
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._trial += 1
+                return self._trial
+            raise CircuitOpenError(
+                "circuit of %s is %s after %d consecutive failures" % (self.name, self.state, self.consecutive_failures)
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.failure_threshold is None:
+                return
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_rate_limited(self):
+        """The connection is up but refuses calls for now, a trial call cannot tell whether it recovered."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def end_trial(self, trial: int):
+        """Lets the next call be the trial if the trial `trial` ended without recording its outcome."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._trial == trial:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.recovery_timeout
@@ -0,0 +1,152 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
+
+
+@dataclass
+class ConnectionStats:
+    latency_ewma: Optional[float] = None  # seconds until the response headers arrived
+    error_rate_ewma: float = 0.0
+    in_flight: int = 0
+    n_calls: int = 0
+    degraded_until: float = 0.0  # monotonic time until which the connection is not routed to
+    probation: bool = False  # degraded before and not answered since, the next failure degrades it again
+    recent_latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=256), repr=False)
+
+
+class TrackedCall:
+    """A request in flight on a connection, see `ConnectionRouter.track`."""
+
+    def __init__(self, router: "ConnectionRouter", connection: TextGenLLMConnection):
+        self._router = router
+        self._connection = connection
+        self._started = time.monotonic()
+        self._ended = False
+        router.on_start(connection)
+
+    def end(self, success: bool):
+        """Record the outcome once the response headers arrived. Only the first call counts."""
+        if self._ended:
+            return
+        self._ended = True
+        self._router.on_end(self._connection, time.monotonic() - self._started, success)
+
+    def __enter__(self) -> "TrackedCall":
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError) and not self._ended:
+            # a cancelled request (e.g. the loser of a hedged call) says nothing about the connection's health
+            self._ended = True
+            self._router.on_cancel(self._connection)
+            return
+        # leaving the block without a response (e.g. on a connection error) counts as a failure
+        self.end(success=False)
+
+
+class ConnectionRouter:
+    """
+    Picks one of several interchangeable connections.
+
+    Each connection is scored by its expected wait, i.e. its latency EWMA scaled by the requests already in flight
+    and penalized by its recent error rate. Connections without observations are assumed to have the mean latency of
+    the observed ones, and are preferred on equal scores so that they get observed.
+    A connection whose error rate exceeds `max_error_rate`, or that failed before it ever answered, is taken out of
+    rotation for `cooldown` seconds. Afterwards it gets probe traffic again, and until it answers successfully, each
+    failure takes it out of rotation again.
+    """
+
+    def __init__(self, alpha: float = 0.2, max_error_rate: float = 0.5, cooldown: float = 30.0):
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._stats: Dict[str, ConnectionStats] = {}
+        self._lock = threading.Lock()
+
+    def stats(self, connection: TextGenLLMConnection) -> ConnectionStats:
+        with self._lock:
+            return self._stats_locked(connection)
+
+    def choose(
+        self,
+        candidates: List[TextGenLLMConnection],
+        is_available: Optional[Callable[[TextGenLLMConnection], bool]] = None,
+    ) -> TextGenLLMConnection:
+        if len(candidates) == 1:
+            return candidates[0]
+        if is_available is not None:
+            candidates = [c for c in candidates if is_available(c)] or candidates
+        now = time.monotonic()
+        with self._lock:
+            healthy = [c for c in candidates if self._stats_locked(c).degraded_until <= now]
+            if len(healthy) == 0:
+                # everything is degraded, spread the load instead of hammering a single connection
+                healthy = candidates
+            stats = [self._stats_locked(c) for c in healthy]
+            observed = [s.latency_ewma for s in stats if s.latency_ewma is not None]
+            latency_prior = sum(observed) / len(observed) if len(observed) > 0 else 1.0
+            scores = [self._score(s, latency_prior) for s in stats]
+            best_score = min(scores)
+            best = [(c, s) for c, s, score in zip(healthy, stats, scores) if score == best_score]
+            fewest_calls = min(s.n_calls for _, s in best)
+            return random.choice([c for c, s in best if s.n_calls == fewest_calls])
+
+    def track(self, connection: TextGenLLMConnection) -> "TrackedCall":
+        """Count a request as in flight until `TrackedCall.end` is called or the with-block is left."""
+        return TrackedCall(router=self, connection=connection)
+
+    def on_start(self, connection: TextGenLLMConnection):
+        with self._lock:
+            self._stats_locked(connection).in_flight += 1
+
+    def on_cancel(self, connection: TextGenLLMConnection):
+        with self._lock:
+            self._stats_locked(connection).in_flight -= 1
+
+    def on_end(self, connection: TextGenLLMConnection, latency: float, success: bool):
+        with self._lock:
+            stats = self._stats_locked(connection)
+            stats.in_flight -= 1
+            stats.n_calls += 1
+            stats.error_rate_ewma += self.alpha * ((0.0 if success else 1.0) - stats.error_rate_ewma)
+            if success:
+                stats.probation = False
+                stats.recent_latencies.append(latency)
+                if stats.latency_ewma is None:
+                    stats.latency_ewma = latency
+                else:
+                    stats.latency_ewma += self.alpha * (latency - stats.latency_ewma)
+            elif stats.latency_ewma is None or stats.probation or stats.error_rate_ewma > self.max_error_rate:
+                # without a latency, the connection would keep the best score and be chosen again right away
+                stats.degraded_until = time.monotonic() + self.cooldown
+                stats.probation = True
+                # forget part of the errors, so the connection is probed once the cooldown passed
+                stats.error_rate_ewma = min(stats.error_rate_ewma, self.max_error_rate / 2)
+
+    def latency_percentile(
+        self, connection: TextGenLLMConnection, percentile: float, min_samples: int = 1
+    ) -> Optional[float]:
+        """Percentile (0-100) of the recent successful latencies, None with less than `min_samples` observations."""
+        with self._lock:
+            latencies = sorted(self._stats_locked(connection).recent_latencies)
+        if len(latencies) < max(min_samples, 1):
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def _stats_locked(self, connection: TextGenLLMConnection) -> ConnectionStats:
+        stats = self._stats.get(connection.key)
+        if stats is None:
+            stats = self._stats[connection.key] = ConnectionStats()
+        return stats
+
+    def _score(self, stats: ConnectionStats, latency_prior: float) -> float:
+        if stats.probation and stats.in_flight == 0:
+            return 0.0  # the cooldown is over, probe whether the connection recovered
+        latency = stats.latency_ewma if stats.latency_ewma is not None else latency_prior
+        return latency * (1 + stats.in_flight) / max(1 - stats.error_rate_ewma, 0.05)
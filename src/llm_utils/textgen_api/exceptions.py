@@ -0,0 +1,14 @@
+from typing import Optional
+
+
+class TextGenApiError(Exception):
+    """A call to the LLM backend failed and was not (or no longer) retried."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, response_text: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+class CircuitOpenError(TextGenApiError):
+    """The connection failed repeatedly and is not called until its recovery timeout has passed."""
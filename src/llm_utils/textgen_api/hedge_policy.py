@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class HedgePolicy:
+    """
+    Decides when a hedged call sends its second request.
+
+    The hedge is sent once the first request has not answered within the `percentile` of the latencies recently
+    observed on its connection. Until `min_samples` latencies are known, `fallback_delay` is used instead.
+    """
+
+    percentile: float = 95.0
+    min_samples: int = 20
+    fallback_delay: float = 10.0
+    min_delay: float = 0.0
+
+    def delay(self, observed_latency: Optional[float]) -> float:
+        """Seconds to wait for the first request, given the observed latency percentile (None if unknown)."""
+        if observed_latency is None:
+            return self.fallback_delay
+        return max(observed_latency, self.min_delay)
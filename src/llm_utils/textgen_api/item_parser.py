@@ -0,0 +1,26 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterable, AsyncIterator, Generic, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+
+class ItemParser(ABC, Generic[T]):
+    """
+    Incremental parser for structured output that is streamed as text chunks.
+    Returns each item as soon as it is complete, so it can be processed while the rest of the output is generated.
+    """
+
+    @abstractmethod
+    def feed(self, text: str) -> List[T]:
+        """Parse the next text chunk and return the items it completed."""
+
+    def parse(self, chunks: Iterable[str]) -> Iterator[T]:
+        """Items of a stream, e.g. `TextGenApi.stream_call`, as they are completed."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+    async def aparse(self, chunks: AsyncIterable[str]) -> AsyncIterator[T]:
+        """Async counterpart of `parse`, e.g. for `TextGenApi.astream`."""
+        async for chunk in chunks:
+            for item in self.feed(chunk):
+                yield item
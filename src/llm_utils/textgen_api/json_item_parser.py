@@ -0,0 +1,125 @@
+import re
+from typing import Any, List, Optional
+
+from llm_utils.textgen_api.item_parser import ItemParser
+from llm_utils.textgen_api.sse_parser import json_loads
+
+_STRUCTURE = re.compile(r'["\[\]{},]')
+_STRING_END = re.compile(r'["\\]')
+_TOP_LEVEL_START = re.compile(r"[\[{]")
+
+
+class JSONItemParser(ItemParser[Any]):
+    """
+    Returns the values of streamed JSON output as soon as they are complete.
+
+    If the output is an array, these are its items, otherwise each top level object, so JSON lines and concatenated
+    objects work as well. Text outside of them, e.g. an introduction or a code fence, is ignored. Brackets in that
+    text, e.g. `[as requested]`, start a value that fails to decode, it is skipped and parsing resumes right after its
+    start. Only the incomplete value is buffered, each character is scanned about once.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._in_array = False  # inside a top level array, its items are at depth 1
+        self._item_start: Optional[int] = None  # start of the object or array that is returned when it is closed
+        self._value_start = 0  # start of the current array item, scalars are returned at the next separator
+        self._value_done = False  # the current array item was already returned
+
+    def feed(self, text: str) -> List[Any]:
+        self._buffer += text
+        items = []
+        buffer = self._buffer
+        position = self._position
+        while True:
+            if self._in_string:
+                match = _STRING_END.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+                if match.group() == "\\":
+                    if match.end() == len(buffer):
+                        position = match.start()  # the escaped character is in the next chunk
+                        break
+                    position = match.end() + 1
+                    continue
+                self._in_string = False
+                position = match.end()
+                continue
+
+            pattern = _TOP_LEVEL_START if self._depth == 0 else _STRUCTURE
+            match = pattern.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            index = match.start()
+            position = match.end()
+            char = match.group()
+            item_depth = 1 if self._in_array else 0
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                if self._depth == 0 and char == "[":
+                    self._in_array = True
+                    self._value_start = position
+                    self._value_done = False
+                elif self._depth == item_depth:
+                    self._item_start = index
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == item_depth and self._item_start is not None:
+                    try:
+                        items.append(json_loads(buffer[self._item_start : position]))
+                    except ValueError:
+                        position = self._resync(self._item_start + 1)
+                        continue
+                    self._item_start = None
+                    self._value_done = True
+                elif self._in_array and self._depth == 0:
+                    if not self._add_scalar(items, buffer[self._value_start : index]):
+                        position = self._resync(self._value_start)
+                        continue
+                    self._in_array = False
+            elif self._in_array and self._depth == 1:  # ","
+                if not self._add_scalar(items, buffer[self._value_start : index]):
+                    position = self._resync(self._value_start)
+                    continue
+                self._value_start = position
+                self._value_done = False
+
+        # drop what was parsed and is not needed anymore
+        keep = position
+        if self._item_start is not None:
+            keep = self._item_start
+        elif self._in_array and self._depth == 1 and not self._value_done:
+            keep = min(keep, self._value_start)
+        self._buffer = buffer[keep:]
+        self._position = position - keep
+        if self._item_start is not None:
+            self._item_start -= keep
+        self._value_start = max(self._value_start - keep, 0)
+        return items
+
+    def _add_scalar(self, items: List[Any], text: str) -> bool:
+        """False if the text is not a JSON value."""
+        text = text.strip()
+        if not self._value_done and len(text) > 0:
+            try:
+                items.append(json_loads(text))
+            except ValueError:
+                return False
+        return True
+
+    def _resync(self, position: int) -> int:
+        """Drop the value that failed to decode, the search for the next one starts at `position`."""
+        self._depth = 0
+        self._in_string = False
+        self._in_array = False
+        self._item_start = None
+        self._value_start = 0
+        self._value_done = False
+        return position
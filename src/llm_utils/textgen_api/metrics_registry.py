@@ -0,0 +1,196 @@
+import bisect
+import math
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from llm_utils.textgen_api.call_metrics import CallMetrics
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(256 * 4**i for i in range(9))  # 256 B to 16 MiB
+TOKENS_PER_SECOND_BUCKETS = (1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 200.0, 400.0, 800.0, 1600.0)
+
+
+@dataclass
+class HistogramSnapshot:
+    buckets: Tuple[float, ...]  # upper bounds, the last bucket (+Inf) is implicit
+    counts: Tuple[int, ...]  # cumulative count per bucket, including +Inf
+    sum: float
+    count: int
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate of the q-quantile (0 <= q <= 1), interpolated linearly within its bucket."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        index = bisect.bisect_left(self.counts, rank)
+        if index >= len(self.buckets):
+            return self.buckets[-1]  # in the +Inf bucket, the largest finite bound is the best estimate
+        lower = self.buckets[index - 1] if index > 0 else 0.0
+        below = self.counts[index - 1] if index > 0 else 0
+        in_bucket = self.counts[index] - below
+        if in_bucket == 0:
+            return self.buckets[index]
+        return lower + (self.buckets[index] - lower) * (rank - below) / in_bucket
+
+    def merge(self, other: "HistogramSnapshot") -> "HistogramSnapshot":
+        """Combined snapshot of both histograms, e.g. of several connections. Both need the same buckets."""
+        if self.buckets != other.buckets:
+            raise ValueError("cannot merge histograms with different buckets")
+        return HistogramSnapshot(
+            buckets=self.buckets,
+            counts=tuple(a + b for a, b in zip(self.counts, other.counts)),
+            sum=self.sum + other.sum,
+            count=self.count + other.count,
+        )
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sum += value
+
+    def snapshot(self) -> HistogramSnapshot:
+        counts = []
+        total = 0
+        for count in self._counts:
+            total += count
+            counts.append(total)
+        return HistogramSnapshot(buckets=self.buckets, counts=tuple(counts), sum=self._sum, count=total)
+
+
+# name -> (help, buckets, value of a call or None if it does not apply)
+HISTOGRAMS: Dict[str, Tuple[str, Tuple[float, ...], Callable[[CallMetrics], Optional[float]]]] = {
+    "queue_wait_seconds": (
+        "Time spent waiting for rate limits and concurrency slots.",
+        SECONDS_BUCKETS,
+        lambda m: None if m.from_cache or m.coalesced else m.queue_wait,
+    ),
+    "time_to_first_byte_seconds": (
+        "Time from sending the request to the response headers.",
+        SECONDS_BUCKETS,
+        lambda m: m.time_to_first_byte,
+    ),
+    "time_to_first_token_seconds": (
+        "Time from the start of a streamed call to its first text.",
+        SECONDS_BUCKETS,
+        lambda m: m.time_to_first_token,
+    ),
+    "latency_seconds": (
+        "Time from the start of the call to the complete message.",
+        SECONDS_BUCKETS,
+        lambda m: m.latency,
+    ),
+    "output_tokens_per_second": (
+        "Generation speed of the call.",
+        TOKENS_PER_SECOND_BUCKETS,
+        lambda m: None if m.from_cache or m.coalesced else m.output_tokens_per_second,
+    ),
+    "request_bytes": ("Size of the request body.", BYTES_BUCKETS, lambda m: m.request_bytes or None),
+    "response_bytes": ("Size of the response body.", BYTES_BUCKETS, lambda m: m.response_bytes or None),
+}
+
+
+class MetricsRegistry:
+    """
+    In-process aggregation of `CallMetrics`, per connection identifier.
+    Pass it as a metrics callback (`TextGenApi` has one as `api.metrics`), read `snapshot()` or render all metrics in
+    the Prometheus text format with `to_prometheus()`. Call ids are not used as labels, they would be unbounded.
+    """
+
+    def __init__(self, prefix: str = "llm_utils"):
+        self.prefix = prefix
+        self._histograms: Dict[str, Dict[str, Histogram]] = {name: {} for name in HISTOGRAMS}
+        self._calls: Dict[Tuple[str, str], int] = defaultdict(int)  # (connection, status) -> count
+        self._retries: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: CallMetrics):
+        self.observe(metrics)
+
+    def observe(self, metrics: CallMetrics):
+        if not metrics.success:
+            status = "error"
+        elif metrics.from_cache:
+            status = "cached"
+        elif metrics.coalesced:
+            status = "coalesced"
+        else:
+            status = "success"
+        with self._lock:
+            self._calls[(metrics.connection_id, status)] += 1
+            self._retries[metrics.connection_id] += metrics.retries
+            for name, (_, buckets, value_of) in HISTOGRAMS.items():
+                value = value_of(metrics)
+                if value is None:
+                    continue
+                histogram = self._histograms[name].get(metrics.connection_id)
+                if histogram is None:
+                    histogram = self._histograms[name][metrics.connection_id] = Histogram(buckets)
+                histogram.observe(value)
+
+    def snapshot(self) -> Dict[str, Dict[str, HistogramSnapshot]]:
+        """Histogram name -> connection identifier -> snapshot."""
+        with self._lock:
+            return {
+                name: {connection: histogram.snapshot() for connection, histogram in histograms.items()}
+                for name, histograms in self._histograms.items()
+            }
+
+    def calls(self) -> Dict[Tuple[str, str], int]:
+        """(connection identifier, status) -> number of calls. The status is success, error, cached or coalesced."""
+        with self._lock:
+            return dict(self._calls)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {name: {} for name in HISTOGRAMS}
+            self._calls.clear()
+            self._retries.clear()
+
+    def to_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            calls = dict(self._calls)
+            retries = dict(self._retries)
+            snapshots = {
+                name: {connection: histogram.snapshot() for connection, histogram in histograms.items()}
+                for name, histograms in self._histograms.items()
+            }
+
+        lines: List[str] = []
+        name = "%s_calls_total" % self.prefix
+        lines += ["# HELP %s Finished calls." % name, "# TYPE %s counter" % name]
+        for (connection, status), count in sorted(calls.items()):
+            lines.append("%s{connection=%s,status=%s} %d" % (name, _label(connection), _label(status), count))
+        name = "%s_retries_total" % self.prefix
+        lines += ["# HELP %s Retried attempts." % name, "# TYPE %s counter" % name]
+        for connection, count in sorted(retries.items()):
+            lines.append("%s{connection=%s} %d" % (name, _label(connection), count))
+
+        for histogram_name, (help_text, _, _) in HISTOGRAMS.items():
+            name = "%s_%s" % (self.prefix, histogram_name)
+            lines += ["# HELP %s %s" % (name, help_text), "# TYPE %s histogram" % name]
+            for connection, snapshot in sorted(snapshots[histogram_name].items()):
+                label = _label(connection)
+                for bound, count in zip(snapshot.buckets + (math.inf,), snapshot.counts):
+                    lines.append("%s_bucket{connection=%s,le=%s} %d" % (name, label, _label(_number(bound)), count))
+                lines.append("%s_sum{connection=%s} %s" % (name, label, _number(snapshot.sum)))
+                lines.append("%s_count{connection=%s} %d" % (name, label, snapshot.count))
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
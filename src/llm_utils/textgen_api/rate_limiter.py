@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Callers reserve what they are about to spend and get back how long they have to wait before sending.
+    The reservation is charged immediately, so concurrent callers queue up behind each other instead of all
+    waking up at the same time. As long as neither a capacity nor a refill rate is known, the bucket never blocks.
+    """
+
+    def __init__(self, capacity: Optional[float] = None, refill_per_second: Optional[float] = None):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self._blocked_until = 0.0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def per_minute(limit: Optional[int]) -> "TokenBucket":
+        if limit is None:
+            return TokenBucket()
+        return TokenBucket(capacity=limit, refill_per_second=limit / 60)
+
+    def reserve(self, amount: float) -> float:
+        """Charge `amount` and return the number of seconds to wait until it is covered."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait_blocked = max(self._blocked_until - now, 0.0)
+            if self.level is None:
+                return wait_blocked
+            if self.capacity is not None:
+                # a request larger than the bucket can never be covered, wait for a full bucket instead
+                amount = min(amount, self.capacity)
+            self.level -= amount
+            if self.level >= 0 or not self.refill_per_second:
+                return wait_blocked
+            return max(-self.level / self.refill_per_second, wait_blocked)
+
+    def seed(self, remaining: float, reset_in_seconds: Optional[float] = None, limit: Optional[float] = None):
+        """Synchronize the bucket with the state reported by the provider."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit is not None:
+                self.capacity = limit
+            elif self.capacity is None or remaining > self.capacity:
+                # without a reported limit, the largest remaining value seen is the best estimate
+                self.capacity = remaining
+            self.level = remaining
+            if reset_in_seconds is not None and reset_in_seconds > 0 and self.capacity > remaining:
+                # providers replenish continuously, reaching the full capacity at the reset time
+                self.refill_per_second = (self.capacity - remaining) / reset_in_seconds
+            self._last_refill = now
+
+    @property
+    def knows_refill_rate(self) -> bool:
+        return bool(self.refill_per_second)
+
+    def exhaust(self):
+        """Empty the bucket, e.g. after the provider rejected a request."""
+        with self._lock:
+            if self.level is not None:
+                self.level = min(self.level, 0)
+
+    def block_for(self, seconds: float):
+        """Hold back all callers for `seconds`."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float):
+        if self.level is not None and self.refill_per_second:
+            self.level += (now - self._last_refill) * self.refill_per_second
+            if self.capacity is not None:
+                self.level = min(self.level, self.capacity)
+        self._last_refill = now
+
+
+class RateLimiter:
+    """Token and request budget of a single connection."""
+
+    def __init__(self, tokens_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None):
+        self.tokens = TokenBucket.per_minute(tokens_per_minute)
+        self.requests = TokenBucket.per_minute(requests_per_minute)
+
+    def reserve(self, n_tokens: int) -> float:
+        """Charge one request with `n_tokens` tokens and return the number of seconds to wait before sending it."""
+        return max(self.tokens.reserve(n_tokens), self.requests.reserve(1))
+
+    def on_rate_limited(self, fallback_seconds: float = 60, retry_after: Optional[float] = None):
+        """
+        The provider rejected a request. Buckets with a known refill rate are emptied, so callers wait exactly
+        until they are refilled. If no refill rate is known at all, callers are held back for `fallback_seconds`.
+        If the provider said when to retry, callers are held back at least until then.
+        """
+        buckets = [self.tokens, self.requests]
+        for bucket in buckets:
+            bucket.exhaust()
+        if retry_after is not None:
+            for bucket in buckets:
+                bucket.block_for(retry_after)
+        elif not any(bucket.knows_refill_rate for bucket in buckets):
+            for bucket in buckets:
+                bucket.block_for(fallback_seconds)
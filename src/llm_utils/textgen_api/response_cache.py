@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+CacheEntry = Tuple[dict, dict]  # (message dict, response usage dict)
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for non-streaming LLM responses.
+
+    Entries are keyed by the hash of the request payload and stored in a sqlite file, fronted by a small in-memory LRU.
+    The disk tier evicts least recently used entries once `max_entries` or `max_bytes` is exceeded,
+    entries older than `ttl` seconds are treated as misses.
+    Without a `path` the cache only lives in memory.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: Optional[int] = 100_000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        memory_entries: int = 1024,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[CacheEntry, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def key(request_data: dict) -> str:
+        """Hash of the request payload. The stream flag does not influence the response and is ignored."""
+        payload = {k: v for k, v in request_data.items() if k != "stream"}
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                entry, created = self._memory[key]
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    return entry
+                del self._memory[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self._expired(created, now):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            data = json.loads(value)
+            entry = (data["message"], data["usage"])
+            self._remember(key, entry, created)
+            return entry
+
+    def put(self, key: str, message: dict, usage: dict):
+        now = time.time()
+        entry = (message, usage)
+        with self._lock:
+            self._remember(key, entry, now)
+            if self._db is None:
+                return
+            value = json.dumps({"message": message, "usage": usage})
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key: str, entry: CacheEntry, created: float):
+        self._memory[key] = (entry, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            (n_entries,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if n_entries > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                    (n_entries - self.max_entries,),
+                )
+        if self.max_bytes is not None:
+            (n_bytes,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if n_bytes > self.max_bytes:
+                # walk the entries from least recently used until enough bytes are freed
+                to_free = n_bytes - self.max_bytes
+                keys = []
+                for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    keys.append((key,))
+                    to_free -= size
+                    if to_free <= 0:
+                        break
+                self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
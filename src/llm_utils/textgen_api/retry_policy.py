@@ -0,0 +1,62 @@
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import FrozenSet, Optional
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Decides whether and when a failed call is retried.
+
+    Delays grow exponentially from `initial_delay` up to `max_delay`, each randomized with `jitter`
+    (0 = no randomization, 1 = anywhere between 0 and the full delay). A `Retry-After` header sent by the provider
+    takes precedence over the computed delay.
+    Status codes not in `retryable_status_codes` fail immediately.
+
+    After `circuit_breaker_threshold` consecutive failures of a connection, its circuit opens and calls fail fast
+    for `circuit_breaker_timeout` seconds. Set the threshold to None to disable the circuit breaker.
+    """
+
+    max_attempts: int = 6
+    initial_delay: float = 1.0
+    max_delay: float = 60.0
+    backoff_factor: float = 2.0
+    jitter: float = 1.0
+    respect_retry_after: bool = True
+    retryable_status_codes: FrozenSet[int] = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 529})
+    rate_limit_status_codes: FrozenSet[int] = frozenset({429, 529})
+    circuit_breaker_threshold: Optional[int] = 5
+    circuit_breaker_timeout: float = 30.0
+
+    def is_retryable(self, status_code: Optional[int]) -> bool:
+        """Network errors (no status code) are always retryable."""
+        return status_code is None or status_code in self.retryable_status_codes
+
+    def is_rate_limit(self, status_code: Optional[int]) -> bool:
+        return status_code in self.rate_limit_status_codes
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait after the `attempt`-th (1-based) failed attempt."""
+        if self.respect_retry_after and retry_after is not None:
+            retry_after_seconds = self.parse_retry_after(retry_after)
+            if retry_after_seconds is not None:
+                return min(retry_after_seconds, self.max_delay)
+        delay = min(self.initial_delay * self.backoff_factor ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    @staticmethod
+    def parse_retry_after(value: str) -> Optional[float]:
+        """`Retry-After` is either a number of seconds or an HTTP date."""
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class Flight(Future):
+    """Result of a request shared by all identical calls made while it is in flight."""
+
+    def __init__(self, key: str):
+        super().__init__()
+        self.key = key
+
+
+class SingleFlight:
+    """
+    Lets concurrent identical calls share one request. The first caller of a key leads the flight and resolves it,
+    callers that join while it is in flight wait for its result instead of sending their own request.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """The flight of the key and whether the caller leads it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            return flight, True
+
+    def leave(self, flight: Flight):
+        """Calls made from now on start a new flight."""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+
+class ChunkTee:
+    """
+    Buffers the chunks of one upstream iterator so that several readers each receive all of them, also readers that
+    start late. The upstream is pulled by whichever reader is ahead and released once it is exhausted, or once all
+    readers were closed before.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], close: Callable[[], None], on_released: Callable[[], None]):
+        self._chunks = chunks
+        self._close = close
+        self._on_released = on_released
+        self._buffer: List[bytes] = []
+        self._complete = False
+        self._error: Optional[Exception] = None
+        self._readers = 0
+        self._released = False
+        self._lock = threading.Lock()
+        self._pull_lock = threading.Lock()
+
+    def reader(self) -> Optional[Tuple[Iterator[bytes], Callable[[], None]]]:
+        """Chunks and close function of a new reader, None if the upstream was released before it completed."""
+        with self._lock:
+            if self._released and not self._complete and self._error is None:
+                return None
+            self._readers += 1
+
+        closed = False
+
+        def close():
+            nonlocal closed
+            with self._lock:
+                if closed:
+                    return
+                closed = True
+                self._readers -= 1
+                abandoned = self._readers == 0
+            if abandoned:
+                self._release()
+
+        return self._read(), close
+
+    def _read(self) -> Iterator[bytes]:
+        index = 0
+        while True:
+            if index < len(self._buffer):
+                index += 1
+                yield self._buffer[index - 1]
+                continue
+            with self._pull_lock:
+                if index < len(self._buffer):
+                    continue
+                if self._error is not None:
+                    raise self._error
+                if self._complete:
+                    return
+                try:
+                    chunk = next(self._chunks, None)
+                except Exception as e:
+                    self._error = e
+                    self._release()
+                    raise
+                if chunk is None:
+                    self._complete = True
+                    self._release()
+                    return
+                self._buffer.append(chunk)
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._close()
+        self._on_released()
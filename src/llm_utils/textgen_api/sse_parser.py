@@ -0,0 +1,104 @@
+import json
+import logging
+from typing import List, Optional
+
+from llm_utils.textgen_api.exceptions import TextGenApiError
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:  # orjson is optional, it only speeds up decoding
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+
+class SSEParser:
+    """
+    Incremental parser for the server-sent events of a streamed completion.
+
+    Works on raw byte chunks as they arrive from the socket, lines may be split across chunks.
+    Understands both the Anthropic (`content_block_delta`, `message_delta`, ...) and the OpenAI-compatible
+    (`choices[0].delta.content`) formats. The text is accumulated so it is available once the stream ended.
+    """
+
+    def __init__(self, anthropic: bool):
+        self.anthropic = anthropic
+        self.usage: Optional[dict] = None
+        self.done = False
+        self._buffer = b""
+        self._parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Parse the next chunk and return the text deltas it completed."""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        texts = []
+        start = 0
+        while not self.done:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            text = self._handle_line(buffer[start:end])
+            start = end + 1
+            if text:
+                texts.append(text)
+        self._buffer = buffer[start:] if not self.done else b""
+        self._parts.extend(texts)
+        return texts
+
+    def finish(self) -> List[str]:
+        """Parse what is left in the buffer once the connection closed."""
+        texts = []
+        if self._buffer and not self.done:
+            text = self._handle_line(self._buffer)
+            if text:
+                texts.append(text)
+        self._buffer = b""
+        self.done = True
+        self._parts.extend(texts)
+        return texts
+
+    def _handle_line(self, line: bytes) -> Optional[str]:
+        # only the data field carries information, `event:`, `id:` and comments are ignored
+        if not line.startswith(b"data:"):
+            return None
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            self.done = True
+            return None
+        try:
+            data = json_loads(payload)
+        except ValueError:
+            logger.warning("Failed to parse streaming data: %s", payload)
+            return None
+        if self.anthropic:
+            return self._handle_anthropic_event(data)
+        return self._handle_openai_event(data)
+
+    def _handle_anthropic_event(self, data: dict) -> Optional[str]:
+        event_type = data.get("type")
+        if event_type == "content_block_delta":
+            return data["delta"].get("text")
+        elif event_type == "message_start":
+            # input tokens are only reported at the start, output tokens in the final message_delta
+            self.usage = dict(data["message"].get("usage", {}))
+        elif event_type == "message_delta":
+            self.usage = {**(self.usage or {}), **(data.get("usage") or {})}
+        elif event_type == "message_stop":
+            self.done = True
+        elif event_type == "error":
+            raise TextGenApiError("error during streaming: %s" % data.get("error"))
+        return None
+
+    def _handle_openai_event(self, data: dict) -> Optional[str]:
+        if data.get("usage"):
+            self.usage = data["usage"]
+        choices = data.get("choices")
+        if choices:
+            return choices[0].get("delta", {}).get("content")
+        return None
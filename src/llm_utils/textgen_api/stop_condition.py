@@ -0,0 +1,89 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Pattern, Sequence, Union
+
+
+@dataclass
+class StopCondition:
+    """
+    Client-side condition that ends a streamed completion early.
+
+    The stream stops at the first of: one of the `stop` strings, a match of `pattern`, `max_chars` characters or
+    `predicate` returning True for the text received so far. The text is cut after the match, or before it without
+    `include_match`, and the connection is closed, so the rest of the completion is neither waited for nor generated.
+
+    Each chunk is only searched together with the end of the text before it that a match can overlap, matches of
+    `pattern` are therefore only found if they span at most `max_match_len` characters. `predicate` is called with the
+    whole text on every chunk, so its cost grows with the length of the output.
+    Without `include_match`, the streamed chunks hold back the characters that may still turn out to be the start of
+    a match, so the stream never yields text that is cut from the message afterwards.
+    """
+
+    stop: Sequence[str] = ()
+    pattern: Optional[Union[str, Pattern[str]]] = None
+    max_chars: Optional[int] = None
+    predicate: Optional[Callable[[str], bool]] = None
+    include_match: bool = True
+    max_match_len: int = 256
+
+    def __post_init__(self):
+        if isinstance(self.stop, str):
+            self.stop = (self.stop,)
+        if isinstance(self.pattern, str):
+            self.pattern = re.compile(self.pattern)
+
+    def matcher(self) -> "StopMatcher":
+        """State to check the condition against a text that arrives in chunks, one per stream."""
+        return StopMatcher(self)
+
+
+class StopMatcher:
+    """Checks a StopCondition against the chunks of one stream, see `StopCondition.matcher`."""
+
+    def __init__(self, condition: StopCondition):
+        self.condition = condition
+        self.length = 0  # characters fed so far
+        self._max_stop_len = max(map(len, condition.stop), default=0)
+        # one more character than a pattern match can overlap, so `^` and `\b` see what precedes the search start
+        self._overlap = max(self._max_stop_len - 1, condition.max_match_len if condition.pattern is not None else 0)
+        self._tail = ""  # the end of the text fed so far that a later match can overlap
+        self._parts: List[str] = []  # the whole text, only kept for `predicate`
+
+    def feed(self, text: str) -> Optional[int]:
+        """Add the next chunk. Length the whole text is cut to if the condition is met, None otherwise."""
+        condition = self.condition
+        window = self._tail + text
+        offset = self.length - len(self._tail)  # position of the window in the whole text
+        self.length += len(text)
+        ends = []
+        for stop in condition.stop:
+            index = window.find(stop, max(len(self._tail) - len(stop) + 1, 0))
+            if index != -1:
+                ends.append(offset + index + (len(stop) if condition.include_match else 0))
+        if condition.pattern is not None:
+            match = condition.pattern.search(window, max(len(self._tail) - condition.max_match_len + 1, 0))
+            if match is not None:
+                ends.append(offset + (match.end() if condition.include_match else match.start()))
+        if condition.max_chars is not None and self.length >= condition.max_chars:
+            ends.append(condition.max_chars)
+        if condition.predicate is not None:
+            self._parts.append(text)
+            if condition.predicate("".join(self._parts)):
+                ends.append(self.length)
+        self._tail = window[max(len(window) - self._overlap, 0) :]
+        return min(ends) if len(ends) > 0 else None
+
+    def pending(self) -> int:
+        """Number of characters at the end of the text fed so far that a later match may still cut off."""
+        condition = self.condition
+        if condition.include_match:
+            return 0
+        pending = 0
+        if condition.pattern is not None:
+            pending = min(condition.max_match_len - 1, self.length)
+        # the longest end of the text that a stop string starts with
+        for length in range(min(self._max_stop_len - 1, len(self._tail)), pending, -1):
+            suffix = self._tail[len(self._tail) - length :]
+            if any(stop.startswith(suffix) for stop in condition.stop):
+                return length
+        return pending
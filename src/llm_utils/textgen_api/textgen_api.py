@@ -1,24 +1,49 @@
+import asyncio
+import functools
+import hashlib
 import json
 import logging
 import os
+import threading
 import time
-from datetime import datetime
-from typing import Generator, Optional, Union, overload
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, List, Optional, Sequence, Tuple, Union, overload
 
 import requests
-import tiktoken
 import urllib3
 from python_utils.string_utils import parse_timedelta
+from requests.adapters import HTTPAdapter
 
 from llm_utils.openai_api.chat import Chat
 from llm_utils.openai_api.message import Message
 from llm_utils.openai_api.message_factory import MessageFactory
+from llm_utils.textgen_api.batch_job import BatchJob
+from llm_utils.textgen_api.batch_result import BatchResult
+from llm_utils.textgen_api.call_metrics import CallMetrics
+from llm_utils.textgen_api.circuit_breaker import CircuitBreaker
+from llm_utils.textgen_api.exceptions import TextGenApiError
+from llm_utils.textgen_api.hedge_policy import HedgePolicy
+from llm_utils.textgen_api.metrics_registry import MetricsRegistry
+from llm_utils.textgen_api.rate_limiter import RateLimiter
+from llm_utils.textgen_api.response_cache import ResponseCache
+from llm_utils.textgen_api.retry_policy import RetryPolicy
+from llm_utils.textgen_api.single_flight import ChunkTee, Flight, SingleFlight
+from llm_utils.textgen_api.sse_parser import SSEParser
+from llm_utils.textgen_api.stop_condition import StopCondition
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
 from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+from llm_utils.textgen_api.textgen_stream import AsyncTextGenStream, TextGenStream
+from llm_utils.textgen_api.token_counter import get_token_counter
 from llm_utils.textgen_api.usage import Usage
+from llm_utils.textgen_api.usage_log import UsageLog
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 logger = logging.getLogger(__name__)
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 
 class TextGenApi:
     """
@@ -27,7 +52,11 @@ class TextGenApi:
 
     Supports both streaming and non-streaming responses:
     - Non-streaming: Returns a complete Message object
-    - Streaming: Returns a Generator that yields text chunks as they arrive
+    - Streaming: Returns a TextGenStream that yields text chunks as they arrive and holds the complete Message
+      once it is exhausted
+
+    Both are also available as coroutines (`acall`, `astream`) that run on an asyncio event loop,
+    so a single thread can keep many requests in flight.
 
     Robustness can be improved by:
             1. reworking/adding to the prompt
@@ -41,18 +70,38 @@ class TextGenApi:
         temperature: float = 1.0,
         seed: Optional[int] = None,
         usage_out_file: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        metrics_callbacks: Optional[Sequence[Callable[[CallMetrics], None]]] = None,
+        coalesce: bool = False,
     ):
         self.connections = connections
+        self.cache = cache
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.hedge_policy = hedge_policy if hedge_policy is not None else HedgePolicy()
         self.headers = {"Content-Type": "application/json"}
-        self.remaining_tokens = None
         self.temperature = temperature
         self.seed = seed
-        self._usage_out_file = usage_out_file
-        if usage_out_file is not None and os.path.exists(usage_out_file):
-            with open(usage_out_file, "r") as f:
-                self.usage = Usage.from_loads(f.read())
-        else:
-            self.usage = Usage()
+        # usage of this instance, the full history is appended to `usage_out_file` (see `UsageLog.read_totals`)
+        self.usage = Usage()
+        self._usage_log = UsageLog(usage_out_file) if usage_out_file is not None else None
+        # every finished call is reported to the callbacks, `metrics` aggregates them for this instance
+        self.metrics = MetricsRegistry()
+        self.metrics_callbacks: List[Callable[[CallMetrics], None]] = [self.metrics, *(metrics_callbacks or ())]
+        # with `coalesce`, identical deterministic calls made while one of them is in flight share its request,
+        # see `_flight_key`
+        self.coalesce = coalesce
+        self._flights = SingleFlight()
+        # one pooled keep-alive session per connection, shared by all threads
+        self._sessions: Dict[str, requests.Session] = {}
+        self._sessions_lock = threading.Lock()
+        self._usage_lock = threading.Lock()
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        # asyncio primitives are bound to the event loop they are used on, keep one set per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_semaphores = weakref.WeakKeyDictionary()
 
     @staticmethod
     def default(connection: Optional[str] = None) -> "TextGenApi":
@@ -68,6 +117,8 @@ class TextGenApi:
         temperature: Optional[float] = None,
         stream: bool = False,
         call_id: Optional[str] = None,
+        hedge: bool = False,
+        stop: Optional[StopCondition] = None,
     ) -> Message: ...
     @overload
     def do_call(
@@ -77,7 +128,10 @@ class TextGenApi:
         temperature: Optional[float] = None,
         stream: bool = True,
         call_id: Optional[str] = None,
-    ) -> Generator[str, None, None]: ...
+        hedge: bool = False,
+        stop: Optional[StopCondition] = None,
+    ) -> TextGenStream: ...
+
     def do_call(
         self,
         chat: Chat,
@@ -85,19 +139,310 @@ class TextGenApi:
         temperature: Optional[float] = None,
         stream: bool = False,
         call_id: Optional[str] = None,
-    ) -> Union[Message, Generator[str, None, None]]:
-        connection = self.connections.get_connection(connection_id)
+        hedge: bool = False,
+        stop: Optional[StopCondition] = None,
+    ) -> Union[Message, TextGenStream]:
+        """
+        With `hedge`, the chat is sent to a second connection if the first one is slow, see `HedgePolicy`.
+        With `stop`, the completion is streamed and closed as soon as the stop condition is met, see `StopCondition`.
+        """
+        if hedge:
+            assert not stream and stop is None, "only non-streaming calls without stop condition can be hedged"
+            return self._hedged_call(chat=chat, connection_id=connection_id, temperature=temperature, call_id=call_id)
+        if stop is not None and not stream:
+            # the condition is checked on the text as it arrives, the message is read from the stream
+            return self._do_call(
+                chat=chat,
+                connection_id=connection_id,
+                temperature=temperature,
+                stream=True,
+                call_id=call_id,
+                coalesce=self.coalesce,
+                stop=stop,
+            ).read()
+        return self._do_call(
+            chat=chat,
+            connection_id=connection_id,
+            temperature=temperature,
+            stream=stream,
+            call_id=call_id,
+            coalesce=self.coalesce,
+            stop=stop,
+        )
+
+    def _do_call(
+        self,
+        chat: Chat,
+        connection_id: Optional[str],
+        temperature: Optional[float],
+        stream: bool,
+        call_id: Optional[str],
+        connection: Optional[TextGenLLMConnection] = None,
+        lookup_cache: bool = True,
+        coalesce: bool = False,
+        stop: Optional[StopCondition] = None,
+        on_sent: Optional[Callable[[], None]] = None,
+    ) -> Union[Message, TextGenStream]:
+        if connection is None:
+            connection = self._select_connection(connection_id)
         logger.debug("call llm with %s", connection)
-        system_message = next(filter(lambda m: m.role == "system", chat.messages), None)
+        metrics = CallMetrics(connection_id=connection.identifier, call_id=call_id, stream=stream)
+        data = self._build_request_data(chat=chat, connection=connection, temperature=temperature, stream=stream)
+        cache_key = None
+        if not stream and self.cache is not None:
+            cache_key = ResponseCache.key(data)
+            cached_message = self._lookup_cache(cache_key, call_id, connection) if lookup_cache else None
+            if cached_message is not None:
+                metrics.from_cache = True
+                self._report_metrics(metrics)
+                return cached_message
+
+        flight = None
+        flight_key = self._flight_key(chat, connection, data) if coalesce else None
+        if flight_key is not None:
+            flight, leader = self._flights.join(flight_key)
+            if not leader:
+                result = self._follow_flight(flight, stream, metrics, stop)
+                if result is not None:
+                    return result
+                # the shared stream was abandoned by its readers before this call could join, send it again
+                flight = None
+
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                if attempt > 1:
+                    connection, data = self._route_retry(connection_id, chat, temperature, stream, connection, data)
+                metrics.connection_id = connection.identifier
+                metrics.retries = attempt - 1
+                circuit_breaker = self._get_circuit_breaker(connection)
+                with circuit_breaker.attempt():
+                    seconds_to_sleep = self._reserve_rate_limit(connection, data)
+                    if seconds_to_sleep > 0:
+                        logger.info("Waiting until rate limits reset (%d seconds)" % seconds_to_sleep)
+                        time.sleep(seconds_to_sleep)
+                        metrics.queue_wait += seconds_to_sleep
+
+                    body = self._encode_request_data(chat, connection, data)
+                    metrics.request_bytes = len(body)
+                    if on_sent is not None:
+                        on_sent()
+                    try:
+                        with self.connections.router.track(connection) as tracked_call:
+                            response = self._get_session(connection).post(
+                                connection.uri,
+                                data=body,
+                                headers=JSON_HEADERS,
+                                stream=stream,
+                                timeout=(connection.connect_timeout, connection.read_timeout),
+                            )
+                            tracked_call.end(success=response.status_code == 200)
+                    except requests.RequestException as e:
+                        delay = self._on_failed_attempt(connection, attempt, error=e)
+                    else:
+                        if response.status_code == 200:
+                            circuit_breaker.record_success()
+                            # until the headers were parsed, also when the body was read along with them
+                            metrics.time_to_first_byte = response.elapsed.total_seconds()
+                            if stream:
+                                return self._handle_streaming_response(
+                                    response, connection, call_id, metrics, flight, stop, data
+                                )
+                            message = self._handle_non_streaming_response(
+                                response, connection, call_id, cache_key, metrics
+                            )
+                            if flight is not None:
+                                flight.set_result(message)
+                                self._flights.leave(flight)
+                            return message
+                        delay = self._on_failed_attempt(connection, attempt, response=response)
+                # back off after the attempt ended, a half-open trial must not hold the circuit while waiting
+                time.sleep(delay)
+        except BaseException as e:
+            # also on interrupts, the calls that joined the flight would wait forever
+            if flight is not None and not flight.done():
+                flight.set_exception(e)
+                self._flights.leave(flight)
+            if isinstance(e, Exception):
+                metrics.success = False
+                self._report_metrics(metrics)
+            raise
+
+    def _flight_key(self, chat: Chat, connection: TextGenLLMConnection, data: dict) -> Optional[str]:
+        """
+        Key under which identical calls share their request, None if the call is not coalesced.
+        Only seeded or greedy calls are, the answers to other calls are meant to differ.
+        """
+        if "seed" not in data and data.get("temperature") != 0:
+            return None
+        body = self._encode_request_data(chat, connection, data)
+        return "%s %s" % (connection.key, hashlib.sha256(body).hexdigest())
+
+    def _follow_flight(
+        self, flight: Flight, stream: bool, metrics: CallMetrics, stop: Optional[StopCondition] = None
+    ) -> Optional[Union[Message, TextGenStream]]:
+        """Result of an identical call in flight. None if its stream can no longer be joined."""
+        metrics.coalesced = True
+        try:
+            result = flight.result()
+        except Exception:
+            metrics.success = False
+            self._report_metrics(metrics)
+            raise
+        if stream:
+            tee, anthropic = result
+            reader = tee.reader()
+            if reader is None:
+                metrics.coalesced = False
+                return None
+            chunks, close = reader
+            result = TextGenStream(
+                chunks=chunks,
+                parser=SSEParser(anthropic=anthropic),
+                on_finish=functools.partial(self._on_stream_finished, None, metrics, None),
+                close=close,
+                stop=stop,
+            )
+        with self._usage_lock:
+            self.usage.add_coalesced()
+        # no tokens were spent on this call, record it so every call id has its usage
+        self._save_call_usage(metrics.call_id, {"prompt_tokens": 0, "completion_tokens": 0}, metrics.connection_id)
+        if not stream:
+            self._report_metrics(metrics)
+        return result
+
+    def _hedged_call(
+        self, chat: Chat, connection_id: Optional[str], temperature: Optional[float], call_id: Optional[str]
+    ) -> Message:
+        """
+        Send the chat and, if it has not been answered within the hedge delay after it was sent, send it again to
+        another connection with the same identifier. The first answer wins.
+        Both requests are streamed, the loser is closed at its next chunk once the winner returned, which aborts its
+        generation. Its usage is recorded with the tokens received until then.
+        Both requests run on threads of their own, so they never wait for each other or for other calls to be started.
+        """
+        primary = self._select_connection(connection_id)
+        cache_key = None
+        if self.cache is not None:
+            # the streamed requests bypass the cache, the answer is looked up and stored as for a non-streaming call
+            data = self._build_request_data(chat=chat, connection=primary, temperature=temperature, stream=False)
+            cache_key = ResponseCache.key(data)
+            cached_message = self._lookup_cache(cache_key, call_id, primary)
+            if cached_message is not None:
+                self._report_metrics(CallMetrics(connection_id=primary.identifier, call_id=call_id, from_cache=True))
+                return cached_message
+
+        decided = threading.Event()
+        # the loser stops like a stream whose stop condition is met, which closes it and records its partial usage
+        stop = StopCondition(predicate=lambda _: decided.is_set())
+
+        def read(connection: TextGenLLMConnection, **kwargs) -> TextGenStream:
+            stream = self._do_call(chat, connection_id, temperature, True, call_id, connection, stop=stop, **kwargs)
+            stream.read()
+            return stream
+
+        # the hedge delay starts once the primary was sent, not while it waits for rate limits
+        sent = threading.Event()
+        primary_future = _run_in_thread(functools.partial(read, primary, coalesce=self.coalesce, on_sent=sent.set))
+        primary_future.add_done_callback(lambda _: sent.set())
+        futures: Dict[Future, bool] = {primary_future: False}
+        sent.wait()
+        done, _ = wait(futures, timeout=self._hedge_delay(primary))
+        secondary = self._select_hedge_connection(primary) if len(done) == 0 else None
+        if secondary is not None:
+            logger.info("hedging call to %s with %s", primary.uri, secondary.uri)
+            with self._usage_lock:
+                self.usage.add_hedge()
+            # joining the primary's flight would only wait for it again
+            futures[_run_in_thread(functools.partial(read, secondary, coalesce=False))] = True
+
+        errors = []
+        pending = set(futures)
+        try:
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    if futures[future]:
+                        with self._usage_lock:
+                            self.usage.add_hedge_win()
+                    stream = future.result()
+                    if cache_key is not None and stream.usage:
+                        self.cache.put(cache_key, message=stream.message.to_dict(), usage=stream.usage)
+                    return stream.message
+            raise errors[0]
+        finally:
+            decided.set()
+
+    def _hedge_delay(self, connection: TextGenLLMConnection) -> float:
+        observed_latency = self.connections.router.latency_percentile(
+            connection, self.hedge_policy.percentile, min_samples=self.hedge_policy.min_samples
+        )
+        return self.hedge_policy.delay(observed_latency)
+
+    def _select_hedge_connection(self, connection: TextGenLLMConnection) -> Optional[TextGenLLMConnection]:
+        """None if there is no other connection, sending the chat to the slow one again would not help."""
+        alternative = self.connections.get_alternative_connection(
+            connection, is_available=lambda c: self._get_circuit_breaker(c).available
+        )
+        return alternative if alternative.key != connection.key else None
+
+    def _select_connection(self, connection_id: Optional[str]) -> TextGenLLMConnection:
+        return self.connections.get_connection(
+            connection_id, is_available=lambda connection: self._get_circuit_breaker(connection).available
+        )
+
+    def _route_retry(
+        self,
+        connection_id: Optional[str],
+        chat: Chat,
+        temperature: Optional[float],
+        stream: bool,
+        connection: TextGenLLMConnection,
+        data: dict,
+    ) -> Tuple[TextGenLLMConnection, dict]:
+        """With routing, a retry may fail over to another connection, which needs its own request data."""
+        next_connection = self._select_connection(connection_id)
+        if next_connection.key == connection.key:
+            return connection, data
+        logger.info("failing over from %s to %s", connection.uri, next_connection.uri)
+        data = self._build_request_data(chat=chat, connection=next_connection, temperature=temperature, stream=stream)
+        return next_connection, data
+
+    def _chat_for_connection(self, chat: Chat, connection: TextGenLLMConnection) -> Chat:
+        """Anthropic expects the system prompt as a top-level parameter instead of a message."""
         if "claude" in connection.identifier:
-            chat = chat.copy_with(messages=list(filter(lambda m: m.role != "system", chat.messages)))
+            return chat.copy_with(messages=list(filter(lambda m: m.role != "system", chat.messages)))
+        return chat
+
+    def _message_cache_breakpoints(self, connection: TextGenLLMConnection, system_message: Optional[Message]) -> int:
+        """
+        Prompt cache breakpoints left for the messages. Only Anthropic needs them, OpenAI-compatible providers cache
+        prefixes without being asked. The system prompt is a top-level parameter there and takes the first one.
+        """
+        if "claude" not in connection.identifier:
+            return 0
+        return max(connection.max_cache_breakpoints - (1 if system_message is not None else 0), 0)
+
+    def _build_request_data(
+        self, chat: Chat, connection: TextGenLLMConnection, temperature: Optional[float], stream: bool
+    ) -> dict:
+        system_message = next(filter(lambda m: m.role == "system", chat.messages), None)
+        max_cache_breakpoints = self._message_cache_breakpoints(connection, system_message)
+        chat = self._chat_for_connection(chat, connection)
         data = {
             "model": connection.model,
-            "messages": chat.to_dict(cache=True),
+            "messages": chat.to_dict(cache=max_cache_breakpoints > 0, max_cache_breakpoints=max_cache_breakpoints),
             "temperature": self.temperature,
             "stream": stream,
             **connection.additional_params,
         }
+        if stream and "claude" not in connection.identifier:
+            # OpenAI-compatible servers only report the usage of a stream in a final chunk when asked to
+            data.setdefault("stream_options", {"include_usage": True})
         if connection.max_tokens is not None:
             data["max_tokens"] = connection.max_tokens
         if temperature is not None:
@@ -106,146 +451,257 @@ class TextGenApi:
             data["seed"] = self.seed
         if "claude" in connection.identifier and system_message is not None:
             data["system"] = system_message.content[0].text
+            if connection.max_cache_breakpoints > 0:
+                data["system"] = [{"type": "text", "text": data["system"], "cache_control": {"type": "ephemeral"}}]
+        return data
+
+    def _encode_request_data(self, chat: Chat, connection: TextGenLLMConnection, data: dict) -> bytes:
+        """
+        JSON body of the request `data` built for `chat`. The messages are spliced in from their memoized encodings,
+        so the unchanged history of a conversation is not encoded again on every turn and retry.
+        """
+        system_message = next(filter(lambda m: m.role == "system", chat.messages), None)
+        max_cache_breakpoints = self._message_cache_breakpoints(connection, system_message)
+        chat = self._chat_for_connection(chat, connection)
+        messages = chat.to_json_bytes(cache=max_cache_breakpoints > 0, max_cache_breakpoints=max_cache_breakpoints)
+        parameters = json.dumps({k: v for k, v in data.items() if k != "messages"}, ensure_ascii=False)
+        return b'{"messages":%s,%s' % (messages, parameters[1:].encode("utf-8"))
+
+    def _get_rate_limiter(self, connection: TextGenLLMConnection) -> RateLimiter:
+        rate_limiter = self._rate_limiters.get(connection.key)
+        if rate_limiter is not None:
+            return rate_limiter
+        with self._sessions_lock:
+            return self._rate_limiters.setdefault(
+                connection.key,
+                RateLimiter(
+                    tokens_per_minute=connection.tokens_per_minute, requests_per_minute=connection.requests_per_minute
+                ),
+            )
 
+    def _reserve_rate_limit(self, connection: TextGenLLMConnection, data: dict) -> float:
+        """Charge the estimated request to the connection's rate limits, returns the seconds to wait before sending."""
         tokens_for_request = self._num_tokens_consumed_from_request(
             request_json=data, token_encoding_name="cl100k_base"
         )
+        return self._get_rate_limiter(connection).reserve(tokens_for_request)
 
-        if self.remaining_tokens is not None and self.remaining_tokens < tokens_for_request:
-            seconds_to_sleep = (self.resets_tokens_at - datetime.now()).total_seconds()
-            if seconds_to_sleep > 0:
-                logger.info("Waiting until rate limits reset (%d seconds)" % seconds_to_sleep)
-                time.sleep(seconds_to_sleep)
-
-        response = requests.post(
-            connection.uri,
-            headers={**self.headers, **connection.additional_headers},
-            json=data,
-            verify=False,
-            stream=stream,
-        )
-
-        if response.status_code == 200:
-            if stream:
-                return self._handle_streaming_response(response, connection, call_id)
-            else:
-                return self._handle_non_streaming_response(response, connection, call_id)
+    def _get_circuit_breaker(self, connection: TextGenLLMConnection) -> CircuitBreaker:
+        circuit_breaker = self._circuit_breakers.get(connection.key)
+        if circuit_breaker is not None:
+            return circuit_breaker
+        with self._sessions_lock:
+            return self._circuit_breakers.setdefault(
+                connection.key,
+                CircuitBreaker(
+                    name=connection.identifier,
+                    failure_threshold=self.retry_policy.circuit_breaker_threshold,
+                    recovery_timeout=self.retry_policy.circuit_breaker_timeout,
+                ),
+            )
 
-        elif response.status_code == 429 or response.status_code == 529:
+    def _on_failed_attempt(
+        self, connection: TextGenLLMConnection, attempt: int, response=None, error: Optional[Exception] = None
+    ) -> float:
+        """Record a failed attempt and return the seconds to wait before retrying. Raises if it is not retried."""
+        status_code = response.status_code if response is not None else None
+        if self.retry_policy.is_rate_limit(status_code):
             logger.warning(
                 "Rate Limit triggered. Should not occur, since we pause before calling the request when we expect a rate limit!\n    %s"
-                % str(response.json())
-            )
-            time.sleep(60)
-            return self.do_call(
-                chat=chat, connection_id=connection_id, temperature=temperature, stream=stream, call_id=call_id
+                % response.text
             )
-        else:
+            self._get_circuit_breaker(connection).record_rate_limited()
+        elif response is not None:
             logger.warning(response.text)
-            logger.error(response.status_code)
-            return self.do_call(
-                chat=chat, connection_id=connection_id, temperature=temperature, stream=stream, call_id=call_id
+            logger.error(status_code)
+            if status_code >= 500:
+                # client errors are caused by the request, the connection itself is healthy
+                self._get_circuit_breaker(connection).record_failure()
+        else:
+            logger.warning("request to %s failed: %s", connection.uri, error)
+            self._get_circuit_breaker(connection).record_failure()
+
+        if not self.retry_policy.is_retryable(status_code) or attempt >= self.retry_policy.max_attempts:
+            raise TextGenApiError(
+                "call to %s failed after %d attempt(s)" % (connection.identifier, attempt),
+                status_code=status_code,
+                response_text=response.text if response is not None else None,
+            ) from error
+
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        delay = self.retry_policy.delay(attempt, retry_after)
+        if self.retry_policy.is_rate_limit(status_code):
+            # the rate limiter holds back this and all other callers of the connection
+            self._update_rate_limits(response, connection)
+            self._get_rate_limiter(connection).on_rate_limited(
+                fallback_seconds=delay, retry_after=delay if retry_after is not None else None
             )
+            return 0.0
+        return delay
 
-    def _handle_non_streaming_response(self, response, connection, call_id: Optional[str] = None) -> Message:
+    def _lookup_cache(
+        self, cache_key: str, call_id: Optional[str], connection: TextGenLLMConnection
+    ) -> Optional[Message]:
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            with self._usage_lock:
+                self.usage.add_cache_miss()
+            return None
+        message_dict, response_usage = entry
+        self._save_call_usage(call_id, response_usage, connection.identifier, from_cache=True)
+        return MessageFactory().from_dict(message_dict)
+
+    def _handle_non_streaming_response(
+        self,
+        response,
+        connection,
+        call_id: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        metrics: Optional[CallMetrics] = None,
+    ) -> Message:
         """Handle non-streaming response from the API."""
         response_data = response.json()
-        self._save_call_usage(call_id, response_data["usage"])
+        usage_call = self._save_call_usage(call_id, response_data["usage"], connection.identifier)
 
         self._update_rate_limits(response, connection)
 
         logger.debug(response_data["usage"])
-        if "claude" in connection.identifier:
-            message = MessageFactory().from_dict(response_data)
-        else:
-            choices = response_data["choices"]
-            assert len(choices) > 0
-            message = MessageFactory().from_dict(choices[0]["message"])
+        message = self._parse_response_message(response_data, connection)
 
+        if cache_key is not None:
+            self.cache.put(cache_key, message=message.to_dict(), usage=response_data["usage"])
+        if metrics is not None:
+            metrics.response_bytes = len(response.content)
+            metrics.output_tokens = usage_call.output_tokens
+            self._report_metrics(metrics)
         return message
 
-    def _save_call_usage(self, call_id: Optional[str], response_usage: dict):
-        """Save usage information to file if specified."""
-        self.usage.add_call(response_usage=response_usage, call_id=call_id)
+    def _parse_response_message(self, response_data: dict, connection: TextGenLLMConnection) -> Message:
+        if "claude" in connection.identifier:
+            return MessageFactory().from_dict(response_data)
+        choices = response_data["choices"]
+        assert len(choices) > 0
+        return MessageFactory().from_dict(choices[0]["message"])
 
-        if self._usage_out_file is not None:
-            with open(self._usage_out_file, "w") as f:
-                f.write(self.usage.to_dumps())
+    def _save_call_usage(
+        self,
+        call_id: Optional[str],
+        response_usage: dict,
+        connection_id: Optional[str] = None,
+        from_cache: bool = False,
+    ):
+        """Save usage information to file if specified. Returns the recorded `UsageCall`."""
+        with self._usage_lock:
+            self.usage.add_call(
+                response_usage=response_usage, call_id=call_id, from_cache=from_cache, connection_id=connection_id
+            )
+            call = self.usage.calls[-1]
+
+        if self._usage_log is not None:
+            self._usage_log.append(call)
+        return call
 
     def _handle_streaming_response(
-        self, response, connection, call_id: Optional[str] = None
-    ) -> Generator[str, None, None]:
+        self,
+        response,
+        connection,
+        call_id: Optional[str],
+        metrics: CallMetrics,
+        flight: Optional[Flight] = None,
+        stop: Optional[StopCondition] = None,
+        data: Optional[dict] = None,
+    ) -> TextGenStream:
         """Handle streaming response from the API."""
         self._update_rate_limits(response, connection)
+        chunks = response.iter_content(chunk_size=None)
+        close = response.close
+        if flight is not None:
+            # the calls that joined the flight read the same chunks, each stream parses them on its own
+            tee = ChunkTee(chunks, close=close, on_released=functools.partial(self._flights.leave, flight))
+            chunks, close = tee.reader()
+            flight.set_result((tee, "claude" in connection.identifier))
+        return TextGenStream(
+            chunks=chunks,
+            parser=SSEParser(anthropic="claude" in connection.identifier),
+            on_finish=functools.partial(self._on_stream_finished, call_id, metrics, data),
+            close=close,
+            stop=stop,
+        )
 
-        accumulated_content = ""
-        usage_data = None
-
-        try:
-            for line in response.iter_lines():
-                if line:
-                    line_str = line.decode("utf-8")
-                    if line_str.startswith("data: "):
-                        data_str = line_str[6:]  # Remove 'data: ' prefix
-
-                        if data_str.strip() == "[DONE]":
-                            break
-
-                        try:
-                            data = json.loads(data_str)
-
-                            # Handle different streaming formats
-                            if "claude" in connection.identifier:
-                                # Claude streaming format
-                                if data.get("type") == "content_block_delta":
-                                    delta = data.get("delta", {})
-                                    text = delta.get("text", "")
-                                    if text:
-                                        accumulated_content += text
-                                        yield text
-                                elif data.get("type") == "message_delta":
-                                    usage_data = data.get("usage")
-                            else:
-                                # OpenAI-compatible streaming format
-                                choices = data.get("choices", [])
-                                if choices:
-                                    delta = choices[0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        accumulated_content += content
-                                        yield content
-
-                                # Check for usage information
-                                if "usage" in data:
-                                    usage_data = data["usage"]
-
-                        except json.JSONDecodeError:
-                            logger.warning(f"Failed to parse streaming data: {data_str}")
-                            continue
-
-        except Exception as e:
-            logger.error(f"Error during streaming: {e}")
-            raise
+    def _on_stream_finished(
+        self,
+        call_id: Optional[str],
+        metrics: CallMetrics,
+        data: Optional[dict],
+        stream: Union[TextGenStream, AsyncTextGenStream],
+    ):
+        usage_call = None
+        response_usage = stream.usage
+        if stream.stopped:
+            # closed before the provider reported the final usage, the tokens received were generated at least
+            output_tokens = sum(get_token_counter("cl100k_base").count([stream.text]))
+            if response_usage and "output_tokens" in response_usage:
+                # Anthropic reports the input tokens at the start, the output tokens only once the message is complete
+                response_usage = {
+                    **response_usage,
+                    "output_tokens": max(response_usage["output_tokens"], output_tokens),
+                }
+            elif not response_usage and data is not None:
+                # OpenAI-compatible providers report the usage in the last chunk only, the prompt is estimated
+                response_usage = {
+                    "prompt_tokens": self._num_prompt_tokens(data, token_encoding_name="cl100k_base"),
+                    "completion_tokens": output_tokens,
+                }
+        if response_usage and not metrics.coalesced:  # the usage of a shared stream is recorded by its leader only
+            usage_call = self._save_call_usage(call_id, response_usage, metrics.connection_id)
+        metrics.response_bytes = stream.received_bytes
+        if stream.first_text_time is not None:
+            metrics.time_to_first_token = stream.first_text_time - metrics.started
+        if usage_call is not None:
+            metrics.output_tokens = usage_call.output_tokens
+        self._report_metrics(metrics)
 
-        # Add usage information if available
-        if usage_data and call_id:
-            self._save_call_usage(call_id, usage_data)
+    def _report_metrics(self, metrics: CallMetrics):
+        """Pass the metrics of a finished call to the callbacks. A failing callback does not fail the call."""
+        metrics.latency = time.perf_counter() - metrics.started
+        for callback in self.metrics_callbacks:
+            try:
+                callback(metrics)
+            except Exception:
+                logger.exception("metrics callback %r failed", callback)
 
     def _update_rate_limits(self, response, connection):
         """Update rate limit information from response headers."""
-        if (
-            connection.ratelimit_remaining_tokens_key is not None
-            and connection.ratelimit_remaining_tokens_key in response.headers
+        rate_limiter = self._get_rate_limiter(connection)
+        for bucket, remaining_key, reset_key, limit_key in (
+            (
+                rate_limiter.tokens,
+                connection.ratelimit_remaining_tokens_key,
+                connection.ratelimit_reset_key,
+                connection.ratelimit_limit_tokens_key,
+            ),
+            (
+                rate_limiter.requests,
+                connection.ratelimit_remaining_requests_key,
+                connection.ratelimit_reset_requests_key,
+                connection.ratelimit_limit_requests_key,
+            ),
         ):
-            self.remaining_tokens = int(response.headers[connection.ratelimit_remaining_tokens_key])
-            if "claude" in connection.identifier:
-                self.resets_tokens_at = datetime.strptime(
-                    response.headers[connection.ratelimit_reset_key], "%Y-%m-%dT%H:%M:%SZ"
-                )
-            else:
-                self.resets_tokens_at = datetime.now() + parse_timedelta(
-                    response.headers[connection.ratelimit_reset_key]
-                )
+            if remaining_key is None or remaining_key not in response.headers:
+                continue
+            reset_in_seconds = None
+            if reset_key is not None and reset_key in response.headers:
+                reset_in_seconds = self._parse_ratelimit_reset(response.headers[reset_key], connection)
+            limit = None
+            if limit_key is not None and limit_key in response.headers:
+                limit = int(response.headers[limit_key])
+            bucket.seed(remaining=int(response.headers[remaining_key]), reset_in_seconds=reset_in_seconds, limit=limit)
+
+    def _parse_ratelimit_reset(self, value: str, connection: TextGenLLMConnection) -> float:
+        if "claude" in connection.identifier:
+            resets_at = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            return (resets_at - datetime.now(timezone.utc)).total_seconds()
+        return parse_timedelta(value).total_seconds()
 
     def stream_call(
         self,
@@ -253,28 +709,675 @@ class TextGenApi:
         connection_id: Optional[str] = None,
         temperature: Optional[float] = None,
         call_id: Optional[str] = None,
-    ) -> Generator[str, None, None]:
+        stop: Optional[StopCondition] = None,
+    ) -> TextGenStream:
         """
         Convenience method for streaming calls.
-        Returns a generator that yields text chunks as they arrive from the LLM.
+        Returns an iterator that yields text chunks as they arrive from the LLM.
+        Once it is exhausted, the complete message and the usage are available as `message` and `usage`.
 
         Args:
             chat: The conversation to send to the LLM
             connection_id: Optional connection identifier
             temperature: Optional temperature override
             call_id: Optional call identifier for usage tracking
+            stop: Optional condition that ends the stream early, the message holds the text up to it
+
+        Returns:
+            TextGenStream yielding text chunks as strings
+        """
+        return self.do_call(
+            chat=chat, connection_id=connection_id, temperature=temperature, stream=True, call_id=call_id, stop=stop
+        )
+
+    @overload
+    def do_batch(
+        self,
+        chats: Sequence[Chat],
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_concurrency: int = 8,
+        call_ids: Optional[Sequence[Optional[str]]] = None,
+        ordered: bool = True,
+    ) -> List[BatchResult]: ...
+    @overload
+    def do_batch(
+        self,
+        chats: Sequence[Chat],
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_concurrency: int = 8,
+        call_ids: Optional[Sequence[Optional[str]]] = None,
+        ordered: bool = False,
+    ) -> Generator[BatchResult, None, None]: ...
+
+    def do_batch(
+        self,
+        chats: Sequence[Chat],
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_concurrency: int = 8,
+        call_ids: Optional[Sequence[Optional[str]]] = None,
+        ordered: bool = True,
+    ) -> Union[List[BatchResult], Generator[BatchResult, None, None]]:
+        """
+        Run many chats through `do_call` on a pool of `max_concurrency` worker threads.
+        A failing chat does not abort the batch, its exception is reported in the corresponding result.
+        Usage of all calls is recorded in `self.usage`.
+
+        Args:
+            chats: The conversations to send to the LLM
+            connection_id: Optional connection identifier
+            temperature: Optional temperature override
+            max_concurrency: Number of calls in flight at the same time
+            call_ids: Optional call identifiers for usage tracking, one per chat
+            ordered: Return a list in input order, otherwise yield results as they complete
 
         Returns:
-            Generator yielding text chunks as strings
+            List or Generator of BatchResult
         """
-        result = self.do_call(
-            chat=chat, connection_id=connection_id, temperature=temperature, stream=True, call_id=call_id
+        if call_ids is not None:
+            assert len(call_ids) == len(chats), "call_ids must have the same length as chats"
+        results = self._iter_batch(
+            chats=chats,
+            connection_id=connection_id,
+            temperature=temperature,
+            max_concurrency=max_concurrency,
+            call_ids=call_ids,
         )
-        if isinstance(result, Generator):
-            yield from result
+        if not ordered:
+            return results
+        ordered_results: List[Optional[BatchResult]] = [None] * len(chats)
+        for result in results:
+            ordered_results[result.index] = result
+        return ordered_results
+
+    def _iter_batch(
+        self,
+        chats: Sequence[Chat],
+        connection_id: Optional[str],
+        temperature: Optional[float],
+        max_concurrency: int,
+        call_ids: Optional[Sequence[Optional[str]]],
+    ) -> Generator[BatchResult, None, None]:
+        assert max_concurrency > 0
+
+        def run(index: int, call_id: Optional[str]) -> BatchResult:
+            try:
+                message = self.do_call(
+                    chat=chats[index], connection_id=connection_id, temperature=temperature, call_id=call_id
+                )
+                return BatchResult(index=index, call_id=call_id, message=message)
+            except Exception as e:
+                logger.warning("batch item %d failed: %s", index, e)
+                return BatchResult(index=index, call_id=call_id, error=e)
+
+        # only keep a bounded window of futures alive, batches can contain 100k+ chats
+        pending_indices = iter(range(len(chats)))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures: set[Future] = set()
+            while True:
+                for index in pending_indices:
+                    futures.add(executor.submit(run, index, call_ids[index] if call_ids is not None else None))
+                    if len(futures) >= 2 * max_concurrency:
+                        break
+                if len(futures) == 0:
+                    return
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def submit_batch_job(
+        self,
+        chats: Sequence[Chat],
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        call_ids: Optional[Sequence[Optional[str]]] = None,
+        job_file: Optional[str] = None,
+    ) -> BatchJob:
+        """
+        Submit the chats to the asynchronous batch endpoint of the provider (OpenAI Batches, Anthropic Message
+        Batches), which is cheaper and has separate, higher rate limits, but answers within hours instead of seconds.
+        Collect the results with `wait_batch_job`.
+
+        Args:
+            chats: The conversations to send to the LLM
+            connection_id: Optional connection identifier
+            temperature: Optional temperature override
+            call_ids: Optional call identifiers for usage tracking, one per chat. They are sent as the custom ids of
+                the requests and must be unique (Anthropic allows at most 64 letters, digits, `-` and `_`)
+            job_file: Save the job to this file as soon as it was submitted, to resume with `BatchJob.load`
+
+        Returns:
+            The submitted BatchJob
+        """
+        if call_ids is not None:
+            assert len(call_ids) == len(chats), "call_ids must have the same length as chats"
+        call_ids = list(call_ids) if call_ids is not None else [None] * len(chats)
+        custom_ids = [BatchJob.custom_id(index, call_id) for index, call_id in enumerate(call_ids)]
+        assert len(set(custom_ids)) == len(custom_ids), "call_ids must be unique"
+
+        connection = self._select_connection(connection_id)
+        bodies = []
+        for chat in chats:
+            data = self._build_request_data(chat=chat, connection=connection, temperature=temperature, stream=False)
+            del data["stream"]
+            bodies.append(self._encode_request_data(chat, connection, data))
+
+        if "claude" in connection.identifier:
+            requests_json = b",".join(
+                b'{"custom_id":%s,"params":%s}' % (json.dumps(custom_id).encode("utf-8"), body)
+                for custom_id, body in zip(custom_ids, bodies)
+            )
+            response = self._batch_request(
+                connection,
+                "POST",
+                self._batch_url(connection, connection.path + "/batches"),
+                data=b'{"requests":[%s]}' % requests_json,
+            )
+            state = response.json()
         else:
-            # Fallback if streaming is not supported - yield the complete message
-            yield result.content[0].text if hasattr(result, "content") and result.content else str(result)
+            endpoint = json.dumps("/" + connection.path).encode("utf-8")
+            jsonl = b"".join(
+                b'{"custom_id":%s,"method":"POST","url":%s,"body":%s}\n'
+                % (json.dumps(custom_id).encode("utf-8"), endpoint, body)
+                for custom_id, body in zip(custom_ids, bodies)
+            )
+            response = self._batch_request(
+                connection,
+                "POST",
+                self._openai_batch_url(connection, "files"),
+                data={"purpose": "batch"},
+                files={"file": ("batch.jsonl", jsonl, "application/jsonl")},
+                headers={"Content-Type": None},  # set by requests, with the multipart boundary
+            )
+            response = self._batch_request(
+                connection,
+                "POST",
+                self._openai_batch_url(connection, "batches"),
+                json={
+                    "input_file_id": response.json()["id"],
+                    "endpoint": "/" + connection.path,
+                    "completion_window": "24h",
+                },
+            )
+            state = response.json()
+
+        job = BatchJob(
+            id=state["id"],
+            connection_id=connection.identifier,
+            call_ids=call_ids,
+            status=state.get("processing_status", state.get("status")),
+        )
+        logger.info("submitted batch job %s with %d requests to %s", job.id, len(chats), connection.identifier)
+        if job_file is not None:
+            job.save(job_file)
+        return job
+
+    def poll_batch_job(self, job: BatchJob) -> BatchJob:
+        """Update the status of the job, see `BatchJob.finished`."""
+        self._poll_batch_job(self._select_connection(job.connection_id), job)
+        return job
+
+    def wait_batch_job(
+        self, job: BatchJob, poll_interval: float = 60.0, timeout: Optional[float] = None
+    ) -> List[BatchResult]:
+        """
+        Poll the job every `poll_interval` seconds until it finished and return its results in input order.
+        Usage of the answered requests is recorded in `self.usage`. Requests that failed, expired or were cancelled
+        are reported in their result. If the job only knows its id, the results are in the order of the provider
+        and their call_id is the custom id of the request.
+
+        Raises:
+            TimeoutError: The job did not finish within `timeout` seconds, wait again to resume
+            TextGenApiError: The provider rejected the job as a whole
+        """
+        connection = self._select_connection(job.connection_id)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        state = self._poll_batch_job(connection, job)
+        while not job.finished:
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                raise TimeoutError("batch job %s is still %s" % (job.id, job.status))
+            time.sleep(poll_interval)
+            state = self._poll_batch_job(connection, job)
+        if job.status == "failed":
+            raise TextGenApiError("batch job %s failed: %s" % (job.id, json.dumps(state.get("errors"))))
+
+        custom_ids = job.custom_ids()
+        indices = {custom_id: index for index, custom_id in enumerate(custom_ids)} if custom_ids is not None else {}
+        results: Dict[int, BatchResult] = {}
+        for custom_id, response_data, error in self._iter_batch_job_results(connection, job, state):
+            index = indices.get(custom_id, len(results)) if custom_ids is not None else len(results)
+            call_id = job.call_ids[index] if custom_ids is not None else custom_id
+            if error is not None:
+                results[index] = BatchResult(index=index, call_id=call_id, error=error)
+                continue
+            self._save_call_usage(call_id, response_data["usage"], connection.identifier)
+            message = self._parse_response_message(response_data, connection)
+            results[index] = BatchResult(index=index, call_id=call_id, message=message)
+
+        for index, custom_id in enumerate(custom_ids or ()):
+            if index not in results:
+                error = TextGenApiError("batch job %s has no result for %s" % (job.id, custom_id))
+                results[index] = BatchResult(index=index, call_id=job.call_ids[index], error=error)
+        return [results[index] for index in sorted(results)]
+
+    def _poll_batch_job(self, connection: TextGenLLMConnection, job: BatchJob) -> dict:
+        if "claude" in connection.identifier:
+            url = self._batch_url(connection, "%s/batches/%s" % (connection.path, job.id))
+            state = self._batch_request(connection, "GET", url).json()
+            job.status = state["processing_status"]
+        else:
+            url = self._openai_batch_url(connection, "batches/%s" % job.id)
+            state = self._batch_request(connection, "GET", url).json()
+            job.status = state["status"]
+        logger.debug("batch job %s is %s", job.id, job.status)
+        return state
+
+    def _iter_batch_job_results(
+        self, connection: TextGenLLMConnection, job: BatchJob, state: dict
+    ) -> Generator[Tuple[str, Optional[dict], Optional[TextGenApiError]], None, None]:
+        """(custom id, response data, error) of every request in the results of a finished job."""
+        if "claude" in connection.identifier:
+            url = state.get("results_url") or self._batch_url(
+                connection, "%s/batches/%s/results" % (connection.path, job.id)
+            )
+            for record in self._iter_jsonl(connection, url):
+                result = record["result"]
+                if result["type"] == "succeeded":
+                    yield record["custom_id"], result["message"], None
+                else:
+                    error = TextGenApiError(
+                        "batch request %s %s" % (record["custom_id"], result["type"]),
+                        response_text=json.dumps(result.get("error")) if "error" in result else None,
+                    )
+                    yield record["custom_id"], None, error
+            return
+
+        # the successful requests are in the output file, the failed ones in the error file
+        for file_id in (state.get("output_file_id"), state.get("error_file_id")):
+            if file_id is None:
+                continue
+            for record in self._iter_jsonl(
+                connection, self._openai_batch_url(connection, "files/%s/content" % file_id)
+            ):
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    yield record["custom_id"], response["body"], None
+                else:
+                    error = TextGenApiError(
+                        "batch request %s failed" % record["custom_id"],
+                        status_code=response.get("status_code"),
+                        response_text=json.dumps(record.get("error") or response.get("body")),
+                    )
+                    yield record["custom_id"], None, error
+
+    def _iter_jsonl(self, connection: TextGenLLMConnection, url: str) -> Generator[dict, None, None]:
+        """Result files can be hundreds of megabytes, parse them line by line while they are downloaded."""
+        response = self._batch_request(connection, "GET", url, stream=True)
+        try:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def _batch_url(self, connection: TextGenLLMConnection, path: str) -> str:
+        return "%s://%s/%s" % (connection.protocol, connection.host, path)
+
+    def _openai_batch_url(self, connection: TextGenLLMConnection, path: str) -> str:
+        """Files and batches live next to the chat completions endpoint, e.g. `v1/files`."""
+        prefix = connection.path[: -len("chat/completions")] if connection.path.endswith("chat/completions") else "v1/"
+        return self._batch_url(connection, prefix + path)
+
+    def _batch_request(self, connection: TextGenLLMConnection, method: str, url: str, **kwargs) -> requests.Response:
+        """Request to the batch endpoints, retried according to the retry policy."""
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            error = None
+            try:
+                response = self._get_session(connection).request(
+                    method, url, timeout=(connection.connect_timeout, connection.read_timeout), **kwargs
+                )
+                if response.status_code < 300:
+                    return response
+            except requests.RequestException as e:
+                error = e
+            status_code = response.status_code if response is not None else None
+            if not self.retry_policy.is_retryable(status_code) or attempt >= self.retry_policy.max_attempts:
+                raise TextGenApiError(
+                    "%s %s failed after %d attempt(s)" % (method, url, attempt),
+                    status_code=status_code,
+                    response_text=response.text if response is not None else None,
+                ) from error
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            logger.warning("%s %s failed (%s), retrying", method, url, status_code if error is None else error)
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    async def acall(
+        self,
+        chat: Chat,
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        call_id: Optional[str] = None,
+        hedge: bool = False,
+        stop: Optional[StopCondition] = None,
+    ) -> Message:
+        """
+        Asynchronous counterpart of `do_call` for non-streaming calls.
+        At most `connection.max_concurrent_requests` calls are in flight per connection, further calls wait.
+
+        Args:
+            chat: The conversation to send to the LLM
+            connection_id: Optional connection identifier
+            temperature: Optional temperature override
+            call_id: Optional call identifier for usage tracking
+            hedge: Send the chat to a second connection if the first one is slow, the slower request is cancelled
+            stop: Optional condition that ends the completion early, it is streamed to check the condition
+
+        Returns:
+            The message returned by the LLM
+        """
+        if stop is not None:
+            assert not hedge, "calls with a stop condition cannot be hedged"
+            return await self.astream(
+                chat=chat, connection_id=connection_id, temperature=temperature, call_id=call_id, stop=stop
+            ).read()
+        if hedge:
+            return await self._ahedged_call(
+                chat=chat, connection_id=connection_id, temperature=temperature, call_id=call_id
+            )
+        return await self._acall(chat=chat, connection_id=connection_id, temperature=temperature, call_id=call_id)
+
+    async def _ahedged_call(
+        self, chat: Chat, connection_id: Optional[str], temperature: Optional[float], call_id: Optional[str]
+    ) -> Message:
+        primary = self._select_connection(connection_id)
+        # the hedge delay starts once the primary was sent, not while it waits for rate limits or a concurrency slot
+        sent = asyncio.Event()
+        primary_task = asyncio.ensure_future(
+            self._acall(chat, connection_id, temperature, call_id, primary, on_sent=sent.set)
+        )
+        primary_task.add_done_callback(lambda _: sent.set())
+        tasks: Dict[asyncio.Task, bool] = {primary_task: False}
+        pending = set(tasks)
+        try:
+            await sent.wait()
+            done, pending = await asyncio.wait(pending, timeout=self._hedge_delay(primary))
+            secondary = self._select_hedge_connection(primary) if len(done) == 0 else None
+            if secondary is not None:
+                logger.info("hedging call to %s with %s", primary.uri, secondary.uri)
+                with self._usage_lock:
+                    self.usage.add_hedge()
+                hedge = asyncio.ensure_future(self._acall(chat, connection_id, temperature, call_id, secondary, False))
+                tasks[hedge] = True
+                pending.add(hedge)
+
+            errors = []
+            while True:
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    if tasks[task]:
+                        with self._usage_lock:
+                            self.usage.add_hedge_win()
+                    return task.result()
+                if len(pending) == 0:
+                    raise errors[0]
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # cancelling the loser aborts its request and frees its concurrency slot, its prompt is recorded in usage
+            for task in pending:
+                task.cancel()
+
+    async def _acall(
+        self,
+        chat: Chat,
+        connection_id: Optional[str],
+        temperature: Optional[float],
+        call_id: Optional[str],
+        connection: Optional[TextGenLLMConnection] = None,
+        lookup_cache: bool = True,
+        on_sent: Optional[Callable[[], None]] = None,
+    ) -> Message:
+        if connection is None:
+            connection = self._select_connection(connection_id)
+        logger.debug("call llm with %s", connection)
+        metrics = CallMetrics(connection_id=connection.identifier, call_id=call_id)
+        data = self._build_request_data(chat=chat, connection=connection, temperature=temperature, stream=False)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.key(data)
+            cached_message = self._lookup_cache(cache_key, call_id, connection) if lookup_cache else None
+            if cached_message is not None:
+                metrics.from_cache = True
+                self._report_metrics(metrics)
+                return cached_message
+
+        httpx = _import_httpx()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                if attempt > 1:
+                    connection, data = self._route_retry(connection_id, chat, temperature, False, connection, data)
+                metrics.connection_id = connection.identifier
+                metrics.retries = attempt - 1
+                circuit_breaker = self._get_circuit_breaker(connection)
+                with circuit_breaker.attempt():
+                    metrics.queue_wait += await self._async_wait_for_rate_limit(connection, data)
+                    client = self._get_async_client(connection)
+                    body = self._encode_request_data(chat, connection, data)
+                    metrics.request_bytes = len(body)
+                    sent = None
+                    try:
+                        waiting = time.perf_counter()
+                        async with self._get_async_semaphore(connection):
+                            sent = time.perf_counter()
+                            metrics.queue_wait += sent - waiting
+                            if on_sent is not None:
+                                on_sent()
+                            with self.connections.router.track(connection) as tracked_call:
+                                # streamed, so the time to the headers can be told apart from the time to read the body
+                                async with client.stream(
+                                    "POST", connection.uri, content=body, headers=JSON_HEADERS
+                                ) as response:
+                                    metrics.time_to_first_byte = time.perf_counter() - sent
+                                    await response.aread()
+                                tracked_call.end(success=response.status_code == 200)
+                    except httpx.TransportError as e:
+                        delay = self._on_failed_attempt(connection, attempt, error=e)
+                    except asyncio.CancelledError:
+                        if sent is not None:
+                            # e.g. the loser of a hedged call. The prompt was sent and is charged, the output tokens
+                            # generated until the request was aborted are not known
+                            prompt_tokens = self._num_prompt_tokens(data, token_encoding_name="cl100k_base")
+                            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": 0}
+                            self._save_call_usage(call_id, usage, connection.identifier)
+                        raise
+                    else:
+                        if response.status_code == 200:
+                            circuit_breaker.record_success()
+                            return self._handle_non_streaming_response(
+                                response, connection, call_id, cache_key, metrics
+                            )
+                        delay = self._on_failed_attempt(connection, attempt, response=response)
+                # back off after the attempt ended, a half-open trial must not hold the circuit while waiting
+                await asyncio.sleep(delay)
+        except Exception:
+            metrics.success = False
+            self._report_metrics(metrics)
+            raise
+
+    def astream(
+        self,
+        chat: Chat,
+        connection_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        call_id: Optional[str] = None,
+        stop: Optional[StopCondition] = None,
+    ) -> AsyncTextGenStream:
+        """
+        Asynchronous counterpart of `stream_call`.
+        The request is sent on the first iteration. The connection's concurrency slot is held until the stream is
+        exhausted or closed, use it as `async with` block to close it when leaving the loop early. Once it is
+        exhausted, the complete message and the usage are available as `message` and `usage`.
+
+        Args:
+            chat: The conversation to send to the LLM
+            connection_id: Optional connection identifier
+            temperature: Optional temperature override
+            call_id: Optional call identifier for usage tracking
+            stop: Optional condition that ends the stream early, the message holds the text up to it
+
+        Returns:
+            AsyncTextGenStream yielding text chunks as strings
+        """
+        connection = self._select_connection(connection_id)
+        logger.debug("call llm with %s", connection)
+        data = self._build_request_data(chat=chat, connection=connection, temperature=temperature, stream=True)
+        metrics = CallMetrics(connection_id=connection.identifier, call_id=call_id, stream=True)
+        return AsyncTextGenStream(
+            chunks=self._astream_chunks(connection_id, chat, temperature, connection, data, metrics),
+            parser=SSEParser(anthropic="claude" in connection.identifier),
+            on_finish=functools.partial(self._on_stream_finished, call_id, metrics, data),
+            stop=stop,
+        )
+
+    async def _astream_chunks(
+        self,
+        connection_id: Optional[str],
+        chat: Chat,
+        temperature: Optional[float],
+        connection: TextGenLLMConnection,
+        data: dict,
+        metrics: CallMetrics,
+    ) -> AsyncGenerator[bytes, None]:
+        """Raw body chunks of the first successful streaming attempt."""
+        httpx = _import_httpx()
+        attempt = 0
+        streaming = False
+        try:
+            while True:
+                attempt += 1
+                if attempt > 1:
+                    connection, data = self._route_retry(connection_id, chat, temperature, True, connection, data)
+                metrics.connection_id = connection.identifier
+                metrics.retries = attempt - 1
+                circuit_breaker = self._get_circuit_breaker(connection)
+                with circuit_breaker.attempt():
+                    metrics.queue_wait += await self._async_wait_for_rate_limit(connection, data)
+                    client = self._get_async_client(connection)
+                    try:
+                        waiting = time.perf_counter()
+                        async with self._get_async_semaphore(connection):
+                            sent = time.perf_counter()
+                            metrics.queue_wait += sent - waiting
+                            with self.connections.router.track(connection) as tracked_call:
+                                body = self._encode_request_data(chat, connection, data)
+                                metrics.request_bytes = len(body)
+                                async with client.stream(
+                                    "POST", connection.uri, content=body, headers=JSON_HEADERS
+                                ) as response:
+                                    tracked_call.end(success=response.status_code == 200)
+                                    if response.status_code == 200:
+                                        metrics.time_to_first_byte = time.perf_counter() - sent
+                                        circuit_breaker.record_success()
+                                        self._update_rate_limits(response, connection)
+                                        streaming = True
+                                        async for chunk in response.aiter_bytes():
+                                            yield chunk
+                                        return
+                                    await response.aread()
+                    except httpx.TransportError as e:
+                        if streaming:
+                            # chunks were already handed out, a retry would repeat them
+                            raise
+                        delay = self._on_failed_attempt(connection, attempt, error=e)
+                    else:
+                        delay = self._on_failed_attempt(connection, attempt, response=response)
+                # back off after the attempt ended, a half-open trial must not hold the circuit while waiting
+                await asyncio.sleep(delay)
+        except Exception:
+            metrics.success = False
+            self._report_metrics(metrics)
+            raise
+
+    async def _async_wait_for_rate_limit(self, connection: TextGenLLMConnection, data: dict) -> float:
+        """Returns the seconds waited."""
+        seconds_to_sleep = self._reserve_rate_limit(connection, data)
+        if seconds_to_sleep > 0:
+            logger.info("Waiting until rate limits reset (%d seconds)" % seconds_to_sleep)
+            await asyncio.sleep(seconds_to_sleep)
+            return seconds_to_sleep
+        return 0.0
+
+    def _connection_headers(self, connection: TextGenLLMConnection) -> Dict[str, str]:
+        headers = {**self.headers, **connection.additional_headers}
+        if not connection.gzip:
+            headers["Accept-Encoding"] = "identity"
+        return headers
+
+    def _get_session(self, connection: TextGenLLMConnection) -> requests.Session:
+        """Keep-alive session of the connection, reused across calls, streams and retries."""
+        session = self._sessions.get(connection.key)
+        if session is not None:
+            return session
+        with self._sessions_lock:
+            if connection.key not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connection.pool_size)
+                session.mount(f"{connection.protocol}://", adapter)
+                session.headers.update(self._connection_headers(connection))
+                session.verify = False
+                self._sessions[connection.key] = session
+            return self._sessions[connection.key]
+
+    def _get_async_client(self, connection: TextGenLLMConnection):
+        httpx = _import_httpx()
+        clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+        if connection.key not in clients:
+            clients[connection.key] = httpx.AsyncClient(
+                headers=self._connection_headers(connection),
+                verify=False,
+                timeout=httpx.Timeout(None, connect=connection.connect_timeout, read=connection.read_timeout),
+                limits=httpx.Limits(
+                    max_connections=connection.max_concurrent_requests,
+                    max_keepalive_connections=connection.pool_size,
+                ),
+            )
+        return clients[connection.key]
+
+    def _get_async_semaphore(self, connection: TextGenLLMConnection) -> asyncio.Semaphore:
+        semaphores: Dict[str, asyncio.Semaphore] = self._async_semaphores.setdefault(asyncio.get_running_loop(), {})
+        if connection.key not in semaphores:
+            # an unbounded connection still gets a semaphore, it is just never contended
+            limit = connection.max_concurrent_requests
+            semaphores[connection.key] = asyncio.Semaphore(limit if limit is not None else 2**31 - 1)
+        return semaphores[connection.key]
+
+    async def aclose(self):
+        """Close the HTTP clients of the running event loop."""
+        for client in self._async_clients.pop(asyncio.get_running_loop(), {}).values():
+            await client.aclose()
+
+    def close(self):
+        """Close the pooled HTTP sessions and the usage log. Sessions are recreated on the next call."""
+        if self._usage_log is not None:
+            self._usage_log.close()
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+    def __enter__(self) -> "TextGenApi":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def _num_tokens_consumed_from_request(
         self,
@@ -287,30 +1390,56 @@ class TextGenApi:
         # else:
         #     api_endpoint = api_endpoint.split("v1/")[1]
 
-        encoding = tiktoken.get_encoding(token_encoding_name)
         # if completions request, tokens = prompt + n * max_tokens
         max_tokens = request_json.get("max_tokens")
         if max_tokens is None:
             max_tokens = 15
         n = request_json.get("n", 1)
         completion_tokens = n * max_tokens
+        return self._num_prompt_tokens(request_json, token_encoding_name) + completion_tokens
 
+    def _num_prompt_tokens(self, request_json: dict, token_encoding_name: str) -> int:
+        """Estimated number of tokens of the messages in the request."""
         # chat completions
         num_tokens = 0
+        texts = []
         for message in request_json["messages"]:
             num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
             assert "role" in message
             assert "content" in message
             if isinstance(message["content"], str):
-                num_tokens += len(encoding.encode(message["content"]))
+                texts.append(message["content"])
             else:
                 for message_content in message["content"]:
                     for key, value in message_content.items():
                         if key == "cache_control":
                             continue
-                        value = "".join([v if isinstance(v, str) else v["text"] for v in value])
-                        num_tokens += len(encoding.encode(value))
+                        texts.append("".join([v if isinstance(v, str) else v["text"] for v in value]))
                         if key == "name":  # if there's a name, the role is omitted
                             num_tokens -= 1  # role is always required and always 1 token
+        num_tokens += sum(get_token_counter(token_encoding_name).count(texts))
         num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens + completion_tokens
+        return num_tokens
+
+
+def _import_httpx():
+    """httpx is only needed for the async api, so it is imported on first use."""
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError("acall/astream require httpx, install with `pip install llm-utils[async]`")
+    return httpx
+
+
+def _run_in_thread(function: Callable[[], Any]) -> Future:
+    """Run `function` on a new daemon thread, its result or exception is set on the returned future."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="textgen-hedge", daemon=True).start()
+    return future
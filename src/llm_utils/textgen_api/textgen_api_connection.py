@@ -17,11 +17,28 @@ class TextGenLLMConnection:
     max_tokens: Optional[int] = None
     ratelimit_remaining_tokens_key: Optional[str] = "x-ratelimit-remaining-tokens"
     ratelimit_reset_key: Optional[str] = "x-ratelimit-reset-tokens"
+    ratelimit_limit_tokens_key: Optional[str] = "x-ratelimit-limit-tokens"
+    ratelimit_remaining_requests_key: Optional[str] = "x-ratelimit-remaining-requests"
+    ratelimit_reset_requests_key: Optional[str] = "x-ratelimit-reset-requests"
+    ratelimit_limit_requests_key: Optional[str] = "x-ratelimit-limit-requests"
+    tokens_per_minute: Optional[int] = None  # initial token budget until the provider reports its limits
+    requests_per_minute: Optional[int] = None  # initial request budget until the provider reports its limits
     additional_params: Dict[str, Any] = field(default_factory=dict)
+    max_concurrent_requests: Optional[int] = None  # caps in-flight async requests, None = unbounded
+    pool_size: int = 10  # number of keep-alive connections kept open to the host
+    connect_timeout: Optional[float] = None  # seconds, None = wait forever
+    read_timeout: Optional[float] = None  # seconds between received bytes, None = wait forever
+    gzip: bool = True  # accept gzip-compressed responses
+    max_cache_breakpoints: int = 4  # prompt cache breakpoints per request, only used for claude models
 
     def __post_init__(self):
         self.model_dir = self.model.replace("/", "-").replace(":", "-")
 
+    @property
+    def key(self) -> str:
+        """Unique key of the endpoint, used to keep per-connection state such as concurrency limits."""
+        return f"{self.identifier}@{self.uri}"
+
     @property
     def host(self) -> str:
         return self.ip_address + ":" + str(self.port)
@@ -46,6 +63,10 @@ class TextGenLLMConnection:
             cheap=True,
             ratelimit_remaining_tokens_key=None,
             ratelimit_reset_key=None,
+            ratelimit_limit_tokens_key=None,
+            ratelimit_remaining_requests_key=None,
+            ratelimit_reset_requests_key=None,
+            ratelimit_limit_requests_key=None,
         )
 
     @staticmethod
@@ -120,6 +141,10 @@ class TextGenLLMConnection:
             max_tokens=8192,
             ratelimit_remaining_tokens_key="anthropic-ratelimit-tokens-remaining",
             ratelimit_reset_key="anthropic-ratelimit-tokens-reset",
+            ratelimit_limit_tokens_key="anthropic-ratelimit-tokens-limit",
+            ratelimit_remaining_requests_key="anthropic-ratelimit-requests-remaining",
+            ratelimit_reset_requests_key="anthropic-ratelimit-requests-reset",
+            ratelimit_limit_requests_key="anthropic-ratelimit-requests-limit",
         )
 
     @staticmethod
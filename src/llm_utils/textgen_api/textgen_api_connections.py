@@ -1,13 +1,17 @@
 import re
-from dataclasses import dataclass
-from typing import Callable, Dict, List
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
 
+from llm_utils.textgen_api.connection_router import ConnectionRouter
 from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
 
 
 @dataclass
 class TextGenLLMConnections:
     connections: List[TextGenLLMConnection]
+    # spread calls across all connections sharing an identifier, weighted by their observed latency and health
+    routing: bool = False
+    router: ConnectionRouter = field(default_factory=ConnectionRouter, repr=False, compare=False)
 
     def cheap_connection_id(self) -> str:
         return next(filter(lambda c: c.cheap, self.connections), self.connections[0]).identifier
@@ -15,12 +19,28 @@ class TextGenLLMConnections:
     def expensive_connection_id(self) -> str:
         return next(filter(lambda c: not c.cheap, self.connections), self.connections[0]).identifier
 
-    def get_connection(self, identifier: str) -> TextGenLLMConnection:
-        """get connection, fallback to first entry"""
-        for connection in self.connections:
-            if connection.identifier == identifier:
-                return connection
-        return self.get_connection(self.expensive_connection_id())
+    def get_connection(
+        self, identifier: str, is_available: Optional[Callable[[TextGenLLMConnection], bool]] = None
+    ) -> TextGenLLMConnection:
+        """
+        get connection, fallback to first entry.
+        With routing, the router picks among all connections with this identifier, preferring available ones.
+        """
+        candidates = [connection for connection in self.connections if connection.identifier == identifier]
+        if len(candidates) == 0:
+            return self.get_connection(self.expensive_connection_id(), is_available)
+        if not self.routing:
+            return candidates[0]
+        return self.router.choose(candidates, is_available)
+
+    def get_alternative_connection(
+        self, connection: TextGenLLMConnection, is_available: Optional[Callable[[TextGenLLMConnection], bool]] = None
+    ) -> TextGenLLMConnection:
+        """Another connection with the same identifier, e.g. to hedge a call. The connection itself if there is none."""
+        candidates = [c for c in self.connections if c.identifier == connection.identifier and c.key != connection.key]
+        if len(candidates) == 0:
+            return connection
+        return self.router.choose(candidates, is_available)
 
     @staticmethod
     def all_connections() -> Dict[str, Callable[[], TextGenLLMConnection]]:
@@ -40,6 +60,16 @@ class TextGenLLMConnections:
 
     @staticmethod
     def default(connection: str) -> "TextGenLLMConnections":
+        """Comma-separated connections (e.g. `self-hosted:10.0.0.1:8000,self-hosted:10.0.0.2:8000`) are routed."""
+        if "," in connection:
+            return TextGenLLMConnections(
+                connections=[TextGenLLMConnections._default_connection(c.strip()) for c in connection.split(",")],
+                routing=True,
+            )
+        return TextGenLLMConnections(connections=[TextGenLLMConnections._default_connection(connection)])
+
+    @staticmethod
+    def _default_connection(connection: str) -> TextGenLLMConnection:
         if "self-hosted" in connection:
             match = re.match(r"self-hosted:(.*):(\d+)", connection)
             assert match is not None
@@ -62,4 +92,4 @@ class TextGenLLMConnections:
         else:
             conn = TextGenLLMConnections.all_connections()[connection]()
 
-        return TextGenLLMConnections(connections=[conn])
+        return conn
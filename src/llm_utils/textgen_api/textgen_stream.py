@@ -0,0 +1,199 @@
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+from llm_utils.openai_api.message import Message
+from llm_utils.openai_api.message_role import MessageRole
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.textgen_api.sse_parser import SSEParser
+from llm_utils.textgen_api.stop_condition import StopCondition
+
+
+class _StreamState:
+    def __init__(
+        self,
+        parser: SSEParser,
+        on_finish: Optional[Callable[["_StreamState"], None]],
+        stop: Optional[StopCondition] = None,
+    ):
+        self._parser = parser
+        self._on_finish = on_finish
+        self._stop_matcher = stop.matcher() if stop is not None else None
+        self._stop_at: Optional[int] = None
+        self._held: List[str] = []  # received texts that are not yielded until the stop condition cannot cut them
+        self._pending = deque()
+        self.message: Optional[Message] = None
+        self.received_bytes = 0
+        self.first_text_time: Optional[float] = None  # `time.perf_counter()` when the first text arrived
+
+    @property
+    def finished(self) -> bool:
+        return self.message is not None
+
+    @property
+    def text(self) -> str:
+        """Text received so far, cut where the stop condition was met."""
+        text = self._parser.text
+        return text[: self._stop_at] if self._stop_at is not None else text
+
+    @property
+    def stopped(self) -> bool:
+        """Whether the stop condition ended the stream before the completion was finished."""
+        return self._stop_at is not None
+
+    @property
+    def usage(self) -> Optional[dict]:
+        """Usage reported by the provider, available once the stream finished."""
+        return self._parser.usage
+
+    def _feed(self, chunk: bytes):
+        self.received_bytes += len(chunk)
+        texts = self._parser.feed(chunk)
+        if self.first_text_time is None and any(texts):
+            self.first_text_time = time.perf_counter()
+        if self._stop_matcher is not None and len(texts) > 0:
+            texts = self._check_stop(texts)
+        self._pending.extend(texts)
+
+    def _check_stop(self, texts: List[str]) -> List[str]:
+        """The texts that can be yielded, up to where the stop condition is met, if it is."""
+        texts = self._held + texts
+        stop_at = self._stop_matcher.feed("".join(texts[len(self._held) :]))
+        if stop_at is not None:
+            self._stop_at = stop_at
+            keep = stop_at - (self._stop_matcher.length - sum(map(len, texts)))
+        else:
+            keep = sum(map(len, texts)) - self._stop_matcher.pending()
+        kept = []
+        for i, delta in enumerate(texts):
+            if keep < len(delta):
+                if keep > 0:
+                    kept.append(delta[:keep])
+                self._held = [delta[max(keep, 0) :]] + texts[i + 1 :] if stop_at is None else []
+                return kept
+            kept.append(delta)
+            keep -= len(delta)
+        self._held = []
+        return kept
+
+    def _finish(self):
+        if self.finished:
+            return
+        if not self.stopped:
+            texts = self._parser.finish()
+            if self._stop_matcher is not None and len(texts) > 0:
+                texts = self._check_stop(texts)
+            self._pending.extend(texts)
+        if not self.stopped:
+            # the completion is over, no match can cut the held back text anymore
+            self._pending.extend(self._held)
+        self._held = []
+        self.message = Message(role=MessageRole.ASSISTANT, content=(TextMessageContent(text=self.text),))
+        if self._on_finish is not None:
+            self._on_finish(self)
+
+
+class TextGenStream(_StreamState):
+    """
+    Iterator over the text chunks of a streamed completion.
+    Once it is exhausted, `message` holds the complete Message and `usage` the reported usage.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterator[bytes],
+        parser: SSEParser,
+        on_finish: Optional[Callable[["TextGenStream"], None]] = None,
+        close: Optional[Callable[[], None]] = None,
+        stop: Optional[StopCondition] = None,
+    ):
+        super().__init__(parser=parser, on_finish=on_finish, stop=stop)
+        self._chunks = chunks
+        self._close = close
+
+    def __iter__(self) -> "TextGenStream":
+        return self
+
+    def __next__(self) -> str:
+        while len(self._pending) == 0:
+            if self.finished:
+                raise StopIteration
+            # keep reading after the final event, so the connection is drained and can be reused
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._finish()
+                self.close()
+                continue
+            self._feed(chunk)
+            if self.stopped:
+                # the rest of the completion is not needed, closing the connection aborts its generation
+                self._finish()
+                self.close()
+        return self._pending.popleft()
+
+    def read(self) -> Message:
+        """Consume the rest of the stream and return the complete message."""
+        for _ in self:
+            pass
+        return self.message
+
+    def close(self):
+        """Release the underlying connection."""
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self) -> "TextGenStream":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncTextGenStream(_StreamState):
+    """Async counterpart of TextGenStream."""
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        parser: SSEParser,
+        on_finish: Optional[Callable[["AsyncTextGenStream"], None]] = None,
+        stop: Optional[StopCondition] = None,
+    ):
+        super().__init__(parser=parser, on_finish=on_finish, stop=stop)
+        self._chunks = chunks
+
+    def __aiter__(self) -> "AsyncTextGenStream":
+        return self
+
+    async def __anext__(self) -> str:
+        while len(self._pending) == 0:
+            if self.finished:
+                raise StopAsyncIteration
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._finish()
+                continue
+            self._feed(chunk)
+            if self.stopped:
+                self._finish()
+                await self.aclose()
+        return self._pending.popleft()
+
+    async def read(self) -> Message:
+        """Consume the rest of the stream and return the complete message."""
+        async for _ in self:
+            pass
+        return self.message
+
+    async def aclose(self):
+        """Release the underlying connection and the connection's concurrency slot."""
+        if hasattr(self._chunks, "aclose"):
+            await self._chunks.aclose()
+
+    async def __aenter__(self) -> "AsyncTextGenStream":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
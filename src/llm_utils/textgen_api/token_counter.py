@@ -0,0 +1,63 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Sequence
+
+
+class TokenCounter:
+    """
+    Memoizing token counter.
+    Consecutive requests of a conversation repeat most of their messages, so counts are cached per text.
+    The cache is keyed by a digest of the text, so its size does not depend on the length of the cached texts.
+    Texts that are not cached yet are encoded together with tiktoken's batch encoder.
+    """
+
+    BATCH_THRESHOLD = 8  # below this number of uncached texts, batching costs more than it saves
+
+    def __init__(self, token_encoding_name: str, max_entries: int = 65536):
+        import tiktoken  # slow to import, only loaded once tokens are counted
+
+        self.encoding = tiktoken.get_encoding(token_encoding_name)
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, texts: Sequence[str]) -> List[int]:
+        counts = [None] * len(texts)
+        keys = [_text_key(text) for text in texts]
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                n_tokens = self._counts.get(key)
+                if n_tokens is None:
+                    missing.append(i)
+                else:
+                    self._counts.move_to_end(key)
+                    counts[i] = n_tokens
+
+        if len(missing) == 0:
+            return counts
+        missing_texts = [texts[i] for i in missing]
+        if len(missing_texts) >= self.BATCH_THRESHOLD:
+            encoded = self.encoding.encode_batch(missing_texts)
+        else:
+            encoded = [self.encoding.encode(text) for text in missing_texts]
+
+        with self._lock:
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                self._counts[keys[i]] = len(tokens)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return counts
+
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(token_encoding_name: str) -> TokenCounter:
+    """Process-wide token counter per encoding, so the encoding is only loaded once."""
+    return TokenCounter(token_encoding_name)
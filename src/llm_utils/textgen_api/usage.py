@@ -1,15 +1,19 @@
 import json
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class UsageCall:
     input_tokens: int
     input_tokens_cached: int
     output_tokens: int
     output_tokens_cached: int
     call_id: Optional[str] = None
+    from_cache: bool = False  # served by the response cache, the tokens were not spent again
+    connection_id: Optional[str] = None
+    # size of the whole prompt including the prompt cache reads and writes, if input_tokens does not count them
+    input_tokens_total: Optional[int] = None
 
     def to_dumps(self) -> str:
         return {
@@ -18,6 +22,9 @@ class UsageCall:
             "output_tokens": self.output_tokens,
             "output_tokens_cached": self.output_tokens_cached,
             "call_id": self.call_id,
+            "from_cache": self.from_cache,
+            "connection_id": self.connection_id,
+            "input_tokens_total": self.input_tokens_total,
         }
 
     @staticmethod
@@ -28,23 +35,43 @@ class UsageCall:
             output_tokens=data["output_tokens"],
             output_tokens_cached=data["output_tokens_cached"],
             call_id=data.get("call_id"),
+            from_cache=data.get("from_cache", False),
+            connection_id=data.get("connection_id"),
+            input_tokens_total=data.get("input_tokens_total"),
         )
 
 
 @dataclass
 class Usage:
     calls: List[UsageCall] = field(default_factory=list)
+    cache_hits: int = 0
+    cache_misses: int = 0
+    hedges: int = 0  # hedged calls that sent a second request
+    hedge_wins: int = 0  # hedged calls answered first by the second request
+    coalesced: int = 0  # calls that shared the request of an identical call in flight, recorded with 0 tokens
 
-    def add_call(self, response_usage: dict, call_id: Optional[str]):
+    def add_call(
+        self,
+        response_usage: dict,
+        call_id: Optional[str],
+        from_cache: bool = False,
+        connection_id: Optional[str] = None,
+    ):
+        input_tokens_total = None
         if "prompt_tokens" in response_usage:
             input_tokens = response_usage["prompt_tokens"]
         else:
             input_tokens = response_usage["input_tokens"]
+            # Anthropic does not count the tokens read from or written to the prompt cache as input tokens
+            cache_tokens = response_usage.get("cache_read_input_tokens") or 0
+            cache_tokens += response_usage.get("cache_creation_input_tokens") or 0
+            if cache_tokens > 0:
+                input_tokens_total = input_tokens + cache_tokens
 
         if "prompt_tokens_details" in response_usage:
             input_tokens_cached = response_usage["prompt_tokens_details"]["cached_tokens"]
         elif "cache_read_input_tokens" in response_usage:
-            input_tokens_cached = response_usage["cache_read_input_tokens"]
+            input_tokens_cached = response_usage["cache_read_input_tokens"] or 0
         else:
             input_tokens_cached = 0
 
@@ -61,14 +88,68 @@ class Usage:
                 output_tokens_cached=output_tokens_cached,
                 output_tokens=output_tokens,
                 call_id=call_id,
+                from_cache=from_cache,
+                connection_id=connection_id,
+                input_tokens_total=input_tokens_total,
             )
         )
+        if from_cache:
+            self.cache_hits += 1
+
+    def prompt_cache_hit_rate(self, connection_id: Optional[str] = None) -> Optional[float]:
+        """
+        Fraction of the input tokens read from the provider's prompt cache, of all calls or those of a connection.
+        Calls served by the response cache are skipped. None if there were no input tokens.
+        """
+        input_tokens = 0
+        input_tokens_cached = 0
+        for call in self.calls:
+            if call.from_cache or (connection_id is not None and call.connection_id != connection_id):
+                continue
+            input_tokens += _total_input_tokens(call)
+            input_tokens_cached += call.input_tokens_cached
+        return input_tokens_cached / input_tokens if input_tokens > 0 else None
+
+    def prompt_cache_hit_rates(self) -> Dict[Optional[str], float]:
+        """`prompt_cache_hit_rate` per connection identifier."""
+        totals: Dict[Optional[str], List[int]] = {}
+        for call in self.calls:
+            if call.from_cache:
+                continue
+            total = totals.setdefault(call.connection_id, [0, 0])
+            total[0] += _total_input_tokens(call)
+            total[1] += call.input_tokens_cached
+        return {connection_id: cached / total for connection_id, (total, cached) in totals.items() if total > 0}
+
+    def add_cache_miss(self):
+        self.cache_misses += 1
+
+    def add_hedge(self):
+        self.hedges += 1
+
+    def add_hedge_win(self):
+        self.hedge_wins += 1
+
+    def add_coalesced(self):
+        self.coalesced += 1
 
     def reset(self):
         self.calls = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.coalesced = 0
 
     def to_json(self) -> dict:
-        return {"calls": list(map(lambda c: c.to_dumps(), self.calls))}
+        return {
+            "calls": list(map(lambda c: c.to_dumps(), self.calls)),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "coalesced": self.coalesced,
+        }
 
     def to_dumps(self) -> str:
         return json.dumps(self.to_json())
@@ -80,7 +161,17 @@ class Usage:
 
     @staticmethod
     def from_json(data: dict) -> "Usage":
-        usage = Usage()
+        usage = Usage(
+            cache_hits=data.get("cache_hits", 0),
+            cache_misses=data.get("cache_misses", 0),
+            hedges=data.get("hedges", 0),
+            hedge_wins=data.get("hedge_wins", 0),
+            coalesced=data.get("coalesced", 0),
+        )
         for call_data in data["calls"]:
             usage.calls.append(UsageCall.from_loads(call_data))
         return usage
+
+
+def _total_input_tokens(call: UsageCall) -> int:
+    return call.input_tokens_total if call.input_tokens_total is not None else call.input_tokens
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Iterator, List, Optional
+
+from llm_utils.textgen_api.usage import Usage, UsageCall
+
+logger = logging.getLogger(__name__)
+
+
+class UsageLog:
+    """
+    Append-only JSONL sink for usage records, one UsageCall per line.
+
+    Records are buffered and written in one append when `flush_every` records are pending, at the latest
+    `flush_interval` seconds after a record was buffered, and when the log is closed, garbage collected or the
+    interpreter exits. A crash can therefore lose at most the pending records, but never truncates the records already
+    written.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._migrate_legacy_file()
+        self._terminate_last_line()
+        # runs on garbage collection or at exit, whichever comes first, and does not keep the log alive
+        self._finalizer = weakref.finalize(self, UsageLog._write, path, self._buffer, self._lock)
+
+    def append(self, call: UsageCall):
+        line = json.dumps(call.to_dumps())
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, UsageLog._flush_pending, args=(weakref.ref(self),))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Write the pending records. Records appended afterwards are written as before."""
+        self.flush()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        UsageLog._write_locked(self.path, self._buffer)
+
+    @staticmethod
+    def _flush_pending(log_ref: "weakref.ref[UsageLog]"):
+        log = log_ref()
+        if log is not None:
+            log.flush()
+
+    @staticmethod
+    def _write(path: str, buffer: List[str], lock: threading.Lock):
+        with lock:
+            UsageLog._write_locked(path, buffer)
+
+    @staticmethod
+    def _write_locked(path: str, buffer: List[str]):
+        if len(buffer) == 0:
+            return
+        with open(path, "a") as f:
+            f.write("\n".join(buffer) + "\n")
+        buffer.clear()  # in place, the finalizer holds the same list
+
+    def _migrate_legacy_file(self):
+        """Usage files used to hold a single json document, convert them to one record per line once."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            first_line = f.readline()
+            if not first_line.startswith('{"calls"'):
+                return
+            legacy_usage = Usage.from_loads(first_line + f.read())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for call in legacy_usage.calls:
+                f.write(json.dumps(call.to_dumps()) + "\n")
+        os.replace(tmp_path, self.path)
+        logger.info("converted usage file %s to jsonl", self.path)
+
+    def _terminate_last_line(self):
+        """A crash mid-write can leave a partial line, make sure new records start on a fresh line."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    @staticmethod
+    def iter_records(path: str) -> Iterator[dict]:
+        """Stream the raw records of a usage log. A truncated last line (e.g. after a crash) is skipped."""
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("skipping malformed usage record in %s", path)
+
+    @staticmethod
+    def read_usage(path: str) -> Usage:
+        """Load all records into memory."""
+        return Usage(calls=[UsageCall.from_loads(record) for record in UsageLog.iter_records(path)])
+
+    @staticmethod
+    def read_totals(path: str, include_cached: bool = False) -> Dict[Optional[str], UsageCall]:
+        """
+        Sum the tokens per call_id in a single pass, without materializing every record.
+        Calls served from the response cache did not spend tokens and are skipped unless `include_cached` is set.
+        """
+        totals: Dict[Optional[str], List[int]] = {}
+        for record in UsageLog.iter_records(path):
+            if record.get("from_cache", False) and not include_cached:
+                continue
+            total = totals.setdefault(record.get("call_id"), [0, 0, 0, 0])
+            total[0] += record["input_tokens"]
+            total[1] += record["input_tokens_cached"]
+            total[2] += record["output_tokens"]
+            total[3] += record["output_tokens_cached"]
+        return {
+            call_id: UsageCall(
+                input_tokens=total[0],
+                input_tokens_cached=total[1],
+                output_tokens=total[2],
+                output_tokens_cached=total[3],
+                call_id=call_id,
+            )
+            for call_id, total in totals.items()
+        }
@@ -0,0 +1,82 @@
+import logging
+import xml.etree.ElementTree as ET
+from typing import List, Optional
+
+from llm_utils.textgen_api.item_parser import ItemParser
+
+logger = logging.getLogger(__name__)
+
+
+class XMLItemParser(ItemParser[ET.Element]):
+    """
+    Returns the elements of streamed XML output as soon as they are closed.
+
+    By default these are the children of the root element, e.g. each `<item>` of `<items><item>..</item>...</items>`,
+    pass `depth` to get deeper elements, 0 for the root itself. Text before the first tag, e.g. an introduction or a
+    code fence, and everything after the root element is closed are ignored. A `<` in the introduction, e.g. in
+    `1 < 2`, makes the XML invalid before the root element started, parsing then resumes at the next `<`.
+    With `fragment`, the output may consist of several elements without a common root, its top level elements are then
+    at depth 1. Returned elements are removed from their parent, so the tree does not grow with the output.
+    Invalid XML after the root element started ends the parsing, the elements returned until then stand.
+    """
+
+    def __init__(self, depth: int = 1, fragment: bool = False):
+        self.depth = depth
+        self.fragment = fragment
+        self.done = False
+        self._restart()
+
+    def feed(self, text: str) -> List[ET.Element]:
+        elements = []
+        while not self.done:
+            if not self._started:
+                start = text.find("<")
+                if start == -1:
+                    break
+                text = text[start:]
+                self._started = True
+            if self._prefix is not None:
+                self._prefix.append(text)
+            self._parser.feed(text)
+            try:
+                self._read_events(elements)
+                break
+            except ET.ParseError as e:
+                if self._prefix is None:
+                    logger.warning("invalid XML in the streamed output, stop parsing: %s", e)
+                    self.done = True
+                    self._parser = None
+                    break
+                # not the document, but e.g. a `<` in the introduction: start over at the next `<`
+                text = "".join(self._prefix)
+                start = text.find("<", 1)
+                text = text[start:] if start != -1 else ""
+                self._restart()
+        return elements
+
+    def _restart(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._path: List[ET.Element] = []
+        self._started = self.fragment
+        # text fed since the document started, kept to start over until its first element is opened
+        self._prefix: Optional[List[str]] = []
+        if self.fragment:
+            self._parser.feed("<fragment>")
+
+    def _read_events(self, elements: List[ET.Element]):
+        for event, element in self._parser.read_events():
+            if event == "start":
+                self._path.append(element)
+                if len(self._path) == (2 if self.fragment else 1):
+                    self._prefix = None
+                continue
+            self._path.pop()
+            if len(self._path) == self.depth:
+                elements.append(element)
+                if len(self._path) > 0:
+                    self._path[-1].remove(element)
+            if len(self._path) == 0:
+                # anything after the root element is not part of the document
+                self.done = True
+                self._parser = None
+                break
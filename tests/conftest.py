@@ -0,0 +1,107 @@
+import dataclasses
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import pytest
+
+from llm_utils.openai_api.chat import Chat
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.user_message import UserMessage
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "benchmarks"))
+
+from stub_server import StubConfig, StubLLMServer  # noqa: E402
+
+CHAT = Chat(messages=[UserMessage(content=TextMessageContent(text="hello there"))])
+
+COMPLETION = {
+    "choices": [{"message": {"role": "assistant", "content": "hello"}}],
+    "usage": {"prompt_tokens": 3, "completion_tokens": 1},
+}
+
+
+class ScriptedServer(ThreadingHTTPServer):
+    """
+    Answers with the queued (status, body) responses in order, with a completion once they are used up.
+    With a `handler`, the response to each request is computed from its body instead.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _ScriptedHandler)
+        self.responses: List[Tuple[int, dict]] = []
+        self.requests: List[dict] = []
+        self.handler: Optional[Callable[[dict], Tuple]] = None  # returns (status, body) or (status, body, headers)
+
+    @property
+    def connection(self) -> TextGenLLMConnection:
+        return TextGenLLMConnection.self_hosted("127.0.0.1", self.server_address[1])
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(request)
+        headers = {}
+        if self.server.handler is not None:
+            status, body, *rest = self.server.handler(request)
+            if len(rest) > 0:
+                headers = rest[0]
+        else:
+            status, body = self.server.responses.pop(0) if self.server.responses else (200, COMPLETION)
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if status == 429 and "Retry-After" not in headers:
+            self.send_header("Retry-After", "0")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def scripted_server():
+    server = ScriptedServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_server(request):
+    """Stub of the OpenAI and Anthropic endpoints, configured with `@pytest.mark.stub(...)` (see `StubConfig`)."""
+    marker = request.node.get_closest_marker("stub")
+    server = StubLLMServer(config=StubConfig(**(marker.kwargs if marker is not None else {}))).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def completion(text: str, prompt_tokens: int = 3, completion_tokens: int = 1) -> dict:
+    return {
+        "choices": [{"message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+    }
+
+
+def user_chat(text: str) -> Chat:
+    return Chat(messages=[UserMessage(content=TextMessageContent(text=text))])
+
+
+def stub_connection(server: StubLLMServer, anthropic: bool = False) -> TextGenLLMConnection:
+    connection = TextGenLLMConnection.self_hosted("127.0.0.1", server.port)
+    if anthropic:
+        connection = dataclasses.replace(connection, identifier="claude-stub", path="v1/messages")
+    return connection
@@ -0,0 +1,60 @@
+import asyncio
+import dataclasses
+
+import pytest
+from conftest import CHAT, stub_connection
+
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+def async_api(server, **connection_fields) -> TextGenApi:
+    connection = dataclasses.replace(stub_connection(server), **connection_fields)
+    return TextGenApi(TextGenLLMConnections(connections=[connection]))
+
+
+def run(api: TextGenApi, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await api.aclose()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.stub(output_tokens=4)
+def test_acall_returns_the_message_and_records_usage(stub_server):
+    api = async_api(stub_server)
+    message = run(api, api.acall(CHAT, call_id="async"))
+    assert message.content[0].text == "tok0 tok1 tok2 tok3 "
+    assert [(call.call_id, call.output_tokens) for call in api.usage.calls] == [("async", 4)]
+
+
+@pytest.mark.stub(latency=0.2, output_tokens=4)
+def test_acall_respects_max_concurrent_requests(stub_server):
+    api = async_api(stub_server, max_concurrent_requests=2)
+
+    async def main():
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*[api.acall(CHAT) for _ in range(4)])
+        return asyncio.get_running_loop().time() - started
+
+    assert run(api, main()) >= 0.4
+    assert len(api.usage.calls) == 4
+
+
+@pytest.mark.stub(tokens_per_second=20, output_tokens=100)
+def test_leaving_astream_early_releases_the_concurrency_slot(stub_server):
+    api = async_api(stub_server, max_concurrent_requests=1)
+
+    async def main():
+        async with api.astream(CHAT) as stream:
+            async for chunk in stream:
+                assert chunk == "tok0 "
+                break
+        # the only slot is free again, otherwise the next stream would wait for the rest of the first one (5 s)
+        async with api.astream(CHAT) as stream:
+            return await asyncio.wait_for(stream.__anext__(), timeout=2)
+
+    assert run(api, main()) == "tok0 "
@@ -0,0 +1,62 @@
+import time
+
+from conftest import completion, user_chat
+
+from llm_utils.textgen_api.retry_policy import RetryPolicy
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+def request_text(request: dict) -> str:
+    content = request["messages"][-1]["content"]
+    return content if isinstance(content, str) else "".join(part["text"] for part in content)
+
+
+def echo(request: dict):
+    """Answers "<delay> <text>" with "echo <text>" after `delay` seconds, "fail" with a non-retryable error."""
+    delay, text = request_text(request).split(" ", 1)
+    time.sleep(float(delay))
+    if text == "fail":
+        return 400, {"error": {"message": "bad request"}}
+    return 200, completion("echo " + text, prompt_tokens=2, completion_tokens=len(text))
+
+
+def batch_api(scripted_server) -> TextGenApi:
+    scripted_server.handler = echo
+    return TextGenApi(
+        TextGenLLMConnections(connections=[scripted_server.connection]), retry_policy=RetryPolicy(max_attempts=1)
+    )
+
+
+def test_results_are_in_input_order(scripted_server):
+    api = batch_api(scripted_server)
+    chats = [user_chat("%.2f item%d" % (0.05 * (5 - i), i)) for i in range(6)]
+    results = api.do_batch(chats, max_concurrency=6, call_ids=["c%d" % i for i in range(6)])
+    assert [result.index for result in results] == list(range(6))
+    assert [result.call_id for result in results] == ["c%d" % i for i in range(6)]
+    assert [result.message.content[0].text for result in results] == ["echo item%d" % i for i in range(6)]
+
+
+def test_unordered_results_are_yielded_as_they_complete(scripted_server):
+    api = batch_api(scripted_server)
+    chats = [user_chat("0.4 slow"), user_chat("0.0 fast"), user_chat("0.2 medium")]
+    results = api.do_batch(chats, max_concurrency=3, ordered=False)
+    assert [result.index for result in results] == [1, 2, 0]
+
+
+def test_failed_item_does_not_abort_the_batch(scripted_server):
+    api = batch_api(scripted_server)
+    chats = [user_chat("0 a"), user_chat("0 fail"), user_chat("0 ccc")]
+    results = api.do_batch(chats, max_concurrency=2, call_ids=["a", "fail", "c"])
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[1].message is None and results[1].error is not None
+    assert results[2].message.content[0].text == "echo ccc"
+
+
+def test_usage_of_all_items_is_recorded(scripted_server):
+    api = batch_api(scripted_server)
+    chats = [user_chat("0 %s" % ("x" * (i + 1))) for i in range(20)]
+    api.do_batch(chats, max_concurrency=4, call_ids=["c%d" % i for i in range(20)])
+    assert sorted(call.call_id for call in api.usage.calls) == sorted("c%d" % i for i in range(20))
+    assert sum(call.output_tokens for call in api.usage.calls) == sum(range(1, 21))
+    assert sum(call.input_tokens for call in api.usage.calls) == 40
@@ -0,0 +1,151 @@
+import dataclasses
+import random
+
+import pytest
+from conftest import stub_connection, user_chat
+
+from llm_utils.textgen_api.batch_job import BatchJob
+from llm_utils.textgen_api.exceptions import TextGenApiError
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+PROVIDERS = pytest.mark.parametrize("anthropic", [False, True], ids=["openai", "anthropic"])
+
+
+def batch_api(server, anthropic: bool) -> TextGenApi:
+    return TextGenApi(TextGenLLMConnections(connections=[stub_connection(server, anthropic=anthropic)]))
+
+
+def chats(n: int) -> list:
+    # the stub counts the words of the prompt as input tokens, chat i has i + 1 of them
+    return [user_chat(" ".join(["word"] * (index + 1))) for index in range(n)]
+
+
+def input_tokens_by_call_id(api: TextGenApi) -> dict:
+    return {call.call_id: call.input_tokens for call in api.usage.calls}
+
+
+def rate_limited_indices(seed: int, rate: float, n: int) -> set:
+    """Requests the stub fails with 429, it draws one random number per request in input order."""
+    rng = random.Random(seed)
+    return {index for index in range(n) if rng.random() < rate}
+
+
+@PROVIDERS
+@pytest.mark.stub(output_tokens=3)
+def test_results_are_returned_in_input_order(stub_server, anthropic):
+    api = batch_api(stub_server, anthropic)
+    job = api.submit_batch_job(chats(5), call_ids=["item-%d" % index for index in range(5)])
+    assert job.id.startswith("msgbatch_" if anthropic else "batch_")
+    assert job.connection_id == ("claude-stub" if anthropic else stub_connection(stub_server).identifier)
+    results = api.wait_batch_job(job, poll_interval=0.01)
+    assert [(result.index, result.call_id, result.ok) for result in results] == [
+        (index, "item-%d" % index, True) for index in range(5)
+    ]
+    assert all(result.message.content[0].text == "tok0 tok1 tok2 " for result in results)
+    assert input_tokens_by_call_id(api) == {"item-%d" % index: index + 1 for index in range(5)}
+    assert job.status == ("ended" if anthropic else "completed")
+
+
+@PROVIDERS
+@pytest.mark.stub(batch_delay=0.3)
+def test_wait_polls_until_the_job_finished(stub_server, anthropic):
+    api = batch_api(stub_server, anthropic)
+    job = api.submit_batch_job(chats(2))
+    assert job.status == "in_progress"
+    assert not api.poll_batch_job(job).finished
+    with pytest.raises(TimeoutError):
+        api.wait_batch_job(job, poll_interval=0.05, timeout=0.1)
+    results = api.wait_batch_job(job, poll_interval=0.05, timeout=5)
+    assert job.finished
+    assert [(result.index, result.call_id, result.ok) for result in results] == [(0, None, True), (1, None, True)]
+
+
+@PROVIDERS
+@pytest.mark.stub(rate_limit_rate=0.5, seed=3)
+def test_failed_requests_are_reported_in_their_result(stub_server, anthropic):
+    n = 12
+    failed = rate_limited_indices(seed=3, rate=0.5, n=n)
+    assert 0 < len(failed) < n
+    api = batch_api(stub_server, anthropic)
+    results = api.wait_batch_job(api.submit_batch_job(chats(n)), poll_interval=0.01)
+    # OpenAI returns the failed requests in a separate file, they are still put back in input order
+    assert [result.index for result in results] == list(range(n))
+    assert {result.index for result in results if not result.ok} == failed
+    for result in results:
+        if result.ok:
+            assert result.message is not None
+        else:
+            assert isinstance(result.error, TextGenApiError) and result.message is None
+            assert "rate_limit_error" in result.error.response_text
+            assert result.error.status_code == (None if anthropic else 429)
+    # usage is only recorded for the answered requests
+    assert sorted(call.input_tokens for call in api.usage.calls) == [i + 1 for i in range(n) if i not in failed]
+
+
+@PROVIDERS
+@pytest.mark.stub(batch_delay=0.2)
+def test_job_saved_on_submit_is_resumed_by_another_instance(stub_server, anthropic, tmp_path):
+    job_file = str(tmp_path / "jobs" / "job.json")
+    job = batch_api(stub_server, anthropic).submit_batch_job(chats(3), call_ids=["a", None, "c"], job_file=job_file)
+    loaded = BatchJob.load(job_file)
+    assert loaded == job
+
+    api = batch_api(stub_server, anthropic)
+    results = api.wait_batch_job(loaded, poll_interval=0.05)
+    assert [(result.index, result.call_id, result.ok) for result in results] == [
+        (0, "a", True),
+        (1, None, True),
+        (2, "c", True),
+    ]
+    assert input_tokens_by_call_id(api) == {"a": 1, None: 2, "c": 3}
+
+
+@PROVIDERS
+def test_job_known_only_by_its_id_uses_the_custom_ids(stub_server, anthropic):
+    api = batch_api(stub_server, anthropic)
+    submitted = api.submit_batch_job(chats(3), call_ids=["a", None, "c"])
+    results = api.wait_batch_job(BatchJob(id=submitted.id, connection_id=submitted.connection_id), poll_interval=0.01)
+    # without the call ids of the job, results are in the order of the provider
+    assert [result.index for result in results] == [0, 1, 2]
+    assert sorted(result.call_id for result in results) == ["a", "c", "request-1"]
+    assert input_tokens_by_call_id(api) == {"a": 1, "request-1": 2, "c": 3}
+
+
+def test_duplicate_call_ids_are_rejected(stub_server):
+    with pytest.raises(AssertionError):
+        batch_api(stub_server, anthropic=False).submit_batch_job(chats(2), call_ids=["a", "a"])
+    # a call id may not collide with the custom id generated for a chat without one either
+    with pytest.raises(AssertionError):
+        batch_api(stub_server, anthropic=False).submit_batch_job(chats(2), call_ids=["request-1", None])
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("v1/chat/completions", "v1/files"),
+        ("openai/deployments/gpt/chat/completions", "openai/deployments/gpt/files"),
+        ("chat/completions", "files"),
+        ("generate", "v1/files"),
+    ],
+)
+def test_openai_batch_url_is_next_to_the_chat_completions_endpoint(stub_server, path, expected):
+    connection = dataclasses.replace(stub_connection(stub_server), path=path)
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]))
+    assert api._openai_batch_url(connection, "files") == "http://127.0.0.1:%d/%s" % (stub_server.port, expected)
+
+
+@PROVIDERS
+@pytest.mark.stub(rate_limit_rate=0.5, seed=3)
+def test_result_records_are_mapped_back_by_custom_id(stub_server, anthropic):
+    api = batch_api(stub_server, anthropic)
+    connection = api._select_connection(None)
+    job = api.submit_batch_job(chats(6), call_ids=["item-%d" % index for index in range(6)])
+    state = api._poll_batch_job(connection, job)
+    records = list(api._iter_batch_job_results(connection, job, state))
+    failed = rate_limited_indices(seed=3, rate=0.5, n=6)
+    assert sorted(custom_id for custom_id, _, _ in records) == ["item-%d" % index for index in range(6)]
+    for custom_id, response_data, error in records:
+        index = int(custom_id.split("-")[1])
+        assert (error is not None) == (index in failed)
+        assert (response_data is None) == (index in failed)
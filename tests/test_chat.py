@@ -0,0 +1,38 @@
+import pytest
+
+from llm_utils.openai_api.assistant_message import AssistantMessage
+from llm_utils.openai_api.chat import Chat
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.user_message import UserMessage
+
+
+def _message(cls, text):
+    return cls(content=[TextMessageContent(text=text)])
+
+
+@pytest.fixture
+def chat():
+    return Chat(
+        messages=[_message(UserMessage, "hi"), _message(AssistantMessage, "hello"), _message(UserMessage, "bye")]
+    )
+
+
+def test_get_all_after_returns_the_new_messages(chat):
+    prior = Chat(messages=chat.messages[:1])
+    assert list(chat.get_all_after(prior).messages) == list(chat.messages[1:])
+
+
+def test_get_all_after_accepts_an_equal_copy_of_the_prior_chat(chat):
+    prior = Chat(messages=[_message(UserMessage, "hi"), _message(AssistantMessage, "hello")])
+    assert list(chat.get_all_after(prior).messages) == [chat.messages[2]]
+
+
+def test_get_all_after_a_longer_prior_chat_is_empty(chat):
+    prior = Chat(messages=chat.messages.appended(_message(AssistantMessage, "see you")))
+    assert len(chat.get_all_after(prior).messages) == 0
+
+
+def test_get_all_after_rejects_a_diverging_chat(chat):
+    prior = Chat(messages=[_message(UserMessage, "something else")])
+    with pytest.raises(AssertionError):
+        chat.get_all_after(prior)
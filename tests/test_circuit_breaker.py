@@ -0,0 +1,148 @@
+import contextlib
+import time
+
+import pytest
+
+from llm_utils.openai_api.chat import Chat
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.user_message import UserMessage
+from llm_utils.textgen_api import textgen_api
+from llm_utils.textgen_api.circuit_breaker import CircuitBreaker
+from llm_utils.textgen_api.exceptions import CircuitOpenError, TextGenApiError
+from llm_utils.textgen_api.retry_policy import RetryPolicy
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+CHAT = Chat(messages=[UserMessage(content=TextMessageContent(text="hi"))])
+
+
+def open_breaker(recovery_timeout: float = 0.0) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=recovery_timeout)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+@pytest.mark.parametrize(
+    "outcome, state",
+    [
+        (CircuitBreaker.record_success, CircuitBreaker.CLOSED),
+        (CircuitBreaker.record_failure, CircuitBreaker.OPEN),
+        (CircuitBreaker.record_rate_limited, CircuitBreaker.OPEN),
+    ],
+)
+def test_trial_outcome(outcome, state):
+    breaker = open_breaker()
+    with breaker.attempt():
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()  # a single trial at a time
+        outcome(breaker)
+    assert breaker.state == state
+
+
+def test_rate_limited_trial_waits_for_recovery_timeout():
+    breaker = open_breaker(recovery_timeout=0.05)
+    time.sleep(0.05)
+    with breaker.attempt():
+        breaker.record_rate_limited()
+    assert not breaker.available
+    time.sleep(0.05)
+    assert breaker.available
+
+
+def test_unsettled_trial_is_released():
+    breaker = open_breaker(recovery_timeout=60)
+    breaker._opened_at -= 60
+    with pytest.raises(KeyboardInterrupt):
+        with breaker.attempt():
+            raise KeyboardInterrupt
+    assert breaker.available
+    with breaker.attempt():
+        breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stale_trial_does_not_release_a_later_one():
+    breaker = open_breaker()
+    trial = breaker.before_call()
+    breaker.record_failure()
+    later_trial = breaker.before_call()
+    breaker.end_trial(trial)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.end_trial(later_trial)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def make_api(server, **retry_policy) -> TextGenApi:
+    policy = RetryPolicy(initial_delay=0, circuit_breaker_threshold=2, circuit_breaker_timeout=60, **retry_policy)
+    return TextGenApi(TextGenLLMConnections(connections=[server.connection]), retry_policy=policy)
+
+
+def test_client_errors_do_not_open_the_circuit(scripted_server):
+    api = make_api(scripted_server)
+    scripted_server.responses = [(400, {"error": "bad request"})] * 3
+    for _ in range(3):
+        with pytest.raises(TextGenApiError):
+            api.do_call(CHAT)
+    assert api.do_call(CHAT).content[0].text == "hello"
+
+
+def test_server_errors_open_the_circuit(scripted_server):
+    api = make_api(scripted_server, max_attempts=2)
+    scripted_server.responses = [(500, {"error": "internal"})] * 2
+    with pytest.raises(TextGenApiError):
+        api.do_call(CHAT)
+    with pytest.raises(CircuitOpenError):
+        api.do_call(CHAT)
+    assert len(scripted_server.requests) == 2
+
+
+def test_rate_limited_trial_reopens_the_circuit(scripted_server):
+    api = make_api(scripted_server, max_attempts=1)
+    breaker = api._get_circuit_breaker(scripted_server.connection)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker._opened_at -= 60
+    scripted_server.responses = [(429, {"error": "rate limited"})]
+    with pytest.raises(TextGenApiError):
+        api.do_call(CHAT)
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker._opened_at -= 60
+    assert api.do_call(CHAT).content[0].text == "hello"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_backoff_waits_after_the_attempt_ended(scripted_server, monkeypatch):
+    api = make_api(scripted_server)
+    breaker = api._get_circuit_breaker(scripted_server.connection)
+    attempts = []
+    attempt = breaker.attempt
+
+    @contextlib.contextmanager
+    def tracked_attempt():
+        with attempt():
+            attempts.append(True)
+            try:
+                yield
+            finally:
+                attempts.pop()
+
+    sleeps = []
+    monkeypatch.setattr(breaker, "attempt", tracked_attempt)
+    monkeypatch.setattr(textgen_api.time, "sleep", lambda seconds: sleeps.append(len(attempts)))
+    scripted_server.responses = [(500, {"error": "internal"})]
+    assert api.do_call(CHAT).content[0].text == "hello"
+    assert sleeps == [0]
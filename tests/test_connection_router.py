@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_utils.textgen_api.connection_router import ConnectionRouter
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
+
+HEALTHY = TextGenLLMConnection.self_hosted("10.0.0.1", 8000)
+DEAD = TextGenLLMConnection.self_hosted("10.0.0.2", 8000)
+
+
+def call(router: ConnectionRouter, connection: TextGenLLMConnection, latency: float, success: bool = True):
+    router.on_start(connection)
+    router.on_end(connection, latency, success)
+
+
+def route(router: ConnectionRouter, n_calls: int, latency: float = 0.3) -> int:
+    """Route calls to HEALTHY and DEAD, returns how many were sent to DEAD."""
+    n_dead = 0
+    for _ in range(n_calls):
+        connection = router.choose([HEALTHY, DEAD])
+        n_dead += connection is DEAD
+        call(router, connection, latency=latency, success=connection is HEALTHY)
+    return n_dead
+
+
+def test_connections_without_observations_are_explored_first():
+    router = ConnectionRouter()
+    call(router, HEALTHY, latency=0.3)
+    assert router.choose([HEALTHY, DEAD]) is DEAD
+
+
+def test_busy_connection_without_observations_is_not_preferred():
+    router = ConnectionRouter()
+    call(router, HEALTHY, latency=5.0)
+    for _ in range(3):
+        router.on_start(DEAD)
+    # scored with the observed latency, three requests in flight weigh more than an idle slow connection
+    assert router.choose([HEALTHY, DEAD]) is HEALTHY
+
+
+def test_faster_connection_is_preferred():
+    router = ConnectionRouter()
+    call(router, HEALTHY, latency=0.1)
+    call(router, DEAD, latency=1.0)
+    assert all(router.choose([HEALTHY, DEAD]) is HEALTHY for _ in range(10))
+
+
+def test_in_flight_requests_spread_the_load():
+    router = ConnectionRouter()
+    call(router, HEALTHY, latency=0.1)
+    call(router, DEAD, latency=0.15)
+    router.on_start(HEALTHY)
+    assert router.choose([HEALTHY, DEAD]) is DEAD
+
+
+@pytest.mark.parametrize("observed_before", [False, True])
+def test_dead_connection_is_tried_once_per_cooldown(observed_before):
+    router = ConnectionRouter(cooldown=0.05)
+    if observed_before:
+        for _ in range(20):
+            call(router, DEAD, latency=0.1)
+        for _ in range(4):
+            call(router, DEAD, latency=0.1, success=False)
+        assert router.stats(DEAD).degraded_until > time.monotonic()
+    else:
+        assert route(router, 20) == 1
+    assert route(router, 20) == 0
+    time.sleep(0.06)
+    assert route(router, 20) == 1
+
+
+def test_recovered_connection_gets_traffic_again():
+    router = ConnectionRouter(cooldown=0.05)
+    route(router, 5)
+    time.sleep(0.06)
+    call(router, DEAD, latency=0.05)
+    assert not router.stats(DEAD).probation
+    assert router.choose([HEALTHY, DEAD]) is DEAD
+
+
+def test_unavailable_connections_are_skipped():
+    router = ConnectionRouter()
+    assert all(router.choose([HEALTHY, DEAD], is_available=lambda c: c is HEALTHY) is HEALTHY for _ in range(10))
+
+
+def test_cancelled_call_does_not_count():
+    router = ConnectionRouter()
+
+    async def cancelled():
+        with router.track(DEAD):
+            raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancelled())
+    stats = router.stats(DEAD)
+    assert (stats.in_flight, stats.n_calls, stats.error_rate_ewma) == (0, 0, 0.0)
+
+
+def test_latency_percentile():
+    router = ConnectionRouter()
+    assert router.latency_percentile(HEALTHY, 95) is None
+    for latency in range(1, 101):
+        call(router, HEALTHY, latency=latency / 100)
+    call(router, HEALTHY, latency=100, success=False)
+    assert router.latency_percentile(HEALTHY, 50) == pytest.approx(0.51)
+    assert router.latency_percentile(HEALTHY, 95) == pytest.approx(0.96)
+    assert router.latency_percentile(HEALTHY, 95, min_samples=200) is None
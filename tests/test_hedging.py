@@ -0,0 +1,108 @@
+import asyncio
+import dataclasses
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import CHAT, stub_connection
+from stub_server import StubConfig, StubLLMServer
+
+from llm_utils.textgen_api.hedge_policy import HedgePolicy
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+@pytest.fixture
+def slow_server():
+    server = StubLLMServer(config=StubConfig(latency=1.0, output_tokens=4)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def hedging_api(*servers, fallback_delay: float, **connection_fields) -> TextGenApi:
+    connections = [dataclasses.replace(stub_connection(server), **connection_fields) for server in servers]
+    return TextGenApi(
+        TextGenLLMConnections(connections=connections), hedge_policy=HedgePolicy(fallback_delay=fallback_delay)
+    )
+
+
+@pytest.mark.stub(latency=0.3, output_tokens=4)
+def test_queued_calls_are_not_hedged(stub_server):
+    api = hedging_api(stub_server, fallback_delay=0.6)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=100) as executor:
+        messages = list(executor.map(lambda _: api.do_call(CHAT, hedge=True), range(100)))
+    assert time.perf_counter() - started < 3
+    assert all(message.content[0].text == "tok0 tok1 tok2 tok3 " for message in messages)
+    assert api.usage.hedges == 0
+    assert len(api.usage.calls) == 100
+
+
+@pytest.mark.stub(latency=0.2, output_tokens=4)
+def test_async_calls_waiting_for_a_concurrency_slot_are_not_hedged(stub_server):
+    api = hedging_api(stub_server, fallback_delay=0.3, max_concurrent_requests=5)
+
+    async def main():
+        try:
+            return await asyncio.gather(*[api.acall(CHAT, hedge=True) for _ in range(20)])
+        finally:
+            await api.aclose()
+
+    assert len(asyncio.run(main())) == 20
+    assert api.usage.hedges == 0
+
+
+@pytest.mark.stub(output_tokens=4)
+def test_slow_call_is_hedged_and_the_loser_is_closed(stub_server):
+    # the loser would take 11 seconds to complete
+    slow_server = StubLLMServer(config=StubConfig(latency=1.0, tokens_per_second=2, output_tokens=20)).start()
+    try:
+        api = hedging_api(slow_server, stub_server, fallback_delay=0.1)
+        started = time.perf_counter()
+        message = api.do_call(CHAT, hedge=True)
+        assert time.perf_counter() - started < 0.8
+        assert message.content[0].text == "tok0 tok1 tok2 tok3 "
+        assert (api.usage.hedges, api.usage.hedge_wins) == (1, 1)
+        # the loser is closed at its first chunk and recorded with the tokens received until then
+        deadline = time.monotonic() + 3
+        while len(api.usage.calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        winner, loser = api.usage.calls
+        assert winner.output_tokens == 4
+        assert 0 < loser.output_tokens < 20 and loser.input_tokens > 0
+    finally:
+        slow_server.shutdown()
+        slow_server.server_close()
+
+
+def test_call_without_alternative_connection_is_not_hedged():
+    server = StubLLMServer(config=StubConfig(latency=0.3, output_tokens=4)).start()
+    try:
+        api = hedging_api(server, fallback_delay=0.1)
+        assert api.do_call(CHAT, hedge=True).content[0].text == "tok0 tok1 tok2 tok3 "
+        assert api.usage.hedges == 0
+        assert server.n_requests == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.stub(output_tokens=4)
+def test_cancelled_async_loser_is_recorded(slow_server, stub_server):
+    api = hedging_api(slow_server, stub_server, fallback_delay=0.1)
+
+    async def main():
+        try:
+            message = await api.acall(CHAT, hedge=True)
+            await asyncio.sleep(0.05)  # let the loser handle its cancellation
+            return message
+        finally:
+            await api.aclose()
+
+    started = time.perf_counter()
+    assert asyncio.run(main()).content[0].text == "tok0 tok1 tok2 tok3 "
+    assert time.perf_counter() - started < 0.8
+    assert (api.usage.hedges, api.usage.hedge_wins) == (1, 1)
+    assert sorted(call.output_tokens for call in api.usage.calls) == [0, 4]
+    assert all(call.input_tokens > 0 for call in api.usage.calls)
@@ -0,0 +1,42 @@
+from dataclasses import fields
+
+import pytest
+from PIL import Image
+
+from llm_utils.openai_api.image_message_content import ImageMessageContent
+from llm_utils.prompt_generation.compiled_prompt import CompiledPrompt
+from llm_utils.prompt_generation.prompt import Prompt
+
+
+def test_data_url_is_memoized_without_a_field():
+    content = ImageMessageContent(image=Image.new("RGBA", (64, 32)), max_edge_size=16)
+    assert [f.name for f in fields(content)] == ["image", "jpeg_quality", "max_edge_size"]
+    assert content.data_url.startswith("data:image/jpeg;base64,")
+    assert content.data_url is content.data_url
+    assert content.to_dict() == {"type": "image_url", "image_url": {"url": content.data_url}}
+
+
+def test_equal_contents_compare_equal_regardless_of_memo():
+    image = Image.new("RGB", (8, 8))
+    encoded = ImageMessageContent(image=image)
+    encoded.data_url
+    assert encoded == ImageMessageContent(image=image)
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_encoding_options_are_read_from_the_xml(compiled):
+    prompt = """<prompt>
+<user>
+<content type="image" id="photo" jpeg_quality="90" max_edge_size="1024"/>
+<content type="image" id="photo"/>
+</user>
+</prompt>"""
+    image = Image.new("RGB", (8, 8))
+    if compiled:
+        chat = CompiledPrompt(prompt).render(images={"photo": image})
+    else:
+        chat = Prompt(prompt).to_chat(images={"photo": image})
+    assert chat.messages[0].content == (
+        ImageMessageContent(image=image, jpeg_quality=90, max_edge_size=1024),
+        ImageMessageContent(image=image),
+    )
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC = str(Path(__file__).parents[1] / "src")
+
+
+def run_python(code: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SRC, env.get("PYTHONPATH")]))
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import llm_utils",
+        "from llm_utils import Chat, UserMessage, TextMessageContent, Usage, UsageCall",
+    ],
+)
+def test_import_does_not_load_heavy_dependencies(code):
+    heavy_modules = ("requests", "httpx", "PIL")
+    result = run_python(code + "\nimport sys\nprint(' '.join(sorted(m.split('.')[0] for m in sys.modules)))")
+    assert set(result.stdout.split()).isdisjoint(heavy_modules)
+    imported = {line.split("|")[-1].strip().split(".")[0] for line in result.stderr.splitlines() if "|" in line}
+    assert "llm_utils" in imported
+    assert imported.isdisjoint(heavy_modules)
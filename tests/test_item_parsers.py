@@ -0,0 +1,64 @@
+import pytest
+
+from llm_utils.textgen_api.json_item_parser import JSONItemParser
+from llm_utils.textgen_api.xml_item_parser import XMLItemParser
+
+CHUNK_SIZES = [1, 2, 7, 1000]
+
+
+def chunked(text: str, size: int):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+JSON_CASES = [
+    ('[1, "two", {"three": [3]}, null, true]', [1, "two", {"three": [3]}, None, True]),
+    ('```json\n[{"a": "]},[{"}, {"b": "\\"x\\\\"}]\n```', [{"a": "]},[{"}, {"b": '"x\\'}]),
+    ('{"a": 1}\n{"b": [2]}\n', [{"a": 1}, {"b": [2]}]),
+    ("[]", []),
+    ("Here are the items [as requested]:\n[1,2]", [1, 2]),
+    ('Sure! {note} below:\n[{"a":1}]', [{"a": 1}]),
+    ('[{note}, {"a": 1}]', [{"a": 1}]),
+    ("no json at all", []),
+]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text, expected", JSON_CASES)
+def test_json_items(text, expected, chunk_size):
+    assert list(JSONItemParser().parse(chunked(text, chunk_size))) == expected
+
+
+def test_json_items_are_returned_as_soon_as_they_are_complete():
+    parser = JSONItemParser()
+    assert parser.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    assert parser.feed(": 2}, 3") == [{"b": 2}]
+    assert parser.feed("]") == [3]
+
+
+XML_CASES = [
+    ("<items><item>a</item><item>b</item></items>", {}, [("item", "a"), ("item", "b")]),
+    ("Sure:\n```xml\n<items><item>a</item></items>\n```\n<item>no</item>", {}, [("item", "a")]),
+    ("Note that 1 < 2. <items><item>a</item><item>b</item></items>", {}, [("item", "a"), ("item", "b")]),
+    ("x <- y, a<b\n<items><item>a</item></items>", {}, [("item", "a")]),
+    ("<items><item><name>a</name></item></items>", {"depth": 2}, [("name", "a")]),
+    ("<items><item>a</item></items>", {"depth": 0}, [("items", None)]),
+    ("<a>1</a>\n<b>2</b>", {"fragment": True}, [("a", "1"), ("b", "2")]),
+    ("1 < 2: <a>1</a>", {"fragment": True}, [("a", "1")]),
+    ("<items><item>a</item><item>b & c</item></items>", {}, [("item", "a")]),
+]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text, options, expected", XML_CASES)
+def test_xml_items(text, options, expected, chunk_size):
+    parser = XMLItemParser(**options)
+    assert [(element.tag, element.text) for element in parser.parse(chunked(text, chunk_size))] == expected
+    if not options.get("fragment", False):
+        assert parser.feed("<more/>") == []  # the document ended
+
+
+def test_xml_items_are_removed_from_the_tree():
+    parser = XMLItemParser()
+    items = parser.feed("<items><item>a</item><item>b</item>")
+    assert [item.text for item in items] == ["a", "b"]
+    assert len(parser._path[0]) == 0
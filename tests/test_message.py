@@ -0,0 +1,63 @@
+import copy
+import json
+import pickle
+from dataclasses import FrozenInstanceError, asdict, fields
+
+import pytest
+
+from llm_utils.openai_api.message import Message
+from llm_utils.openai_api.message_role import MessageRole
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.user_message import UserMessage
+from llm_utils.textgen_api.usage import UsageCall
+
+
+def message(*texts: str) -> Message:
+    return Message(role=MessageRole.USER, content=[TextMessageContent(text=text) for text in texts])
+
+
+def test_json_encoding_is_memoized_per_cache_flag():
+    msg = message("a", "b")
+    assert msg.to_json_bytes() is msg.to_json_bytes()
+    assert msg.to_json_bytes(cache=True) is not msg.to_json_bytes()
+    assert json.loads(msg.to_json_bytes(cache=True)) == msg.to_dict(cache=True)
+    assert msg.to_dict(cache=True)["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in msg.to_dict()["content"][-1]
+
+
+def test_modifying_the_dict_does_not_change_the_message():
+    msg = message("a", "b")
+    encoded = msg.to_json_bytes()
+    message_dict = msg.to_dict()
+    message_dict["content"][0]["text"] = "changed"
+    message_dict["role"] = "assistant"
+    assert msg.to_dict() == {"role": "user", "content": [{"type": "text", "text": "a"}, {"type": "text", "text": "b"}]}
+    assert msg.to_json_bytes() == encoded
+
+
+def test_single_text_content_is_flattened_without_cache():
+    assert message("a").to_dict() == {"role": "user", "content": "a"}
+    assert message("a").to_dict(cache=True)["content"] == [
+        {"type": "text", "text": "a", "cache_control": {"type": "ephemeral"}}
+    ]
+
+
+def test_messages_are_slotted_and_frozen():
+    msg = UserMessage(content=TextMessageContent(text="a"))
+    for instance, field in ((msg, "content"), (msg.content[0], "text"), (UsageCall(1, 0, 1, 0), "call_id")):
+        assert not hasattr(instance, "__dict__")
+        with pytest.raises(FrozenInstanceError):
+            setattr(instance, field, None)
+    assert isinstance(msg.content, tuple)
+    equal = UserMessage(content=[TextMessageContent(text="a")])
+    assert msg == equal and hash(msg) == hash(equal)
+
+
+def test_memo_is_neither_a_field_nor_copied():
+    msg = message("a")
+    msg.to_json_bytes()
+    assert [f.name for f in fields(msg)] == ["role", "content"]
+    assert asdict(msg) == asdict(message("a"))
+    for copied in (copy.copy(msg), pickle.loads(pickle.dumps(msg))):
+        assert copied == msg
+        assert copied.to_json_bytes() == msg.to_json_bytes()
@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+from llm_utils.textgen_api.call_metrics import CallMetrics
+from llm_utils.textgen_api.metrics_registry import Histogram, HistogramSnapshot, MetricsRegistry
+
+
+def snapshot_of(values, buckets=(1.0, 2.0, 4.0)) -> HistogramSnapshot:
+    histogram = Histogram(buckets)
+    for value in values:
+        histogram.observe(value)
+    return histogram.snapshot()
+
+
+def test_bucket_upper_bounds_are_inclusive():
+    snapshot = snapshot_of([0.5, 1.0, 1.5, 2.0, 4.0, 9.0])
+    assert snapshot.counts == (2, 4, 5, 6)
+    assert (snapshot.count, snapshot.sum) == (6, 18.0)
+
+
+def test_buckets_are_sorted():
+    assert Histogram((4.0, 1.0, 2.0)).buckets == (1.0, 2.0, 4.0)
+
+
+def test_quantiles_are_interpolated_within_their_bucket():
+    snapshot = snapshot_of([0.5, 0.5, 1.5, 1.5])
+    assert snapshot.quantile(0.0) == 0.0
+    assert snapshot.quantile(0.25) == pytest.approx(0.5)
+    assert snapshot.quantile(0.5) == pytest.approx(1.0)
+    assert snapshot.quantile(0.75) == pytest.approx(1.5)
+    assert snapshot.quantile(1.0) == pytest.approx(2.0)
+
+
+def test_quantile_in_the_inf_bucket_is_the_largest_bound():
+    assert snapshot_of([100.0]).quantile(0.5) == 4.0
+    assert snapshot_of([]).quantile(0.5) is None
+
+
+def test_merge_adds_counts_and_sums():
+    merged = snapshot_of([0.5, 3.0]).merge(snapshot_of([1.5, 9.0, 9.0]))
+    assert merged == snapshot_of([0.5, 3.0, 1.5, 9.0, 9.0])
+    assert merged.quantile(0.2) == pytest.approx(snapshot_of([0.5, 1.5, 3.0, 9.0, 9.0]).quantile(0.2))
+    with pytest.raises(ValueError):
+        merged.merge(snapshot_of([1.0], buckets=(1.0, 2.0)))
+
+
+def test_calls_are_counted_per_status():
+    registry = MetricsRegistry()
+    registry(CallMetrics(connection_id="a", latency=0.2, retries=2))
+    registry(CallMetrics(connection_id="a", success=False))
+    registry(CallMetrics(connection_id="a", from_cache=True, queue_wait=5.0))
+    registry(CallMetrics(connection_id="b", coalesced=True, latency=0.3))
+    assert registry.calls() == {("a", "success"): 1, ("a", "error"): 1, ("a", "cached"): 1, ("b", "coalesced"): 1}
+    snapshot = registry.snapshot()
+    assert snapshot["latency_seconds"]["a"].count == 1
+    assert snapshot["latency_seconds"]["b"].count == 1
+    # calls that sent no request do not count as waiting
+    assert snapshot["queue_wait_seconds"]["a"].count == 2
+    assert snapshot["queue_wait_seconds"]["a"].sum == 0.0
+    assert "b" not in snapshot["queue_wait_seconds"]
+    registry.reset()
+    assert registry.calls() == {} and registry.snapshot()["latency_seconds"] == {}
+
+
+def test_prometheus_text_format():
+    registry = MetricsRegistry(prefix="test")
+    registry(CallMetrics(connection_id='gpt "4"', latency=0.3, retries=1, request_bytes=300))
+    registry(CallMetrics(connection_id='gpt "4"', latency=200.0))
+    text = registry.to_prometheus()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert "# TYPE test_calls_total counter" in lines
+    assert 'test_calls_total{connection="gpt \\"4\\"",status="success"} 2' in lines
+    assert 'test_retries_total{connection="gpt \\"4\\""} 1' in lines
+    assert "# TYPE test_latency_seconds histogram" in lines
+    assert 'test_latency_seconds_bucket{connection="gpt \\"4\\"",le="0.25"} 0' in lines
+    assert 'test_latency_seconds_bucket{connection="gpt \\"4\\"",le="0.5"} 1' in lines
+    assert 'test_latency_seconds_bucket{connection="gpt \\"4\\"",le="120.0"} 1' in lines
+    assert 'test_latency_seconds_bucket{connection="gpt \\"4\\"",le="+Inf"} 2' in lines
+    assert 'test_latency_seconds_sum{connection="gpt \\"4\\""} 200.3' in lines
+    assert 'test_latency_seconds_count{connection="gpt \\"4\\""} 2' in lines
+    assert 'test_request_bytes_count{connection="gpt \\"4\\""} 1' in lines
+    # histograms without observations only have their HELP and TYPE lines
+    assert not any(line.startswith("test_response_bytes") for line in lines)
+    sample = re.compile(r'^[a-z_]+\{(\w+="(\\.|[^"\\])*",?)+\} (\d+(\.\d+)?|\+Inf)$')
+    assert all(line.startswith("# ") or sample.match(line) for line in lines)
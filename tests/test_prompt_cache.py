@@ -0,0 +1,135 @@
+import dataclasses
+import json
+
+import pytest
+
+from llm_utils.openai_api.assistant_message import AssistantMessage
+from llm_utils.openai_api.chat import Chat
+from llm_utils.openai_api.system_message import SystemMessage
+from llm_utils.openai_api.text_message_content import TextMessageContent
+from llm_utils.openai_api.user_message import UserMessage
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+from llm_utils.textgen_api.usage import Usage, UsageCall
+
+
+def chat(roles: str) -> Chat:
+    """Chat with a message per letter: s(ystem), u(ser) or a(ssistant)."""
+    message_types = {"s": SystemMessage, "u": UserMessage, "a": AssistantMessage}
+    return Chat(
+        messages=[
+            message_types[role](content=[TextMessageContent(text="%s%d" % (role, i))]) for i, role in enumerate(roles)
+        ]
+    )
+
+
+def flagged(roles: str, **kwargs) -> str:
+    return "".join(role.upper() if flag else role for role, flag in zip(roles, chat(roles).cache_flags(**kwargs)))
+
+
+@pytest.mark.parametrize(
+    "roles, expected",
+    [
+        ("", ""),
+        ("u", "U"),
+        ("s", "S"),
+        ("su", "SU"),
+        ("sua", "SUA"),
+        # the user messages that ended the previous turns, newest first
+        ("suaua", "SUaUA"),
+        ("suauaua", "SuaUaUA"),
+        ("suauauaua", "SuauaUaUA"),
+        ("uauauau", "UaUaUaU"),
+        # only the last of several user messages in a row ended the turn
+        ("suuaua", "SuUaUA"),
+        ("suauu", "SUauU"),
+    ],
+)
+def test_breakpoints_are_on_the_stable_prefix(roles, expected):
+    assert flagged(roles) == expected
+
+
+def test_breakpoints_are_limited():
+    assert flagged("suauaua", max_cache_breakpoints=2) == "SuauauA"
+    assert flagged("uauaua", max_cache_breakpoints=1) == "uauauA"
+    assert flagged("suaua", max_cache_breakpoints=0) == "suaua"
+    assert flagged("suaua", cache=False) == "suaua"
+
+
+def test_to_dict_sets_cache_control_on_the_flagged_messages():
+    messages = chat("suaua").to_dict(cache=True)
+    assert [("cache_control" in message["content"][-1]) for message in messages] == [True, True, False, True, True]
+    assert chat("suaua").to_dict() == [message.to_dict() for message in chat("suaua").messages]
+    assert json.loads(chat("suaua").to_json_bytes(cache=True, max_cache_breakpoints=2)) == chat("suaua").to_dict(
+        cache=True, max_cache_breakpoints=2
+    )
+
+
+def request_body(connection: TextGenLLMConnection, roles: str) -> dict:
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]))
+    data = api._build_request_data(chat(roles), connection, temperature=None, stream=False)
+    body = json.loads(api._encode_request_data(chat(roles), connection, data))
+    assert body == json.loads(json.dumps(data))
+    return body
+
+
+def n_breakpoints(value) -> int:
+    return json.dumps(value).count("cache_control")
+
+
+CONNECTION = TextGenLLMConnection.self_hosted("127.0.0.1", 1)
+CLAUDE = dataclasses.replace(CONNECTION, identifier="claude-test", path="v1/messages")
+
+
+def test_claude_system_prompt_takes_the_first_breakpoint():
+    body = request_body(CLAUDE, "suauaua")
+    assert body["system"] == [{"type": "text", "text": "s0", "cache_control": {"type": "ephemeral"}}]
+    assert [n_breakpoints(message) for message in body["messages"]] == [0, 0, 1, 0, 1, 1]
+    assert n_breakpoints(request_body(dataclasses.replace(CLAUDE, max_cache_breakpoints=2), "suauaua")) == 2
+
+
+def test_breakpoints_are_only_sent_to_claude_models():
+    assert n_breakpoints(request_body(CONNECTION, "suaua")) == 0
+    assert n_breakpoints(request_body(dataclasses.replace(CLAUDE, max_cache_breakpoints=0), "suaua")) == 0
+
+
+def test_anthropic_input_tokens_are_kept_as_reported():
+    usage = Usage()
+    usage.add_call(
+        {"input_tokens": 10, "cache_read_input_tokens": 60, "cache_creation_input_tokens": 30, "output_tokens": 5},
+        "a",
+    )
+    usage.add_call({"input_tokens": 10, "cache_read_input_tokens": None, "output_tokens": 5}, "b")
+    assert [(call.input_tokens, call.input_tokens_cached, call.input_tokens_total) for call in usage.calls] == [
+        (10, 60, 100),
+        (10, 0, None),
+    ]
+    assert Usage.from_json(json.loads(usage.to_dumps())).calls == usage.calls
+
+
+def test_prompt_cache_hit_rate_of_the_whole_prompt():
+    usage = Usage()
+    # Anthropic: the first call read 90 of its 100 prompt tokens from the cache, the second wrote 90 to it
+    usage.add_call({"input_tokens": 10, "cache_read_input_tokens": 90, "output_tokens": 5}, "a", connection_id="claude")
+    usage.add_call(
+        {"input_tokens": 10, "cache_creation_input_tokens": 90, "output_tokens": 5}, "b", connection_id="claude"
+    )
+    # OpenAI: prompt_tokens include the cached tokens
+    usage.add_call(
+        {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 25}, "completion_tokens": 5},
+        "c",
+        connection_id="gpt",
+    )
+    # served by the response cache, not by the provider
+    usage.add_call({"prompt_tokens": 100, "completion_tokens": 5}, "d", from_cache=True, connection_id="gpt")
+    assert usage.prompt_cache_hit_rate("claude") == pytest.approx(90 / 200)
+    assert usage.prompt_cache_hit_rate("gpt") == pytest.approx(25 / 100)
+    assert usage.prompt_cache_hit_rate() == pytest.approx(115 / 300)
+    assert usage.prompt_cache_hit_rates() == {"claude": pytest.approx(0.45), "gpt": pytest.approx(0.25)}
+    assert usage.prompt_cache_hit_rate("other") is None
+
+
+def test_hit_rate_of_calls_recorded_without_a_total():
+    usage = Usage(calls=[UsageCall(100, 40, 5, 0, connection_id="x")])
+    assert usage.prompt_cache_hit_rate("x") == pytest.approx(0.4)
@@ -0,0 +1,140 @@
+import random
+import re
+
+import pytest
+
+from llm_utils.prompt_generation.compiled_prompt import CompiledPrompt
+from llm_utils.prompt_generation.prompt import Prompt
+from llm_utils.prompt_generation.utils import join_indented, needle_pattern, replace_text, replace_texts
+
+TEMPLATE = """<data>
+    <message role='system'>
+        You are a helpful assistant specialized in {domain}.
+        Rules &amp; such:
+            - {rule}
+    </message>
+    <message role="user">{question}</message>
+    <user>
+        What is the weather like in {city} on {date}? {date}
+    </user>
+    <message role="assistant">
+        <content type="text">
+            Answer: {answer}
+        </content>
+    </message>
+</data>
+"""
+
+VALUES = [
+    "x",
+    " lead",
+    "\tx",
+    "",
+    "  ",
+    "a\nb",
+    "line1\n  line2\n",
+    "<tag> & 'q' \"d\"",
+    "multi\n\nblank",
+    "\n lead",
+    "a\r\nb",
+    "{city}",
+]
+
+
+def replace_sequentially(text: str, replacements: dict) -> str:
+    """Reference: `replace_text` applied to one occurrence after the other, from left to right."""
+    pattern = re.compile("|".join(map(re.escape, sorted(replacements, key=len, reverse=True))))
+    position = 0
+    while True:
+        match = pattern.search(text, position)
+        if match is None:
+            return text
+        rest = len(text) - match.end()
+        text = replace_text(text, match.span(), replacements[match.group()])
+        position = len(text) - rest
+
+
+def test_longest_needle_wins():
+    assert needle_pattern(("ab", "abc", "b")).findall("abcab b") == ["abc", "ab", "b"]
+    assert replace_texts("abc", {"ab": "1", "bc": "2"}) == "1c"
+    assert replace_texts("abc", {"b": "1", "abc": "2"}) == "2"
+
+
+def test_replacements_are_not_searched_again():
+    assert replace_texts("{a} {b}", {"{a}": "{b}", "{b}": "{a}"}) == "{b} {a}"
+
+
+def test_multi_line_replacement_is_indented_with_its_line_prefix():
+    text = "<list>\n    - {items}\n</list>"
+    assert (
+        replace_texts(text, {"{items}": "one\ntwo\n\nthree"}) == "<list>\n    - one\n    - two\n\n    - three\n</list>"
+    )
+    assert replace_texts(text, {"{items}": "one"}) == "<list>\n    - one\n</list>"
+
+
+def test_whitespace_only_replacement_drops_its_line_prefix():
+    # like `replace_text`, the prefix is moved into the replacement and `textwrap.indent` skips blank lines
+    assert join_indented(["a: ", " b"], ["  "]) == "   b"
+    assert replace_text("a: {x} b", "{x}", "  ") == "   b"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_single_pass_equals_sequential_replacement(seed):
+    rng = random.Random(seed)
+    pieces = ["a", " ", "\n", "\t", "{x}", "{y}", "{z}"]
+    values = ["", " ", "\n", "v", "v\nw", " \n", "\n ", "\t", "v\n", " v"]
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 10)))
+        replacements = {needle: rng.choice(values) for needle in ("{x}", "{y}", "{z}")}
+        assert replace_texts(text, replacements) == replace_sequentially(text, replacements)
+
+
+def test_whitespace_only_replacement_differs_from_needle_by_needle_replacement():
+    # Replacing `{y}` first drops the still unreplaced `{z}` along with the rest of the line prefix of the blank value.
+    # The single pass replaces the occurrences from left to right, so `{z}` is replaced before that.
+    text = "{z}{y}"
+    replacements = {"{y}": "\n", "{z}": "v\n"}
+    needle_by_needle = text
+    for needle, replacement in replacements.items():
+        needle_by_needle = replace_text(needle_by_needle, needle, replacement)
+    assert needle_by_needle == "\n"
+    assert replace_texts(text, replacements) == replace_sequentially(text, replacements) == "v\n\n"
+
+
+def assert_renders_like_prompt(template: str, values: dict):
+    prompt = Prompt(template)
+    prompt.replace_all(**values)
+    try:
+        expected = prompt.to_chat()
+    except Exception as e:  # e.g. a value that breaks up the markup
+        with pytest.raises(type(e)):
+            CompiledPrompt(template).render(**values)
+    else:
+        assert CompiledPrompt(template).render(**values) == expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_compiled_prompt_renders_like_prompt(seed):
+    rng = random.Random(seed)
+    assert CompiledPrompt(TEMPLATE)._messages is not None  # rendered on the parsed structure
+    for _ in range(300):
+        values = {name: rng.choice(VALUES) for name in ("domain", "rule", "question", "city", "date", "answer")}
+        assert_renders_like_prompt(TEMPLATE, values)
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        '<data><message role="{role}">hi</message></data>',  # placeholder in an attribute
+        "<data>\n    {markup}\n</data>",  # placeholder on a markup line
+        "<data><user>{text}</user><assistant> </assistant></data>",
+    ],
+)
+@pytest.mark.parametrize("value", ["user", "<user>a\nb</user>", "  "])
+def test_compiled_prompt_falls_back_to_parsing(template, value):
+    assert_renders_like_prompt(template, {name: value for name in ("role", "markup", "text")})
+
+
+def test_unknown_placeholders_are_kept():
+    prompt = "<data><user>{a} {b}</user></data>"
+    assert CompiledPrompt(prompt).render(a="x") == Prompt(prompt.replace("{a}", "x")).to_chat()
@@ -0,0 +1,168 @@
+import dataclasses
+import threading
+import time
+
+import pytest
+from conftest import CHAT, COMPLETION
+
+from llm_utils.textgen_api import rate_limiter
+from llm_utils.textgen_api.rate_limiter import RateLimiter, TokenBucket
+from llm_utils.textgen_api.retry_policy import RetryPolicy
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_unconfigured_bucket_never_blocks(clock):
+    bucket = TokenBucket()
+    assert [bucket.reserve(1000) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_reservations_queue_up_behind_each_other(clock):
+    bucket = TokenBucket.per_minute(60)
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_reservation_larger_than_the_capacity_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket.per_minute(60)
+    assert bucket.reserve(1000) == 0.0
+    assert bucket.reserve(1000) == pytest.approx(60.0)
+
+
+def test_seed_with_limit_and_reset_sets_the_refill_rate(clock):
+    bucket = TokenBucket()
+    bucket.seed(remaining=0, reset_in_seconds=10, limit=100)
+    assert (bucket.capacity, bucket.refill_per_second) == (100, 10.0)
+    assert bucket.reserve(20) == pytest.approx(2.0)
+
+
+def test_seed_without_limit_uses_the_largest_remaining_value(clock):
+    bucket = TokenBucket()
+    bucket.seed(remaining=50)
+    bucket.seed(remaining=30)
+    assert (bucket.capacity, bucket.level) == (50, 30)
+    assert not bucket.knows_refill_rate
+    # without a refill rate the bucket cannot tell how long to wait
+    assert bucket.reserve(40) == 0.0
+
+
+def test_rate_limited_waits_for_retry_after(clock):
+    limiter = RateLimiter(tokens_per_minute=600, requests_per_minute=60)
+    limiter.on_rate_limited(fallback_seconds=30, retry_after=5)
+    assert limiter.reserve(1) == pytest.approx(5.0)
+    clock.now += 5
+    # the emptied buckets refilled in the meantime
+    assert limiter.reserve(1) == 0.0
+
+
+def test_rate_limited_with_known_refill_rate_only_empties_the_buckets(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.on_rate_limited(fallback_seconds=30)
+    assert limiter.reserve(1) == pytest.approx(1.0)
+
+
+def test_rate_limited_without_refill_rate_waits_for_the_fallback(clock):
+    limiter = RateLimiter()
+    limiter.on_rate_limited(fallback_seconds=30)
+    assert limiter.reserve(1) == pytest.approx(30.0)
+    clock.now += 30
+    assert limiter.reserve(1) == 0.0
+
+
+def limited_connection(server):
+    return dataclasses.replace(
+        server.connection,
+        ratelimit_remaining_requests_key="x-ratelimit-remaining-requests",
+        ratelimit_reset_requests_key="x-ratelimit-reset-requests",
+        ratelimit_limit_requests_key="x-ratelimit-limit-requests",
+    )
+
+
+def test_rate_limit_headers_seed_the_buckets(scripted_server):
+    scripted_server.handler = lambda request: (
+        200,
+        COMPLETION,
+        {
+            "x-ratelimit-remaining-requests": "40",
+            "x-ratelimit-reset-requests": "20s",
+            "x-ratelimit-limit-requests": "100",
+        },
+    )
+    connection = limited_connection(scripted_server)
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]))
+    api.do_call(CHAT)
+    requests = api._get_rate_limiter(connection).requests
+    assert requests.capacity == 100
+    assert requests.level == pytest.approx(40, abs=1)
+    assert requests.refill_per_second == pytest.approx(3.0)
+
+
+def test_responses_without_rate_limit_headers_leave_the_buckets_unconfigured(scripted_server):
+    connection = limited_connection(scripted_server)
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]))
+    api.do_call(CHAT)
+    limiter = api._get_rate_limiter(connection)
+    assert (limiter.requests.level, limiter.tokens.level) == (None, None)
+    assert limiter.reserve(1000) == 0.0
+
+
+class FixedWindowLimit:
+    """Server side limit of `limit` requests per `window` seconds, answers 429 with the time until the next window."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.window_start = time.monotonic()
+        self.accepted = 0
+        self.rejected = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request: dict):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start += (now - self.window_start) // self.window * self.window
+                self._count = 0
+            if self._count >= self.limit:
+                self.rejected += 1
+                retry_after = self.window_start + self.window - now + 0.001  # not before the window ends
+                return 429, {"error": "rate limited"}, {"Retry-After": "%.3f" % retry_after}
+            self._count += 1
+            self.accepted += 1
+            headers = {"x-ratelimit-remaining-requests": str(self.limit - self._count)}
+            headers["x-ratelimit-limit-requests"] = str(self.limit)
+            return 200, COMPLETION, headers
+
+
+def test_rate_limited_requests_are_retried_after_the_window(scripted_server):
+    limit = FixedWindowLimit(limit=4, window=0.3)
+    scripted_server.handler = limit
+    connection = limited_connection(scripted_server)
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]), retry_policy=RetryPolicy(max_attempts=10))
+    start = time.monotonic()
+    results = api.do_batch([CHAT] * 16, max_concurrency=4)
+    assert all(result.ok for result in results)
+    assert limit.accepted == 16
+    # 16 requests at 4 per window cannot finish before the fourth window started
+    assert time.monotonic() - start >= 3 * limit.window
+    # a 429 holds back all callers until the window ends, so at most the 4 requests in flight are rejected per window
+    assert limit.rejected <= 3 * 4
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from conftest import CHAT
+
+from llm_utils.textgen_api import response_cache
+from llm_utils.textgen_api.response_cache import ResponseCache
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+MESSAGE = {"role": "assistant", "content": "hello"}
+USAGE = {"prompt_tokens": 3, "completion_tokens": 1}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock.time)
+    return clock
+
+
+def test_key_ignores_the_stream_flag_and_key_order():
+    assert ResponseCache.key({"model": "m", "seed": 0}) == ResponseCache.key({"seed": 0, "model": "m", "stream": True})
+    assert ResponseCache.key({"model": "m", "seed": 0}) != ResponseCache.key({"model": "m", "seed": 1})
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_entries_expire_after_the_ttl(tmp_path, clock, in_memory):
+    if in_memory:
+        cache = ResponseCache(ttl=60)
+    else:  # without the memory tier, so the entry is read from disk
+        cache = ResponseCache(path=str(tmp_path / "cache.sqlite"), ttl=60, memory_entries=0)
+    cache.put("key", MESSAGE, USAGE)
+    clock.now += 59
+    assert cache.get("key") == (MESSAGE, USAGE)
+    clock.now += 2
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entries_are_evicted_by_count(tmp_path, clock):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"), max_entries=2, memory_entries=0)
+    for key in ("a", "b"):
+        cache.put(key, MESSAGE, USAGE)
+        clock.now += 1
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    clock.now += 1
+    cache.put("c", MESSAGE, USAGE)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path, clock):
+    entry_size = len(json.dumps({"message": MESSAGE, "usage": USAGE}))
+    cache = ResponseCache(
+        path=str(tmp_path / "cache.sqlite"), max_entries=None, max_bytes=3 * entry_size, memory_entries=0
+    )
+    for key in ("a", "b", "c", "d"):
+        cache.put(key, MESSAGE, USAGE)
+        clock.now += 1
+    assert [cache.get(key) is not None for key in ("a", "b", "c", "d")] == [False, True, True, True]
+
+
+def test_memory_tier_is_bounded():
+    cache = ResponseCache(memory_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, MESSAGE, USAGE)
+    assert cache.get("a") is None
+    assert cache.get("c") == (MESSAGE, USAGE)
+
+
+def test_entries_persist_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path=path)
+    cache.put("key", MESSAGE, USAGE)
+    cache.close()
+    assert ResponseCache(path=path).get("key") == (MESSAGE, USAGE)
+    ResponseCache(path=path).clear()
+    assert ResponseCache(path=path).get("key") is None
+
+
+def test_hits_skip_the_request_and_are_counted(scripted_server, tmp_path):
+    connections = TextGenLLMConnections(connections=[scripted_server.connection])
+    path = str(tmp_path / "cache.sqlite")
+    api = TextGenApi(connections, seed=0, cache=ResponseCache(path))
+    first = api.do_call(CHAT, call_id="first")
+    second = api.do_call(CHAT, call_id="second")
+    assert second == first
+    assert len(scripted_server.requests) == 1
+    assert (api.usage.cache_hits, api.usage.cache_misses) == (1, 1)
+    assert [(call.call_id, call.from_cache) for call in api.usage.calls] == [("first", False), ("second", True)]
+    api.do_call(CHAT, temperature=0.5)
+    assert len(scripted_server.requests) == 2  # a different request is not served from the cache
+
+    # a new client reads the entries the previous one wrote
+    api = TextGenApi(connections, seed=0, cache=ResponseCache(path))
+    assert api.do_call(CHAT) == first
+    assert len(scripted_server.requests) == 2
+    assert api.usage.cache_hits == 1
@@ -0,0 +1,162 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import CHAT, stub_connection
+
+from llm_utils.textgen_api.single_flight import ChunkTee, SingleFlight
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+class Upstream:
+    def __init__(self, chunks, error=None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.pulled = 0
+        self.closed = False
+        self.released = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.pulled += 1
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def tee(self) -> ChunkTee:
+        return ChunkTee(iter(self), close=self.close, on_released=self.release)
+
+    def close(self):
+        self.closed = True
+
+    def release(self):
+        self.released = True
+
+
+def test_followers_join_the_flight_until_it_is_left():
+    flights = SingleFlight()
+    flight, leads = flights.join("key")
+    follower_flight, follower_leads = flights.join("key")
+    assert leads and not follower_leads and follower_flight is flight
+    assert flights.join("other")[1]
+    flights.leave(flight)
+    new_flight, new_leads = flights.join("key")
+    assert new_leads and new_flight is not flight
+    flights.leave(flight)  # leaving a finished flight does not end the new one
+    assert flights.join("key")[0] is new_flight
+
+
+def test_late_reader_receives_all_chunks():
+    upstream = Upstream([b"a", b"b", b"c"])
+    tee = upstream.tee()
+    first, close_first = tee.reader()
+    assert next(first) == b"a"
+    late, close_late = tee.reader()
+    assert list(first) == [b"b", b"c"]
+    assert list(late) == [b"a", b"b", b"c"]
+    assert upstream.pulled == 3 and upstream.released
+    close_first()
+    close_late()
+
+
+def test_early_close_keeps_the_upstream_for_the_other_readers():
+    upstream = Upstream([b"a", b"b", b"c"])
+    tee = upstream.tee()
+    first, close_first = tee.reader()
+    second, close_second = tee.reader()
+    assert next(first) == b"a"
+    close_first()
+    close_first()  # closing twice counts once
+    assert not upstream.closed
+    assert list(second) == [b"a", b"b", b"c"]
+    close_second()
+
+
+def test_abandoned_upstream_is_released_and_rejects_new_readers():
+    upstream = Upstream([b"a", b"b", b"c"])
+    tee = upstream.tee()
+    chunks, close = tee.reader()
+    assert next(chunks) == b"a"
+    close()
+    assert upstream.closed and upstream.released
+    assert tee.reader() is None
+
+
+def test_completed_upstream_still_serves_new_readers():
+    upstream = Upstream([b"a", b"b"])
+    tee = upstream.tee()
+    chunks, close = tee.reader()
+    assert list(chunks) == [b"a", b"b"]
+    close()
+    chunks, _ = tee.reader()
+    assert list(chunks) == [b"a", b"b"]
+
+
+def test_upstream_error_reaches_every_reader():
+    upstream = Upstream([b"a"], error=ConnectionError("lost"))
+    tee = upstream.tee()
+    first, _ = tee.reader()
+    second, _ = tee.reader()
+    with pytest.raises(ConnectionError):
+        list(first)
+    assert upstream.released
+    assert next(second) == b"a"
+    with pytest.raises(ConnectionError):
+        next(second)
+
+
+def test_concurrent_readers_pull_each_chunk_once():
+    upstream = Upstream([b"%d" % i for i in range(200)])
+    tee = upstream.tee()
+    readers = [tee.reader() for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda reader: list(reader[0]), readers))
+    assert all(result == upstream.chunks for result in results)
+    assert upstream.pulled == 200
+
+
+@pytest.mark.stub(latency=0.3, output_tokens=4)
+def test_identical_seeded_calls_share_one_request(stub_server):
+    api = TextGenApi(TextGenLLMConnections(connections=[stub_connection(stub_server)]), seed=0, coalesce=True)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        messages = list(executor.map(lambda i: api.do_call(CHAT, call_id="call-%d" % i), range(16)))
+    assert stub_server.n_requests == 1
+    assert all(message == messages[0] for message in messages)
+    assert api.usage.coalesced == 15
+    # every call id has its usage, the tokens are only recorded for the call that sent the request
+    assert sorted(call.call_id for call in api.usage.calls) == sorted("call-%d" % i for i in range(16))
+    assert sorted(call.output_tokens for call in api.usage.calls) == [0] * 15 + [4]
+
+
+@pytest.mark.stub(latency=0.1, tokens_per_second=5, output_tokens=4)
+@pytest.mark.parametrize("anthropic", [False, True])
+def test_identical_streams_share_one_request(stub_server, anthropic):
+    api = TextGenApi(
+        TextGenLLMConnections(connections=[stub_connection(stub_server, anthropic)]), seed=0, coalesce=True
+    )
+    barrier = threading.Barrier(4)
+
+    def read(i: int):
+        barrier.wait()
+        if i == 3:
+            time.sleep(0.4)  # joins after the first chunks were streamed
+        return api.stream_call(CHAT).read()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        messages = list(executor.map(read, range(4)))
+    assert stub_server.n_requests == 1
+    assert all(message.content[0].text == "tok0 tok1 tok2 tok3 " for message in messages)
+    assert sorted(call.output_tokens for call in api.usage.calls) == [0, 0, 0, 4]
+
+
+@pytest.mark.stub(latency=0.2, output_tokens=4)
+def test_unseeded_or_disabled_calls_are_not_coalesced(stub_server):
+    connections = TextGenLLMConnections(connections=[stub_connection(stub_server)])
+    for api in (TextGenApi(connections, seed=None, coalesce=True), TextGenApi(connections, seed=0)):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: api.do_call(CHAT), range(4)))
+        assert api.usage.coalesced == 0
+        assert [call.output_tokens for call in api.usage.calls] == [4] * 4
+    assert stub_server.n_requests == 8
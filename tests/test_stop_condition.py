@@ -0,0 +1,85 @@
+import json
+import time
+
+import pytest
+from conftest import CHAT, stub_connection
+
+from llm_utils.textgen_api.sse_parser import SSEParser
+from llm_utils.textgen_api.stop_condition import StopCondition
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+from llm_utils.textgen_api.textgen_stream import TextGenStream
+
+TEXT = "The answer is 42.\n\nDone. </answer> trailing text"
+
+
+def split(text: str, size: int):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def sse_stream(deltas, stop: StopCondition) -> TextGenStream:
+    chunks = [b"data: %s\n\n" % json.dumps({"choices": [{"delta": {"content": delta}}]}).encode() for delta in deltas]
+    return TextGenStream(chunks=iter(chunks + [b"data: [DONE]\n\n"]), parser=SSEParser(anthropic=False), stop=stop)
+
+
+CASES = [
+    (StopCondition(stop=["</answer>"]), "The answer is 42.\n\nDone. </answer>"),
+    (StopCondition(stop=["</answer>"], include_match=False), "The answer is 42.\n\nDone. "),
+    (StopCondition(stop=["nope", "42"], include_match=False), "The answer is "),
+    (StopCondition(pattern=r"\n\n"), "The answer is 42.\n\n"),
+    (StopCondition(pattern=r"\d+\.", include_match=False), "The answer is "),
+    (StopCondition(pattern=r"(?m)^Done", include_match=False), "The answer is 42.\n\n"),
+    (StopCondition(max_chars=10), "The answer"),
+    (StopCondition(stop=["nope"], pattern=r"xyz"), TEXT),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, len(TEXT)])
+@pytest.mark.parametrize("condition, expected", CASES)
+def test_stream_is_cut_where_the_condition_is_met(condition, expected, chunk_size):
+    stream = sse_stream(split(TEXT, chunk_size), condition)
+    chunks = list(stream)
+    assert stream.message.content[0].text == expected
+    # the caller never sees text that is not part of the message
+    assert "".join(chunks) == expected
+    assert stream.stopped == (expected != TEXT)
+
+
+def test_text_that_may_start_a_match_is_held_back():
+    matcher = StopCondition(stop=["abc"], include_match=False).matcher()
+    assert matcher.feed("xa") is None and matcher.pending() == 1
+    assert matcher.feed("b") is None and matcher.pending() == 2
+    assert matcher.feed("x") is None and matcher.pending() == 0
+    stream = sse_stream(["a", "b", "x", "a", "c"], StopCondition(stop=["abc"], include_match=False))
+    assert list(stream) == ["a", "b", "x", "a", "c"]
+    stream = sse_stream(["x", "a", "b", "c"], StopCondition(stop=["abc"], include_match=False))
+    assert list(stream) == ["x"]
+    assert stream.message.content[0].text == "x"
+
+
+def test_predicate_is_checked_once_per_chunk():
+    condition = StopCondition(predicate=lambda text: "Done" in text)
+    assert sse_stream(split(TEXT, 1), condition).read().content[0].text == "The answer is 42.\n\nDone"
+    assert sse_stream(split(TEXT, 3), condition).read().content[0].text == "The answer is 42.\n\nDone."
+
+
+def test_matcher_only_searches_the_end_of_the_text():
+    condition = StopCondition(stop=["</answer>"], pattern=r"\n\n\n")
+    matcher = condition.matcher()
+    started = time.perf_counter()
+    for _ in range(100_000):
+        assert matcher.feed("tok ") is None
+    assert time.perf_counter() - started < 5
+    assert matcher.feed("</ans") is None
+    assert matcher.feed("wer>") == 400_009
+
+
+@pytest.mark.stub(output_tokens=50)
+def test_stopped_openai_stream_records_estimated_usage(stub_server):
+    api = TextGenApi(TextGenLLMConnections(connections=[stub_connection(stub_server)]))
+    stream = api.stream_call(CHAT, stop=StopCondition(stop=["tok2 "]))
+    assert stream.read().content[0].text == "tok0 tok1 tok2 "
+    assert stream.stopped
+    assert len(api.usage.calls) == 1
+    assert api.usage.calls[0].input_tokens > 0
+    assert api.usage.calls[0].output_tokens > 0
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from conftest import CHAT, stub_connection
+
+from llm_utils.textgen_api.textgen_api import TextGenApi
+from llm_utils.textgen_api.textgen_api_connection import TextGenLLMConnection
+from llm_utils.textgen_api.textgen_api_connections import TextGenLLMConnections
+
+
+@pytest.mark.parametrize("anthropic", [False, True])
+@pytest.mark.stub(output_tokens=8)
+def test_stream_records_usage(stub_server, anthropic):
+    api = TextGenApi(TextGenLLMConnections(connections=[stub_connection(stub_server, anthropic)]))
+    stream = api.stream_call(CHAT, call_id="streamed")
+    assert "".join(stream) == "".join("tok%d " % i for i in range(8))
+    assert stream.message.content[0].text == "".join("tok%d " % i for i in range(8))
+    assert len(api.usage.calls) == 1
+    assert api.usage.calls[0].call_id == "streamed"
+    assert api.usage.calls[0].output_tokens == 8
+
+
+@pytest.mark.stub(output_tokens=8)
+def test_async_stream_records_usage(stub_server):
+    api = TextGenApi(TextGenLLMConnections(connections=[stub_connection(stub_server)]))
+
+    async def main():
+        try:
+            return await api.astream(CHAT).read()
+        finally:
+            await api.aclose()
+
+    assert asyncio.run(main()).content[0].text.startswith("tok0 ")
+    assert api.usage.calls[0].output_tokens == 8
+
+
+def test_openai_streams_ask_for_usage():
+    connection = TextGenLLMConnection.self_hosted("127.0.0.1", 8000)
+    api = TextGenApi(TextGenLLMConnections(connections=[connection]))
+    data = api._build_request_data(CHAT, connection, temperature=None, stream=True)
+    assert data["stream_options"] == {"include_usage": True}
+    assert "stream_options" not in api._build_request_data(CHAT, connection, temperature=None, stream=False)
@@ -0,0 +1,45 @@
+import pytest
+
+from llm_utils.textgen_api.token_counter import TokenCounter
+
+
+class _Encoding:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return text.split()
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    import tiktoken
+
+    encoding = _Encoding()
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    return TokenCounter("cl100k_base", max_entries=2)
+
+
+def test_counts_are_cached(counter):
+    assert counter.count(["a b", "c", "a b"]) == [2, 1, 2]
+    assert counter.count(["a b", "c"]) == [2, 1]
+    assert counter.encoding.encoded == ["a b", "c", "a b"]
+
+
+def test_cache_does_not_keep_texts(counter):
+    text = "word " * 10_000
+    counter.count([text])
+    assert all(len(key) == 16 for key in counter._counts)
+
+
+def test_least_recently_used_count_is_evicted(counter):
+    counter.count(["a", "b"])
+    counter.count(["a"])
+    counter.count(["c"])
+    counter.encoding.encoded.clear()
+    assert counter.count(["a", "b"]) == [1, 1]
+    assert counter.encoding.encoded == ["b"]
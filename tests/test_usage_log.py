@@ -0,0 +1,52 @@
+import gc
+import time
+import weakref
+
+from llm_utils.textgen_api.usage import UsageCall
+from llm_utils.textgen_api.usage_log import UsageLog
+
+
+def make_call(call_id: str) -> UsageCall:
+    return UsageCall(input_tokens=3, input_tokens_cached=0, output_tokens=1, output_tokens_cached=0, call_id=call_id)
+
+
+def call_ids(path) -> list:
+    return [record["call_id"] for record in UsageLog.iter_records(str(path))]
+
+
+def test_flushes_after_flush_every_records(tmp_path):
+    log = UsageLog(str(tmp_path / "usage.jsonl"), flush_every=2, flush_interval=60)
+    log.append(make_call("a"))
+    assert call_ids(log.path) == []
+    log.append(make_call("b"))
+    assert call_ids(log.path) == ["a", "b"]
+
+
+def test_flushes_after_flush_interval_without_further_records(tmp_path):
+    log = UsageLog(str(tmp_path / "usage.jsonl"), flush_interval=0.05)
+    log.append(make_call("a"))
+    deadline = time.monotonic() + 5
+    while call_ids(log.path) == [] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert call_ids(log.path) == ["a"]
+
+
+def test_pending_records_are_written_when_the_log_is_collected(tmp_path):
+    path = tmp_path / "usage.jsonl"
+    log = UsageLog(str(path), flush_interval=60)
+    log.append(make_call("a"))
+    log_ref = weakref.ref(log)
+    del log
+    gc.collect()
+    assert log_ref() is None
+    assert call_ids(path) == ["a"]
+
+
+def test_close_writes_pending_records(tmp_path):
+    log = UsageLog(str(tmp_path / "usage.jsonl"), flush_interval=60)
+    log.append(make_call("a"))
+    log.close()
+    assert call_ids(log.path) == ["a"]
+    log.append(make_call("b"))
+    log.close()
+    assert call_ids(log.path) == ["a", "b"]